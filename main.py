@@ -1,31 +1,34 @@
-try:
-    import sys
-    from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, 
-                                QPushButton, QLabel, QVBoxLayout)
-    import teacher_doc_generator
-except ImportError as e:
-    print(f"無法引入必要模組：{str(e)}")
-    print("正在嘗試重新安裝 PyQt6...")
-    import subprocess
-    try:
-        # 先移除現有的 PyQt6
-        subprocess.run([sys.executable, "-m", "pip", "uninstall", "-y", "PyQt6", "PyQt6-Qt6", "PyQt6-sip"])
-        # 重新安裝 PyQt6
-        subprocess.run([sys.executable, "-m", "pip", "install", "--no-cache-dir", "PyQt6"])
-        
-        # 再次嘗試引入
-        from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, 
-                                   QPushButton, QLabel, QVBoxLayout)
-    except Exception as install_error:
-        print(f"安裝失敗：{str(install_error)}")
-        sys.exit(1)
+import sys
+import time
+import multiprocessing
 
 if __name__ == "__main__":
+    # 打包成執行檔後，批次產生的子行程需要這個呼叫才能正常啟動
+    multiprocessing.freeze_support()
+    
+    # 介面模組在這裡才載入，批次產生的子行程不會載入 PyQt6
+    start = time.perf_counter()
     try:
+        from PyQt6.QtWidgets import QApplication
+        qt_loaded = time.perf_counter()
+        import teacher_doc_generator
+    except ImportError as e:
+        print(f"無法引入必要模組：{str(e)}")
+        print("請執行 pip install -r requirements.txt 安裝所需套件")
+        sys.exit(1)
+    
+    try:
+        # 記錄載入模組、建立視窗到第一次繪製的時間
+        timer = teacher_doc_generator.StartupTimer(start)
+        timer.mark('載入 PyQt6', qt_loaded)
+        timer.mark('載入 teacher_doc_generator')
         app = QApplication(sys.argv)
+        timer.mark('建立 QApplication')
         window = teacher_doc_generator.TeacherDocApp()
+        timer.mark('建立視窗')
+        teacher_doc_generator.FirstPaintReporter(window, timer)
         window.show()
         sys.exit(app.exec())
     except Exception as e:
         print(f"程式執行錯誤：{str(e)}")
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,245 @@
+# 教師資料文件產生器的命令列介面，不需要圖形介面即可同步資料和產生文件
+# 用法：
+#   python teacher_doc_cli.py sync --login-code 代碼
+#   python teacher_doc_cli.py generate --template 範本.docx --course 3D筆 --teacher 顏建杰 [--output 輸出.docx]
+#   python teacher_doc_cli.py batch --template 範本.docx [--course 3D筆]
+#   python teacher_doc_cli.py bench --template 範本.odt --course 3D筆 --teacher 顏建杰
+#   python teacher_doc_cli.py bench --template 範本.docx --course 3D筆 --workers 4
+#   python teacher_doc_cli.py startup [--budget-ms 800]
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+
+import teacher_doc_core as core
+
+def positive_int(value):
+    # argparse 的 type：只接受 1 以上的整數，錯誤時由 argparse 顯示用法
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"必須是整數：{value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必須大於 0：{value}")
+    return number
+
+def create_managers(args):
+    teacher_manager = core.TeacherDataManager(compact=args.compact, backend=args.backend)
+    course_manager = core.CourseDataManager(compact=args.compact, backend=args.backend)
+    return teacher_manager, course_manager
+
+def find_course(course_manager, course_type):
+    # 與介面相同：同一個課程分類使用最後一筆課程
+    courses = course_manager.find_by_course_type(course_type)
+    if not courses:
+        raise ValueError(f"找不到課程分類：{course_type}")
+    return courses[-1]
+
+def find_teacher(teacher_manager, teacher):
+    # 可以用教師 ID 或姓名指定
+    if teacher in teacher_manager.teachers:
+        return teacher, teacher_manager.teachers[teacher]
+    matches = teacher_manager.find_by_name(teacher)
+    if not matches:
+        raise ValueError(f"找不到教師：{teacher}")
+    if len(matches) > 1:
+        raise ValueError(f"有 {len(matches)} 位教師名為 {teacher}，請改用教師 ID：{', '.join(str(teacher_id) for teacher_id, _ in matches)}")
+    return matches[0]
+
+def cmd_sync(args):
+    login_code = args.login_code or os.getenv('TEACHERDOC_LOGIN_CODE')
+    if not login_code:
+        print("請以 --login-code 或環境變數 TEACHERDOC_LOGIN_CODE 指定登入碼")
+        return 2
+    
+    creds = core.get_service_account_creds()
+    teacher_manager, course_manager = create_managers(args)
+    os.makedirs('images/teachers', exist_ok=True)
+    os.makedirs('images/courses', exist_ok=True)
+    
+    result = core.login_and_sync(
+        creds,
+        login_code,
+        teacher_manager,
+        course_manager,
+        download_workers=args.download_workers,
+        incremental=not args.full,
+        force=args.force,
+        thumbnails=not args.originals
+    )
+    if not result['is_valid']:
+        print("登入碼無效")
+        return 1
+    if result['errors']:
+        print("更新失敗：" + "\n".join(result['errors']))
+        return 1
+    if not result['need_update']:
+        print("資料已是最新，不需要同步")
+    else:
+        print(f"同步完成：{len(teacher_manager.teachers)} 位教師，{len(course_manager.courses)} 筆課程")
+    return 0
+
+def cmd_generate(args):
+    teacher_manager, course_manager = create_managers(args)
+    course_id, course_data = find_course(course_manager, args.course)
+    teacher_id, teacher_data = find_teacher(teacher_manager, args.teacher)
+    
+    start = time.perf_counter()
+    processor = core.DocumentProcessor(args.template)
+    output_path = processor.process_document(
+        core.merge_records(teacher_data, course_data),
+        args.output or core.output_path_for(args.template, teacher_data, course_data)
+    )
+    print(f"文件產生完成（{time.perf_counter() - start:.1f} 秒）：{output_path}")
+    return 0
+
+def cmd_batch(args):
+    teacher_manager, course_manager = create_managers(args)
+    if args.course:
+        course_choices = [(args.course, find_course(course_manager, args.course)[0])]
+    else:
+        course_choices = course_manager.course_type_choices()
+    
+    items = core.build_batch_items(teacher_manager, course_manager, course_choices, args.template)
+    if not items:
+        print("沒有符合的教師")
+        return 1
+    
+    print(f"批次產生 {len(items)} 份文件...")
+    renderer = core.ParallelRenderer(
+        workers=args.workers,
+        progress_callback=lambda completed, total, label: print(f"已產生 {completed}/{total}：{label}")
+    )
+    summary = renderer.render(args.template, items)
+    print(f"批次產生完成：成功 {summary['succeeded']} 份，失敗 {len(summary['failed'])} 份，"
+          f"耗時 {summary['elapsed']:.1f} 秒（每分鐘 {summary['per_minute']:.1f} 份），"
+          f"{summary['workers']} 個行程")
+    for label, error in summary['failed']:
+        print(f"  失敗：{label}：{error}")
+    return 1 if summary['failed'] else 0
+
+def cmd_bench(args):
+    teacher_manager, course_manager = create_managers(args)
+    course_id, course_data = find_course(course_manager, args.course)
+    
+    # 指定 --workers 時以課程分類的所有教師比較逐份產生和平行產生
+    if args.workers:
+        items = core.build_batch_items(teacher_manager, course_manager, [(args.course, course_id)], args.template)
+        if not items:
+            print("沒有符合的教師")
+            return 1
+        core.benchmark_batch(args.template, items, args.workers)
+        return 0
+    
+    if not args.teacher:
+        print("請以 --teacher 指定教師，或以 --workers 比較批次產生")
+        return 2
+    teacher_id, teacher_data = find_teacher(teacher_manager, args.teacher)
+    data = core.merge_records(teacher_data, course_data)
+    
+    # .odt 範本比較直接處理和 LibreOffice 轉檔；其他範本只測量產生時間
+    if os.path.splitext(args.template)[1].lower() == '.odt':
+        core.benchmark_odt(args.template, data, runs=args.runs)
+        return 0
+    
+    # 在暫存資料夾中產生，避免覆寫範本資料夾中的文件
+    work_dir = tempfile.mkdtemp()
+    try:
+        work_template = os.path.join(work_dir, os.path.basename(args.template))
+        shutil.copy(args.template, work_template)
+        processor = core.DocumentProcessor(work_template, image_cache={})
+        timings = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            processor.process_document(data)
+            timings.append(time.perf_counter() - start)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(f"產生時間（{args.runs} 次）：第一次 {timings[0] * 1000:.0f} ms，"
+          f"最快 {min(timings) * 1000:.0f} ms，平均 {sum(timings) / len(timings) * 1000:.0f} ms")
+    return 0
+
+def cmd_startup(args):
+    # 列出各套件的載入時間；載入介面模組超過預算時回傳 1
+    results = core.measure_import_times()
+    print("載入時間：")
+    for module, seconds in results.items():
+        print(f"  {module}：{'無法載入' if seconds is None else f'{seconds * 1000:.0f} ms'}")
+    
+    if args.budget_ms is not None:
+        seconds = results.get('teacher_doc_generator')
+        if seconds is None or seconds * 1000 > args.budget_ms:
+            print(f"超過啟動時間預算 {args.budget_ms} ms")
+            return 1
+        print(f"在啟動時間預算 {args.budget_ms} ms 內")
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="教師資料文件產生器（命令列）")
+    parser.add_argument('--data-dir', help="資料檔和照片所在的資料夾（預設為目前資料夾）")
+    parser.add_argument('--backend', default=os.getenv('TEACHERDOC_BACKEND', 'json'), choices=['json', 'sqlite'],
+                        help="資料儲存方式")
+    parser.add_argument('--compact', action='store_true', help="資料檔使用不縮排的精簡格式")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    sync_parser = subparsers.add_parser('sync', help="驗證登入碼並同步師資、課程資料和照片")
+    sync_parser.add_argument('--login-code', help="登入碼（或使用環境變數 TEACHERDOC_LOGIN_CODE）")
+    sync_parser.add_argument('--full', action='store_true', help="重新處理所有資料，不只處理有變動的列")
+    sync_parser.add_argument('--force', action='store_true', help="不論試算表和照片是否變動都進行同步，並重新檢查所有照片")
+    sync_parser.add_argument('--download-workers', type=positive_int, default=8, help="同時下載照片的連線數")
+    sync_parser.add_argument('--originals', action='store_true', help="大頭照和課程照片也下載原始檔，不使用 Drive 縮圖")
+    sync_parser.set_defaults(func=cmd_sync)
+    
+    generate_parser = subparsers.add_parser('generate', help="產生一份文件")
+    generate_parser.add_argument('--template', required=True, help="範本檔案（.docx、.doc 或 .odt）")
+    generate_parser.add_argument('--course', required=True, help="課程分類")
+    generate_parser.add_argument('--teacher', required=True, help="教師 ID 或姓名")
+    generate_parser.add_argument('--output', help="輸出檔案（預設放在範本的資料夾，副檔名依範本格式）")
+    generate_parser.set_defaults(func=cmd_generate)
+    
+    batch_parser = subparsers.add_parser('batch', help="為課程分類的所有教師產生文件")
+    batch_parser.add_argument('--template', required=True, help="範本檔案（.docx、.doc 或 .odt）")
+    batch_parser.add_argument('--course', help="課程分類（預設為所有課程）")
+    batch_parser.add_argument('--workers', type=positive_int,
+                              default=int(os.getenv('TEACHERDOC_RENDER_WORKERS', os.cpu_count() or 1)),
+                              help="產生文件的行程數")
+    batch_parser.set_defaults(func=cmd_batch)
+    
+    bench_parser = subparsers.add_parser('bench', help="測量產生文件的時間（.odt 範本會和 LibreOffice 轉檔比較）")
+    bench_parser.add_argument('--template', required=True, help="範本檔案")
+    bench_parser.add_argument('--course', required=True, help="課程分類")
+    bench_parser.add_argument('--teacher', help="教師 ID 或姓名（測量單份文件時需要）")
+    bench_parser.add_argument('--runs', type=positive_int, default=3, help="重複次數")
+    bench_parser.add_argument('--workers', type=positive_int,
+                              help="比較課程分類所有教師的批次產生：逐份產生和使用這個數量的行程各執行一次")
+    bench_parser.set_defaults(func=cmd_bench)
+    
+    startup_parser = subparsers.add_parser('startup', help="測量各套件的載入時間")
+    startup_parser.add_argument('--budget-ms', type=int, help="載入介面模組的時間上限（毫秒），超過時回傳錯誤")
+    startup_parser.set_defaults(func=cmd_startup)
+    return parser
+
+def main(argv=None):
+    # 批次產生的子行程需要這個呼叫才能在打包後的執行檔中啟動
+    multiprocessing.freeze_support()
+    
+    args = build_parser().parse_args(argv)
+    # 範本和輸出路徑以目前資料夾為準，再切換到資料夾
+    if getattr(args, 'template', None):
+        args.template = os.path.abspath(args.template)
+    if getattr(args, 'output', None):
+        args.output = os.path.abspath(args.output)
+    if args.data_dir:
+        os.chdir(args.data_dir)
+    
+    try:
+        return args.func(args)
+    except Exception as e:
+        print(f"執行失敗：{str(e)}")
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
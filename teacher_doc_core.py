@@ -0,0 +1,3276 @@
+# 教師資料文件產生器的核心功能：登入、同步資料和產生文件
+# 這個模組不使用 PyQt6，圖形介面（teacher_doc_generator.py）和命令列（teacher_doc_cli.py）共用
+# python-docx、odfpy、Pillow、Google API 和 Word COM 載入較慢或只在 Windows 上有，
+# 都在用到的函式中才載入，開啟程式時不需等待
+import mimetypes
+import os
+import sys
+import re
+import json
+import hashlib
+import importlib.util
+import tempfile
+import sqlite3
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from datetime import datetime
+import shutil
+import io
+import time
+import random
+import threading
+import queue
+import multiprocessing
+import atexit
+import socket
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# 修改教師標記定義
+TEACHER_TAGS = [
+    ("姓名", "@name"),
+    ("綽號", "@nickname"),
+    ("大頭照", "@photo"),
+    ("申請單位", "@unit"),
+    ("出生日期", "@birth"),
+    ("性別", "@gender"),
+    ("手機", "@mobile"),
+    ("身分證字號", "@idno"),
+    ("通訊地址", "@address"),
+    ("Email", "@email"),
+    ("Line ID", "@line"),
+    ("專長", "@skill"),
+    ("最高學歷", "@education"),
+    ("現職", "@job"),
+    ("教學經驗（年）", "@experience"),
+    ("經歷", "@history"),
+    ("身分證正面（照片）", "@id_front"),
+    ("身分證反面（照片）", "@id_back"),
+    ("畢業證書（照片）", "@diploma"),
+    ("其他（良民證、比賽等）", "@other_certs")
+]
+
+# 修改課程標記定義，分成三個區塊
+COURSE_TAGS = [
+    ("社團名稱", "@course_name"),
+    ("課程介紹", "@intro"),
+    ("教學目標", "@target"),
+    ("材料費", "@material_fee"),
+    ("材料內容", "@reason"),     
+    ("課程主題（表格）", "@course_topic"),       
+    ("課程內容（表格）", "@content"),
+    ("課程照片（表格照片）", "@photos")
+]
+
+# 新增報價單標記區塊
+PRICE_LIST_TAGS = [
+    ("品名（表格）", "@price_list_name"),
+    ("單位（表格）", "@price_list_unit"),
+    ("數量（表格）", "@price_list_quantity"),
+    ("單價（表格）", "@price_list_price"),
+    ("預計金額（表格）", "@price_list_amount"),
+    ("用途說明（表格）", "@price_list_usage"),
+    ("公司存摺（照片）", "@bank_account")
+]
+
+# 表格標記：標記所在的儲存格為起點，往下填入多列資料
+TABLE_MARKERS = ('@content', '@course_topic', '@price_list_table', '@photos')
+
+# OpenDocument 的命名空間（與 odf.namespaces 相同），直接寫出以免載入本模組時就載入 odfpy
+TEXTNS = 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+TABLENS = 'urn:oasis:names:tc:opendocument:xmlns:table:1.0'
+DRAWNS = 'urn:oasis:names:tc:opendocument:xmlns:drawing:1.0'
+
+# 單張照片與多張照片的欄位
+IMAGE_FIELDS = ('photo', 'id_front', 'id_back', 'diploma', 'bank_account')
+MULTI_IMAGE_FIELDS = ('other_certs',)
+
+# 同步時可以下載 Drive 縮圖的照片欄位（大頭照、課程照片只以 2 吋顯示）；
+# 身分證、畢業證書、存摺和其他證明要保持清晰可辨識，一律下載原始檔
+THUMBNAIL_FIELDS = ('photo', 'photos')
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
+
+# 報價單表格由上往下依序填入的欄位
+PRICE_LIST_FIELDS = [
+    ('price_list_name', '品項'),
+    ('price_list_unit', '單位'),
+    ('price_list_quantity', '數量'),
+    ('price_list_price', '單價'),
+    ('price_list_amount', '預計金額'),
+    ('price_list_usage', '用途說明')
+]
+
+def build_marker_pattern(markers):
+    # 依長度由長到短排列，讓 @photos 不會被 @photo 先比對到；
+    # 標記後面不能再接英數字或底線，避免比對到其他標記的前半段
+    alternatives = sorted(set(markers), key=len, reverse=True)
+    return re.compile('(' + '|'.join(re.escape(marker) for marker in alternatives) + ')(?![A-Za-z0-9_])')
+
+MARKER_PATTERN = build_marker_pattern(
+    [tag for _, tag in TEACHER_TAGS + COURSE_TAGS + PRICE_LIST_TAGS] + list(TABLE_MARKERS)
+)
+
+class GoogleClientFactory:
+    # 同一次登入和同步共用的 Google API 服務物件：
+    # 探索文件使用 googleapiclient 內建的版本，只解析一次，不需連網下載；
+    # 每個服務物件各自保留一條持續連線的 HTTP 連線，之後的請求不需重新連線
+    def __init__(self, creds, timeout=120):
+        self.creds = creds
+        self.timeout = timeout
+        self.documents = {}
+        self.services = {}
+        # 平行下載用的服務物件，用完放回池中給之後的下載重複使用
+        self.pools = {}
+        self.lock = threading.RLock()
+        self.build_count = 0
+    
+    def _document(self, name, version):
+        key = (name, version)
+        document = self.documents.get(key)
+        if document is None:
+            from googleapiclient.discovery_cache import get_static_doc
+            content = get_static_doc(name, version)
+            if content is None:
+                raise ValueError(f"找不到 {name} {version} 的探索文件")
+            document = json.loads(content)
+            self.documents[key] = document
+        return document
+    
+    def _http(self):
+        import httplib2
+        import google_auth_httplib2
+        return google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http(timeout=self.timeout))
+    
+    def _build(self, name, version):
+        from googleapiclient.discovery import build_from_document
+        with self.lock:
+            document = self._document(name, version)
+            self.build_count += 1
+        return build_from_document(document, http=self._http())
+    
+    def get(self, name, version):
+        # 依序呼叫的地方（登入、讀取試算表、列出照片資料夾）共用同一個服務物件
+        with self.lock:
+            service = self.services.get((name, version))
+            if service is None:
+                service = self._build(name, version)
+                self.services[(name, version)] = service
+            return service
+    
+    @contextmanager
+    def _lease(self, key, create):
+        with self.lock:
+            pool = self.pools.setdefault(key, [])
+            item = pool.pop() if pool else None
+        if item is None:
+            item = create()
+        try:
+            yield item
+        finally:
+            with self.lock:
+                pool.append(item)
+    
+    def lease(self, name, version):
+        # httplib2 的連線不是執行緒安全的，平行下載時每個執行緒借用一個服務物件，同一時間只有一個執行緒使用
+        return self._lease((name, version), lambda: self._build(name, version))
+    
+    def lease_http(self):
+        # 直接下載網址（例如 Drive 縮圖）用的授權 HTTP 連線，同樣每個執行緒借用一條
+        return self._lease('http', self._http)
+    
+    def sheets(self):
+        return self.get('sheets', 'v4')
+    
+    def drive(self):
+        return self.get('drive', 'v3')
+
+class LoginManager:
+    # 登入時一次讀取的範圍：登入表，以及需要同步時使用的師資和課程資料
+    LOGIN_RANGE = 'login!A:C'
+    TEACHER_RANGE = '師資!A2:V'
+    COURSE_RANGE = '課程!A2:P'
+    
+    def __init__(self, creds, clients=None):
+        self.SPREADSHEET_ID = '171kBtkTN5LUTNVMkCEhJ-L-l4xh7Wj9sJE76W0HmZ9w'
+        self.creds = creds
+        self.clients = clients or GoogleClientFactory(creds)
+        self.service = self.clients.sheets()
+        # 登入時讀到的各範圍資料，同步時直接沿用
+        self.sheet_values = {}
+        self.user_region = None
+        # 各階段耗時（秒）
+        self.timings = {}
+    
+    def verify_login(self, login_code):
+        try:
+            self.timings = {}
+            
+            # 一次讀取登入表（A:C）和師資、課程資料
+            start = time.perf_counter()
+            ranges = [self.LOGIN_RANGE, self.TEACHER_RANGE, self.COURSE_RANGE]
+            result = self.service.spreadsheets().values().batchGet(
+                spreadsheetId=self.SPREADSHEET_ID,
+                ranges=ranges
+            ).execute()
+            value_ranges = result.get('valueRanges', [])
+            self.sheet_values = {
+                range_name: (value_ranges[i].get('values', []) if i < len(value_ranges) else [])
+                for i, range_name in enumerate(ranges)
+            }
+            self.timings['讀取試算表'] = time.perf_counter() - start
+            
+            login_rows = self.sheet_values[self.LOGIN_RANGE]
+            
+            # 找到登入碼（A欄）所在的列
+            row_num = None
+            for i, row in enumerate(login_rows):
+                if row and row[0] == login_code:
+                    row_num = i + 1
+                    break
+            
+            # 檢查登入碼是否存在
+            if row_num is None:
+                return False
+            
+            # 使用者地區（B2）
+            self.user_region = login_rows[1][1] if len(login_rows) > 1 and len(login_rows[1]) > 1 else None
+            
+            # 記錄使用者的最後登入時間（C欄，使用統一的格式）；
+            # 是否需要同步由 DataSyncService.detect_changes 判斷
+            start = time.perf_counter()
+            now = datetime.now().strftime('%Y-%m-%d %H:%M')
+            self.service.spreadsheets().values().update(
+                spreadsheetId=self.SPREADSHEET_ID,
+                range=f'login!C{row_num}',
+                valueInputOption='RAW',
+                body={'values': [[now]]}
+            ).execute()
+            self.timings['寫入登入時間'] = time.perf_counter() - start
+            
+            self.print_timings()
+            return True
+            
+        except Exception as e:
+            print(f"驗證錯誤：{str(e)}")
+            return False
+    
+    def print_timings(self):
+        for phase, seconds in self.timings.items():
+            print(f"{phase}：{seconds * 1000:.0f} ms")
+
+class DriveFolderIndex:
+    IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
+    
+    def __init__(self, files):
+        self.files_by_name = {}
+        # 依前綴分組的編號檔案，例如 林顯庭其他證明_1.jpg、3D筆_01.jpg
+        self.numbered_files = {}
+        
+        for file in files:
+            self.files_by_name.setdefault(file['name'], file)
+            
+            name_parts = file['name'].rsplit('_', 1)
+            if len(name_parts) == 2 and os.path.splitext(name_parts[1])[0].isdigit():
+                self.numbered_files.setdefault(name_parts[0], []).append(file)
+        
+        for group in self.numbered_files.values():
+            group.sort(key=lambda f: f['name'])
+    
+    @classmethod
+    def from_drive(cls, drive_service, folder_id, page_size=1000):
+        print("建立照片資料夾索引...")
+        files = []
+        page_token = None
+        while True:
+            results = drive_service.files().list(
+                q=f"'{folder_id}' in parents and trashed = false",
+                fields="nextPageToken, files(id, name, md5Checksum, modifiedTime, size, thumbnailLink)",
+                pageSize=page_size,
+                pageToken=page_token
+            ).execute()
+            files.extend(results.get('files', []))
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                break
+        
+        print(f"照片資料夾共 {len(files)} 個檔案")
+        return cls(files)
+    
+    def find(self, photo_name):
+        # 如果檔名已經包含副檔名
+        if any(photo_name.lower().endswith(ext) for ext in self.IMAGE_EXTENSIONS):
+            return self.files_by_name.get(photo_name)
+        
+        # 如果檔名不包含副檔名，依序嘗試所有可能的副檔名
+        for ext in self.IMAGE_EXTENSIONS:
+            file = self.files_by_name.get(f"{photo_name}{ext}")
+            if file:
+                return file
+        return None
+    
+    def find_numbered(self, prefix):
+        return list(self.numbered_files.get(prefix, []))
+
+class DriveChangeFeed:
+    # 以 Drive changes.list 找出上次同步後照片資料夾中變動的檔案
+    # drive_service 只需要 changes().getStartPageToken() 和 changes().list()，測試時可換成假的服務
+    def __init__(self, drive_service, folder_id, page_size=1000):
+        self.drive_service = drive_service
+        self.folder_id = folder_id
+        self.page_size = page_size
+    
+    def start_token(self):
+        # 從現在開始記錄變動；在同步開始前取得，同步期間的變動下次仍會找到
+        return self.drive_service.changes().getStartPageToken().execute()['startPageToken']
+    
+    def changes_since(self, page_token):
+        # 回傳 (變動的檔案, 下次使用的權杖)；每個檔案為 dict：id、name、in_folder、removed
+        # 刪除的檔案沒有檔名和資料夾，由呼叫端以檔案 ID 對照
+        changes = []
+        while True:
+            result = self.drive_service.changes().list(
+                pageToken=page_token,
+                pageSize=self.page_size,
+                includeRemoved=True,
+                spaces='drive',
+                fields="nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, parents, trashed))"
+            ).execute()
+            for change in result.get('changes', []):
+                file = change.get('file') or {}
+                changes.append({
+                    'id': change.get('fileId') or file.get('id'),
+                    'name': file.get('name'),
+                    'in_folder': self.folder_id in file.get('parents', []),
+                    'removed': bool(change.get('removed') or file.get('trashed'))
+                })
+            
+            if result.get('newStartPageToken'):
+                return changes, result['newStartPageToken']
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                raise ValueError("Drive 變動紀錄沒有回傳下次使用的權杖")
+
+class PhotoCache:
+    MANIFEST_PATH = 'images/photo_manifest.json'
+    PHOTO_DIRS = ('images/teachers', 'images/courses')
+    
+    def __init__(self, manifest_path=MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self.entries = self._load_manifest()
+        self._entries_by_base = None
+        # 本次同步中仍被資料引用的檔案
+        self.used_paths = set()
+    
+    def _load_manifest(self):
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"讀取照片快取清單失敗，將重新下載：{str(e)}")
+        return {}
+    
+    def is_fresh(self, file, local_path, variant='original'):
+        entry = self.entries.get(os.path.normpath(local_path))
+        if not entry or entry.get('id') != file['id']:
+            return False
+        # 需要原始檔時不能沿用縮圖；要縮圖但 Drive 沒有提供縮圖，或同一版原始檔上次無法取得縮圖時，
+        # 沿用已下載的原始檔，不會每次同步都重新下載
+        if entry.get('variant', 'original') != variant:
+            if variant == 'original':
+                return False
+            if file.get('thumbnailLink') and entry.get('thumbnailFailed') != self._version(file):
+                return False
+        if not os.path.exists(local_path):
+            return False
+        # 大小不符的檔案（例如舊版中斷時留下的不完整照片）重新下載
+        if entry.get('size') and os.path.getsize(local_path) != int(entry['size']):
+            return False
+        # 優先比對 md5，沒有 md5 的檔案（例如 Google 文件）改比對修改時間
+        if file.get('md5Checksum'):
+            return entry.get('md5Checksum') == file['md5Checksum']
+        return entry.get('modifiedTime') == file.get('modifiedTime')
+    
+    @staticmethod
+    def _version(file):
+        return file.get('md5Checksum') or file.get('modifiedTime')
+    
+    def record(self, file, local_path, variant='original', thumbnail_failed=False):
+        # md5Checksum 和 modifiedTime 記錄 Drive 上的原始檔，用來判斷原始檔是否變動；
+        # size 記錄本機檔案的大小（縮圖和原始檔不同），縮圖另外記錄本機檔案的 md5
+        key = os.path.normpath(local_path)
+        self._entries_by_base = None
+        self.entries[key] = {
+            'id': file['id'],
+            'md5Checksum': file.get('md5Checksum'),
+            'modifiedTime': file.get('modifiedTime'),
+            'size': file.get('size') if variant == 'original' else str(os.path.getsize(local_path)),
+            'variant': variant
+        }
+        if variant == 'thumbnail':
+            with open(local_path, 'rb') as f:
+                self.entries[key]['localMd5'] = hashlib.md5(f.read()).hexdigest()
+        if thumbnail_failed:
+            # 記錄無法取得縮圖的原始檔版本，原始檔變動後才再嘗試縮圖
+            self.entries[key]['thumbnailFailed'] = self._version(file)
+        self.used_paths.add(key)
+    
+    def local_asset(self, local_path):
+        # 本機檔案實際的大小和 md5；原始檔與 Drive 相同，縮圖使用下載時記錄的值
+        entry = self.entries.get(os.path.normpath(local_path))
+        if not entry:
+            return None
+        if entry.get('variant', 'original') == 'thumbnail':
+            return {'size': int(entry['size']) if entry.get('size') else None, 'md5': entry.get('localMd5')}
+        return {'size': int(entry['size']) if entry.get('size') else None, 'md5': entry.get('md5Checksum')}
+    
+    def mark_used(self, local_path):
+        self.used_paths.add(os.path.normpath(local_path))
+    
+    def keep_paths(self, paths):
+        # 資料中的照片路徑可能沒有副檔名，改用不含副檔名的路徑比對
+        if self._entries_by_base is None:
+            self._entries_by_base = {}
+            for key in self.entries:
+                self._entries_by_base.setdefault(os.path.splitext(key)[0], []).append(key)
+        
+        for path in paths:
+            key = os.path.normpath(path)
+            if key in self.entries:
+                self.used_paths.add(key)
+            else:
+                self.used_paths.update(self._entries_by_base.get(key, []))
+    
+    def collect_garbage(self):
+        # 刪除本次同步沒有用到的照片
+        removed = 0
+        for photo_dir in self.PHOTO_DIRS:
+            if not os.path.exists(photo_dir):
+                continue
+            for root, dirs, files in os.walk(photo_dir):
+                for name in files:
+                    path = os.path.normpath(os.path.join(root, name))
+                    if path not in self.used_paths:
+                        os.remove(path)
+                        removed += 1
+        
+        self.entries = {path: entry for path, entry in self.entries.items() if path in self.used_paths}
+        print(f"清除 {removed} 個不再使用的照片")
+    
+    def save(self):
+        write_json_atomic(self.manifest_path, self.entries)
+
+class SyncState:
+    STATE_PATH = 'sync_state.json'
+    # 紀錄格式變更時調高版本，下次同步會重新處理所有資料
+    VERSION = 2
+    
+    def __init__(self, state_path=STATE_PATH):
+        self.state_path = state_path
+        self.data = self._load_state()
+    
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"讀取同步狀態失敗，將重新處理所有資料：{str(e)}")
+        return {}
+    
+    @staticmethod
+    def row_hash(row):
+        return hashlib.sha1(json.dumps(row, ensure_ascii=False).encode('utf-8')).hexdigest()
+    
+    def get_hashes(self, sheet):
+        if self.data.get('version') != self.VERSION:
+            return {}
+        return dict(self.data.get(sheet, {}))
+    
+    def set_hashes(self, sheet, row_hashes, failed_hashes=()):
+        # failed_hashes 為處理失敗而跳過的列，內容沒有變動時不會單獨觸發同步，下次同步時重試
+        self.data[sheet] = row_hashes
+        self.data.setdefault('failed', {})[sheet] = sorted(failed_hashes)
+    
+    def get_failed_hashes(self, sheet):
+        if self.data.get('version') != self.VERSION:
+            return set()
+        return set(self.data.get('failed', {}).get(sheet, []))
+    
+    def get_page_token(self):
+        # 上次同步時照片資料夾的 Drive 變動紀錄權杖
+        if self.data.get('version') != self.VERSION:
+            return None
+        return self.data.get('drive_page_token')
+    
+    def set_page_token(self, page_token):
+        self.data['drive_page_token'] = page_token
+    
+    def get_pending_photos(self):
+        # 上次下載失敗的照片檔名，下次登入時視為有變動並重新下載
+        if self.data.get('version') != self.VERSION:
+            return set()
+        return set(self.data.get('pending_photos', []))
+    
+    def set_pending_photos(self, names):
+        self.data['pending_photos'] = sorted(names)
+    
+    def save(self):
+        self.data['version'] = self.VERSION
+        write_json_atomic(self.state_path, self.data)
+
+class SyncCancelled(Exception):
+    pass
+
+class DownloadVerificationError(Exception):
+    # 下載的檔案大小或 md5 和 Drive 上的不符
+    pass
+
+class HashingWriter:
+    # 寫入檔案時同時計算 md5 和大小，下載完不需再讀一次檔案
+    def __init__(self, f):
+        self.f = f
+        self.md5 = hashlib.md5()
+        self.size = 0
+    
+    def write(self, data):
+        self.md5.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+class DriveDownloadEngine:
+    # 需要重試的 HTTP 狀態碼（流量限制與伺服器錯誤）
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    # 每次請求下載的大小，記憶體用量不會超過 連線數 × 這個大小
+    # （可用環境變數 TEACHERDOC_DOWNLOAD_CHUNK_SIZE 調整，單位為位元組）
+    CHUNK_SIZE = int(os.getenv('TEACHERDOC_DOWNLOAD_CHUNK_SIZE', 1024 * 1024))
+    # 縮圖的長邊像素：文件中照片寬 2 吋，以 200 DPI 需要 400 像素寬，
+    # 長邊 800 像素讓高寬比到 2:1 的直式照片寬度也足夠
+    # （可用環境變數 TEACHERDOC_THUMBNAIL_SIZE 調整）
+    THUMBNAIL_SIZE = int(os.getenv('TEACHERDOC_THUMBNAIL_SIZE', 800))
+    
+    def __init__(self, creds, max_workers=8, max_retries=5,
+                 backoff_base=1.0, progress_callback=None, cache=None, cancel_event=None, clients=None,
+                 chunksize=CHUNK_SIZE, thumbnail_size=THUMBNAIL_SIZE):
+        self.creds = creds
+        self.chunksize = chunksize
+        self.thumbnail_size = thumbnail_size
+        self.clients = clients or GoogleClientFactory(creds)
+        self.cache = cache
+        self.cancel_event = cancel_event
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.progress_callback = progress_callback
+        # 以儲存路徑為鍵，同一個檔案（例如多門課程共用的照片）只下載一次
+        self.jobs = {}
+        # 以儲存路徑為鍵，'thumbnail' 表示下載縮圖；同一個檔案只要有一處需要原始檔就下載原始檔
+        self.variants = {}
+        # 下載失敗的 Drive 檔案
+        self.failed_files = []
+    
+    def submit(self, file, save_path, thumbnail=False):
+        self.jobs[save_path] = file
+        if thumbnail:
+            self.variants.setdefault(save_path, 'thumbnail')
+        else:
+            self.variants[save_path] = 'original'
+    
+    @staticmethod
+    def local_path(file, save_path):
+        # 儲存路徑加上 Drive 檔案的實際副檔名
+        return os.path.splitext(save_path)[0] + os.path.splitext(file['name'])[1]
+    
+    def run(self):
+        jobs, self.jobs = self.jobs, {}
+        variants, self.variants = self.variants, {}
+        results = {}
+        if not jobs:
+            return results
+        
+        # 快取中內容沒有變動的照片直接沿用
+        if self.cache is not None:
+            pending = {}
+            for save_path, file in jobs.items():
+                local_path = self.local_path(file, save_path)
+                if self.cache.is_fresh(file, local_path, variants[save_path]):
+                    self.cache.mark_used(local_path)
+                    results[save_path] = local_path
+                else:
+                    pending[save_path] = file
+            print(f"照片快取命中 {len(results)} 個，需要下載 {len(pending)} 個")
+            jobs = pending
+        
+        if not jobs:
+            return results
+        
+        total = len(jobs)
+        completed = 0
+        print(f"開始下載照片，共 {total} 個檔案，同時 {self.max_workers} 個連線")
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._download_with_retry, file, save_path, variants[save_path]): (file, save_path)
+                for save_path, file in jobs.items()
+            }
+            for future in as_completed(futures):
+                file, save_path = futures[future]
+                photo_name = file['name']
+                if self._cancelled():
+                    # 取消尚未開始的下載，已開始的檔案會下載完成
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    raise SyncCancelled("已取消同步")
+                try:
+                    results[save_path], variant, thumbnail_failed = future.result()
+                    if self.cache is not None:
+                        self.cache.record(file, results[save_path], variant, thumbnail_failed)
+                except SyncCancelled:
+                    continue
+                except Exception as e:
+                    print(f"下載照片失敗 {photo_name}: {str(e)}")
+                    if hasattr(e, 'resp') and hasattr(e.resp, 'status'):
+                        print(f"HTTP狀態碼：{e.resp.status}")
+                    results[save_path] = None
+                    self.failed_files.append(file)
+                    # 下載失敗時保留舊版照片，不列入清除
+                    if self.cache is not None:
+                        self.cache.mark_used(self.local_path(file, save_path))
+                
+                completed += 1
+                if self.progress_callback:
+                    self.progress_callback(completed, total, photo_name)
+        
+        return results
+    
+    def _cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+    
+    def _download_with_retry(self, file, save_path, variant='original'):
+        # 回傳 (本機路徑, 實際下載的版本, 是否因為無法取得縮圖而改下載原始檔)
+        from googleapiclient.errors import HttpError
+        photo_name = file['name']
+        thumbnail_failed = False
+        attempt = 0
+        while True:
+            if self._cancelled():
+                raise SyncCancelled("已取消同步")
+            try:
+                # 沒有縮圖或 Drive 無法產生縮圖時改下載原始檔，之後重試也直接下載原始檔；
+                # 流量限制和伺服器錯誤則和原始檔一樣重試，不改下載較大的原始檔
+                if variant == 'thumbnail':
+                    with self.clients.lease_http() as http:
+                        thumbnail_path = self._download_thumbnail(http, file, save_path)
+                    if thumbnail_path:
+                        return thumbnail_path, 'thumbnail', False
+                    variant = 'original'
+                    thumbnail_failed = bool(file.get('thumbnailLink'))
+                with self.clients.lease('drive', 'v3') as drive_service:
+                    return self._download_file(drive_service, file, save_path), 'original', thumbnail_failed
+            except HttpError as e:
+                if e.resp.status not in self.RETRY_STATUS or attempt >= self.max_retries:
+                    raise
+                print(f"下載 {photo_name} 收到 HTTP {e.resp.status}，稍後重試")
+            except (ConnectionError, TimeoutError, DownloadVerificationError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                print(f"下載 {photo_name} 失敗：{str(e)}，稍後重試")
+            
+            # 指數退避加上隨機延遲，避免所有執行緒同時重試
+            delay = self.backoff_base * (2 ** attempt) + random.uniform(0, self.backoff_base)
+            if self.cancel_event is not None:
+                self.cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+    
+    def _download_thumbnail(self, http, file, save_path):
+        # thumbnailLink 結尾的 =s220 改成需要的大小，由 Drive 產生縮小的照片；
+        # 連結需要帶授權的請求，使用 GoogleClientFactory 的授權 HTTP 連線下載
+        from googleapiclient.errors import HttpError
+        link = file.get('thumbnailLink')
+        if not link:
+            return None
+        url = re.sub(r'=s\d+$', '', link) + f'=s{self.thumbnail_size}'
+        print(f"下載縮圖：{file['name']}")
+        resp, content = http.request(url, 'GET')
+        if resp.status in self.RETRY_STATUS:
+            raise HttpError(resp, content, uri=url)
+        if resp.status != 200 or not resp.get('content-type', '').startswith('image/') or not content:
+            print(f"無法下載縮圖 {file['name']}（HTTP {resp.status}），改下載原始檔")
+            return None
+        
+        # 和原始檔一樣先寫入暫存檔再改名
+        save_path = self.local_path(file, save_path)
+        directory = os.path.dirname(save_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.download-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, save_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return save_path
+    
+    def _download_file(self, drive_service, file, save_path):
+        from googleapiclient.http import MediaIoBaseDownload
+        print(f"開始處理照片：{file['name']}")
+        file_id = file['id']
+        
+        # 更新儲存路徑以含正確的副檔名
+        save_path = self.local_path(file, save_path)
+        
+        # 分段下載直接寫入同資料夾的暫存檔，驗證大小和 md5 後才改名，
+        # 中斷或損毀的下載不會留在照片的位置
+        directory = os.path.dirname(save_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.download-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer = HashingWriter(f)
+                request = drive_service.files().get_media(fileId=file_id)
+                downloader = MediaIoBaseDownload(writer, request, chunksize=self.chunksize)
+                
+                done = False
+                while done is False:
+                    if self._cancelled():
+                        raise SyncCancelled("已取消同步")
+                    status, done = downloader.next_chunk()
+                f.flush()
+                os.fsync(f.fileno())
+            
+            self._verify(file, writer)
+            os.replace(temp_path, save_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        return save_path
+    
+    def _verify(self, file, writer):
+        # Google 文件等沒有 md5 和大小的檔案不檢查
+        if file.get('size') is not None and writer.size != int(file['size']):
+            raise DownloadVerificationError(f"大小不符：預期 {file['size']}，實際 {writer.size}")
+        if file.get('md5Checksum') and writer.md5.hexdigest() != file['md5Checksum']:
+            raise DownloadVerificationError(f"md5 不符：預期 {file['md5Checksum']}，實際 {writer.md5.hexdigest()}")
+
+class DataSyncService:
+    PHOTO_FOLDER_ID = "1I_LHNBh8pDMJRbtRmQRblqumIZ9vayfa"
+    
+    def __init__(self, creds, teacher_manager, course_manager, login_manager=None,
+                 download_workers=8, progress_callback=None, cancel_event=None, clients=None,
+                 thumbnails=True, change_feed=None):
+        self.SPREADSHEET_ID = '171kBtkTN5LUTNVMkCEhJ-L-l4xh7Wj9sJE76W0HmZ9w'
+        self.creds = creds
+        self.teacher_manager = teacher_manager
+        self.course_manager = course_manager
+        # 登入管理器（保留登入時讀到的試算表資料）
+        self.login_manager = login_manager
+        # 和登入共用同一組 Google API 服務物件
+        if clients is None:
+            clients = login_manager.clients if login_manager else GoogleClientFactory(creds)
+        self.clients = clients
+        self.service = clients.sheets()
+        # 同時下載照片的連線數
+        self.download_workers = download_workers
+        # 大頭照和課程照片下載 Drive 縮圖（THUMBNAIL_FIELDS），其他照片下載原始檔
+        self.thumbnails = thumbnails
+        # progress_callback(階段, 已完成, 總數, 檔名)，total 為 0 表示無法估計進度
+        self.progress_callback = progress_callback
+        # 設定後在下一個檢查點中止同步，尚未寫入的資料維持原狀
+        self.cancel_event = cancel_event
+        # Drive 變動紀錄（DriveChangeFeed），未指定時使用照片資料夾的變動紀錄
+        self.change_feed = change_feed
+        # 同步成功後儲存的變動紀錄權杖
+        self.page_token = None
+        # 上次同步後變動的照片檔名；None 表示無法判斷，所有資料都重新檢查照片
+        self.photo_changes = set()
+        self.folder_index = None
+        self.photo_cache = None
+        self.sync_state = None
+        # 本次同步下載失敗的照片檔名
+        self.failed_photos = set()
+        # 本次加入下載佇列的照片 (本機路徑, 紀錄中的照片資訊)
+        self.pending_assets = []
+        self.errors = []
+    
+    def _get_change_feed(self):
+        if self.change_feed is None:
+            self.change_feed = DriveChangeFeed(self.clients.drive(), self.PHOTO_FOLDER_ID)
+        return self.change_feed
+    
+    def detect_changes(self):
+        # 試算表比對每一列的雜湊值（登入時已讀取，不需另外呼叫 API），
+        # 照片從上次同步的權杖讀取 Drive 變動紀錄
+        # 回傳 dict：sheets（有變動的工作表）、photos（變動的照片檔名，無法判斷時為 None）、changed
+        sync_state = SyncState()
+        changed_sheets = []
+        teacher_rows = self._teacher_rows()
+        course_rows = self._get_sheet_values(LoginManager.COURSE_RANGE)
+        for sheet, rows in (('teachers', teacher_rows), ('courses', course_rows)):
+            # 上次處理失敗的列也算已知，內容沒有變動時不會每次登入都重新同步
+            known_hashes = set(sync_state.get_hashes(sheet)) | sync_state.get_failed_hashes(sheet)
+            if {SyncState.row_hash(row) for row in rows} != known_hashes:
+                changed_sheets.append(sheet)
+        
+        photo_changes = None
+        page_token = sync_state.get_page_token()
+        if page_token:
+            try:
+                changes, self.page_token = self._get_change_feed().changes_since(page_token)
+                # 刪除或移出資料夾的檔案以照片快取中的檔案 ID 對照檔名
+                names_by_id = {entry['id']: os.path.basename(path) for path, entry in PhotoCache().entries.items()}
+                photo_changes = set()
+                for change in changes:
+                    if change['in_folder'] or change['id'] in names_by_id:
+                        name = change['name'] or names_by_id.get(change['id'])
+                        if name:
+                            photo_changes.add(name)
+                        if change['id'] in names_by_id and names_by_id[change['id']] != name:
+                            photo_changes.add(names_by_id[change['id']])  # 改名前的檔名
+            except Exception as e:
+                print(f"讀取 Drive 變動紀錄失敗，將重新檢查所有照片：{str(e)}")
+                self.page_token = None
+                photo_changes = None
+        
+        # 上次下載失敗的照片一併視為有變動，所屬的資料會重新處理並下載
+        if photo_changes is not None:
+            photo_changes |= sync_state.get_pending_photos()
+        
+        changed = bool(changed_sheets) or photo_changes is None or bool(photo_changes)
+        print(f"變動的工作表：{'、'.join(changed_sheets) or '無'}，"
+              f"變動的照片：{'無法判斷' if photo_changes is None else len(photo_changes)}")
+        return {'sheets': changed_sheets, 'photos': photo_changes, 'changed': changed}
+    
+    def mark_unchanged(self):
+        # 沒有變動時不需同步，只推進變動紀錄的權杖
+        if self.page_token:
+            sync_state = SyncState()
+            sync_state.set_page_token(self.page_token)
+            sync_state.save()
+    
+    def sync(self, incremental=True, photo_changes=()):
+        # photo_changes 為 detect_changes 找到的照片檔名，這些照片所屬的資料即使試算表沒有變動也重新處理；
+        # None 表示無法判斷，所有資料都重新檢查照片（內容沒變的照片不會重新下載）
+        print(f"開始更新資料（{'增量' if incremental else '完整'}同步）...")
+        self.errors = []
+        self.photo_changes = photo_changes if photo_changes is None else set(photo_changes)
+        
+        # 重新建立照片資料夾索引，並載入照片快取和上次同步的狀態
+        self.folder_index = None
+        self.pending_assets = []
+        self.failed_photos = set()
+        self.photo_cache = PhotoCache()
+        self.sync_state = SyncState()
+        
+        # 同步前先取得權杖，同步期間的照片變動下次仍會找到
+        if self.page_token is None:
+            try:
+                self.page_token = self._get_change_feed().start_token()
+            except Exception as e:
+                print(f"無法取得 Drive 變動紀錄權杖：{str(e)}")
+        
+        try:
+            # 更新師資資料
+            teachers_ok = self.import_teacher_data_from_google(incremental)
+            print("師資資料更新成")
+            
+            # 更新課程資料
+            courses_ok = self.import_course_data_from_google(incremental)
+            print("課程資料更新完成")
+            
+            # 下載失敗的照片記錄下來，下次登入時重新下載；有照片下載失敗時不推進變動紀錄的權杖
+            if not (teachers_ok and courses_ok):
+                self.failed_photos |= self.sync_state.get_pending_photos()
+            self.sync_state.set_pending_photos(self.failed_photos)
+            if self.failed_photos:
+                print(f"{len(self.failed_photos)} 張照片下載失敗，下次登入時重新下載")
+            
+            # 兩邊都完整同步後才能判斷哪些照片已不再使用
+            if teachers_ok and courses_ok:
+                if self.page_token and not self.failed_photos:
+                    self.sync_state.set_page_token(self.page_token)
+                self._report('清理照片快取')
+                self.photo_cache.collect_garbage()
+                
+                # 預先建立文件用的照片縮圖，產生文件時不需再處理原始照片
+                IMAGE_DERIVATIVES.prepare(
+                    {path: (self.photo_cache.local_asset(path) or {}).get('md5') for path in self.photo_cache.used_paths},
+                    lambda completed, total, name: self._report('建立照片縮圖', completed, total, name)
+                )
+            return teachers_ok and courses_ok
+        finally:
+            # 取消或失敗時也保留已下載的照片和已完成部分的同步狀態
+            self.photo_cache.save()
+            self.sync_state.save()
+            # 照片資料夾可能已變動，下次產生文件時重新建立照片索引
+            ASSET_INDEX.invalidate()
+    
+    def _get_sheet_values(self, range_name):
+        # 登入時已經一起讀取的範圍直接沿用，不再另外呼叫 API
+        if self.login_manager and range_name in self.login_manager.sheet_values:
+            return self.login_manager.sheet_values[range_name]
+        
+        result = self.service.spreadsheets().values().get(
+            spreadsheetId=self.SPREADSHEET_ID,
+            range=range_name
+        ).execute()
+        return result.get('values', [])
+    
+    def _get_folder_index(self):
+        # 每次同步只列出一次照片資料夾
+        if self.folder_index is None:
+            self._report('建立照片資料夾索引')
+            self.folder_index = DriveFolderIndex.from_drive(self.clients.drive(), self.PHOTO_FOLDER_ID)
+        return self.folder_index
+    
+    def _create_download_engine(self, phase):
+        return DriveDownloadEngine(
+            self.creds,
+            max_workers=self.download_workers,
+            progress_callback=lambda completed, total, photo_name: self._report(phase, completed, total, photo_name),
+            cache=self.photo_cache,
+            cancel_event=self.cancel_event,
+            clients=self.clients
+        )
+    
+    def _report(self, phase, completed=0, total=0, name=''):
+        if total:
+            print(f"{phase} {completed}/{total}：{name}")
+        else:
+            print(f"{phase}...")
+        if self.progress_callback:
+            self.progress_callback(phase, completed, total, name)
+    
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise SyncCancelled("已取消同步")
+    
+    def _photos_changed(self, *prefixes):
+        # 變動的照片是否屬於這筆資料（照片檔名以教師姓名或課程分類開頭）
+        if self.photo_changes is None:
+            return True
+        return any(name.startswith(prefix) for name in self.photo_changes for prefix in prefixes if prefix)
+    
+    def _teacher_rows(self):
+        # 取得使用者地區（登入表 B2）
+        login_rows = self._get_sheet_values(LoginManager.LOGIN_RANGE)
+        user_region = login_rows[1][1] if len(login_rows) > 1 and len(login_rows[1]) > 1 else None
+        print(f"使用者地區：{user_region}")
+        
+        # 讀取資資料
+        values = self._get_sheet_values(LoginManager.TEACHER_RANGE)
+        
+        # 篩選使用者地區且有姓名的資料
+        rows = []
+        for row in values:
+            if len(row) > 0 and row[0] != user_region:
+                continue
+            # 只有當姓名不為空時才新增教師資料
+            if len(row) > 1 and row[1]:
+                rows.append(row)
+            else:
+                print(f"跳過沒有姓名的資料")
+        return rows
+    
+    def import_teacher_data_from_google(self, incremental=False):
+        try:
+            print("取師資料...")
+            rows = self._teacher_rows()
+            
+            # 確保資料夾存在
+            if not os.path.exists('images/teachers'):
+                os.makedirs('images/teachers')
+            if not os.path.exists('images/courses'):
+                os.makedirs('images/courses')
+            
+            # 照片先加入下載佇列，最後再一起平行下載
+            download_engine = self._create_download_engine('下載教師照片')
+            
+            # 比對每一列的雜湊值，找出新增、變動和刪除的資料
+            previous_hashes = self.sync_state.get_hashes('teachers') if incremental else {}
+            plan = self._plan_row_sync(
+                rows,
+                previous_hashes,
+                self.teacher_manager.teachers,
+                lambda row: (row[0] if len(row) > 0 else '', row[1]),
+                lambda teacher: (teacher.get('region', ''), teacher.get('name', '')),
+                lambda row: self._photos_changed(row[1])
+            )
+            
+            teachers = {}
+            row_hashes = {}
+            failed_hashes = set()
+            self._report('處理師資資料')
+            for row_hash, row, teacher_id, changed in plan:
+                self._check_cancelled()
+                if changed:
+                    try:
+                        teachers[teacher_id] = self._build_teacher_record(row, download_engine)
+                    except Exception as row_error:
+                        print(f"處理教師資料時發生錯誤，跳過此筆資料: {str(row_error)}")
+                        failed_hashes.add(row_hash)
+                        continue
+                else:
+                    # 沒有變動的資料沿用原本的紀錄和照片
+                    teachers[teacher_id] = self.teacher_manager.teachers[teacher_id]
+                    self.photo_cache.keep_paths(self._teacher_photo_paths(teachers[teacher_id]))
+                row_hashes[row_hash] = teacher_id
+            
+            changed_count = sum(1 for _, _, _, changed in plan if changed)
+            removed_count = len(set(self.teacher_manager.teachers) - set(teachers))
+            print(f"師資資料：變動 {changed_count} 筆，沿用 {len(teachers) - changed_count} 筆，移除 {removed_count} 筆")
+            
+            # 平行下載所有教師照片
+            download_engine.run()
+            self.failed_photos.update(file['name'] for file in download_engine.failed_files)
+            self._update_local_assets()
+            
+            self.teacher_manager.replace_teachers(teachers)
+            self.sync_state.set_hashes('teachers', row_hashes, failed_hashes)
+            
+            return True
+            
+        except SyncCancelled:
+            raise
+        except Exception as e:
+            print(f"更新師資資料時發生錯誤：{str(e)}")
+            self.errors.append(f"更新師資資料失敗：{str(e)}")
+            return False
+    
+    def _plan_row_sync(self, rows, previous_hashes, records, row_key, record_key, photos_changed=None):
+        # 回傳 (列雜湊, 列資料, ID, 是否需要重新處理)，順序與試算表相同
+        # photos_changed(row) 為 True 的資料即使試算表沒有變動也重新處理
+        plan = []
+        claimed = set()
+        for row in rows:
+            row_hash = SyncState.row_hash(row)
+            record_id = previous_hashes.get(row_hash)
+            if record_id in records and record_id not in claimed and not (photos_changed and photos_changed(row)):
+                claimed.add(record_id)
+                plan.append((row_hash, row, record_id, False))
+            else:
+                plan.append((row_hash, row, None, True))
+        
+        # 變動的資料沿用同一筆紀錄（例如同地區同姓名的教師）原本的 ID
+        unclaimed = {}
+        for record_id, record in records.items():
+            if record_id not in claimed:
+                unclaimed.setdefault(record_key(record), record_id)
+        
+        next_id = max((int(record_id) for record_id in records if record_id.isdigit()), default=0) + 1
+        for i, (row_hash, row, record_id, changed) in enumerate(plan):
+            if not changed:
+                continue
+            record_id = unclaimed.pop(row_key(row), None)
+            if record_id is None:
+                record_id = str(next_id)
+                next_id += 1
+            plan[i] = (row_hash, row, record_id, True)
+        
+        return plan
+    
+    def _build_teacher_record(self, row, download_engine):
+        # 使用預設值處理所有欄位
+        teacher_data = {
+            'region': row[0] if len(row) > 0 else '',      # 地區 (A欄)
+            'name': row[1] if len(row) > 1 else '',        # 姓名 (B欄)
+            'nickname': row[2] if len(row) > 2 else '',    # 綽號 (C欄)
+            'photo': '',                                   # 大頭照 (D欄)
+            'unit': row[4] if len(row) > 4 else '',       # 申請單位 (E欄)
+            'birth': row[5] if len(row) > 5 else '',      # 出生日期 (F欄)
+            'gender': row[6] if len(row) > 6 else '',     # 性別 (G欄)
+            'mobile': row[7] if len(row) > 7 else '',     # 手機 (H欄)
+            'idno': row[8] if len(row) > 8 else '',       # 身分證字號 (I欄)
+            'address': row[9] if len(row) > 9 else '',    # 通訊地址 (J欄)
+            'email': row[10] if len(row) > 10 else '',    # Email (K欄)
+            'line': row[11] if len(row) > 11 else '',     # Line ID (L欄)
+            'skill': row[12] if len(row) > 12 else '',    # 專長 (M欄)
+            'experience': row[13] if len(row) > 13 else '',# 教學經驗 (N欄)
+            'history': row[14] if len(row) > 14 else '',  # 經歷 (O欄)
+            'education': row[15] if len(row) > 15 else '', # 最高學歷 (P欄)
+            'job': row[16] if len(row) > 16 else '',      # 現職 (Q欄)
+            'id_front': '',                               # 身分證正面 (R欄)
+            'id_back': '',                                # 身分證反面 (S欄)
+            'diploma': '',                                # 畢業證書 (T欄)
+            'other_certs': [],                           # 其他證明 (U欄)
+            'course_type': row[21] if len(row) > 21 else '', # 課程分類 (V欄)
+            'assets': {}                                  # 照片實際路徑對應大小和雜湊
+        }
+        
+        # 修改照欄位對應
+        photo_fields = {
+            3: ('photo', '大頭照'),       # D欄
+            17: ('id_front', '身分證正'),   # S欄
+            18: ('id_back', '身分證反'),    # T欄
+            19: ('diploma', '畢業證書')     # U欄
+        }
+        
+        # 照片資料夾只列出一次，之後的查詢都在本機完成
+        folder_index = self._get_folder_index()
+        
+        # 修改這部分，加入錯誤處理
+        for col_idx, (field_name, photo_type) in photo_fields.items():
+            try:
+                if len(row) > col_idx and row[col_idx]:
+                    try:
+                        # 使用教師姓名和照片類型建立檔名
+                        photo_name = f"{row[1]}{photo_type}"  # 例如：林顯庭大頭照
+                        save_path = f'images/teachers/{photo_name}'
+                        file = folder_index.find(photo_name)
+                        if file:
+                            save_path = self._add_asset(teacher_data, file, save_path, download_engine, field_name)
+                        else:
+                            print(f"找不到檔案：{photo_name}")
+                        teacher_data[field_name] = save_path
+                    except Exception as photo_error:
+                        print(f"跳過照片 {field_name}: {str(photo_error)}")
+                        teacher_data[field_name] = ''
+            except Exception as field_error:
+                print(f"處理照片欄位 {field_name} 時發生錯誤: {str(field_error)}")
+                teacher_data[field_name] = ''
+        
+        # 處理其他證明
+        try:
+            teacher_name = row[1]
+            other_certs = []
+            for file in folder_index.find_numbered(f"{teacher_name}其他證明"):
+                photo_name = file['name']
+                save_path = self._add_asset(teacher_data, file, f'images/teachers/{photo_name}', download_engine, 'other_certs')
+                other_certs.append(save_path)
+            
+            teacher_data['other_certs'] = other_certs
+        except Exception as other_certs_error:
+            print(f"處理其他證明時發生錯誤: {str(other_certs_error)}")
+            teacher_data['other_certs'] = []
+        
+        return teacher_data
+    
+    def _add_asset(self, record, file, save_path, download_engine, field):
+        # 加入下載佇列，紀錄中改存含副檔名的實際路徑，並保留大小和 md5
+        download_engine.submit(file, save_path, thumbnail=self.thumbnails and field in THUMBNAIL_FIELDS)
+        local_path = download_engine.local_path(file, save_path)
+        # 大小和 md5 要等下載後才知道（縮圖和 Drive 上的不同，下載失敗時保留的是舊檔），
+        # 由 _update_local_assets 依照片快取清單填入
+        asset = {'size': None, 'md5': None}
+        record['assets'][os.path.normpath(local_path)] = asset
+        self.pending_assets.append((local_path, asset))
+        return local_path
+    
+    def _update_local_assets(self):
+        # 下載完成後改為本機檔案實際的大小和 md5，照片縮圖以這個 md5 為鍵，不會混用新舊照片
+        for local_path, asset in self.pending_assets:
+            asset.update(self.photo_cache.local_asset(local_path) or {'size': None, 'md5': None})
+        self.pending_assets = []
+    
+    def _teacher_photo_paths(self, teacher_data):
+        paths = [teacher_data.get(field) for field in ('photo', 'id_front', 'id_back', 'diploma')]
+        paths.extend(teacher_data.get('other_certs', []))
+        return [path for path in paths if path]
+
+    def import_course_data_from_google(self, incremental=False):
+        try:
+            print("讀取課程資料...")
+            values = self._get_sheet_values(LoginManager.COURSE_RANGE)
+            print(f"讀取到 {len(values)} 筆課程資料")
+            
+            # 確保資料夾存在
+            if not os.path.exists('images/teachers'):
+                os.makedirs('images/teachers')
+            if not os.path.exists('images/courses'):
+                os.makedirs('images/courses')
+            
+            # 照片先加入下載佇列，最後再一起平行下載
+            download_engine = self._create_download_engine('下載課程照片')
+            
+            # 比對每一列的雜湊值，找出新增、變動和刪除的資料
+            previous_hashes = self.sync_state.get_hashes('courses') if incremental else {}
+            plan = self._plan_row_sync(
+                values,
+                previous_hashes,
+                self.course_manager.courses,
+                lambda row: (row[0] if len(row) > 0 else '', row[15] if len(row) > 15 else ''),
+                lambda course: (course.get('course_name', ''), course.get('course', '')),
+                lambda row: self._photos_changed(row[15].strip() if len(row) > 15 else '', row[14] if len(row) > 14 else '')
+            )
+            
+            # 處理每一筆課程資料
+            courses = {}
+            row_hashes = {}
+            failed_hashes = set()
+            self._report('處理課程資料')
+            for row_hash, row, course_id, changed in plan:
+                self._check_cancelled()
+                if changed:
+                    try:
+                        courses[course_id] = self._build_course_record(row, download_engine)
+                    except Exception as row_error:
+                        print(f"處理課程資料時發生錯誤，跳過此筆資料: {str(row_error)}")
+                        failed_hashes.add(row_hash)
+                        continue
+                else:
+                    # 沒有變動的資料沿用原本的紀錄和照片
+                    courses[course_id] = self.course_manager.courses[course_id]
+                    self.photo_cache.keep_paths(self._course_photo_paths(courses[course_id]))
+                row_hashes[row_hash] = course_id
+            
+            changed_count = sum(1 for _, _, _, changed in plan if changed)
+            removed_count = len(set(self.course_manager.courses) - set(courses))
+            print(f"課程資料：變動 {changed_count} 筆，沿用 {len(courses) - changed_count} 筆，移除 {removed_count} 筆")
+            
+            # 平行下載所有課程照片
+            download_engine.run()
+            self.failed_photos.update(file['name'] for file in download_engine.failed_files)
+            self._update_local_assets()
+            
+            self.course_manager.replace_courses(courses)
+            self.sync_state.set_hashes('courses', row_hashes, failed_hashes)
+            return True
+                        
+        except SyncCancelled:
+            raise
+        except Exception as e:
+            print(f"更新課程資料時發生錯誤：{str(e)}")
+            self.errors.append(f"更新課程資料失敗：{str(e)}")
+            return False
+    
+    def _build_course_record(self, row, download_engine):
+        course_data = {
+            'course_name': row[0] if len(row) > 0 else '',     # 社團名稱 (A欄)
+            'intro': row[1] if len(row) > 1 else '',           # 課程介紹 (B欄)
+            'material_fee': row[2] if len(row) > 2 else '',    # 材料費 (C欄)
+            'reason': row[3] if len(row) > 3 else '',          # 原因 (D欄)
+            'target': row[4] if len(row) > 4 else '',          # 教學目標 (E欄)
+            'course_topic': row[5] if len(row) > 5 else '',    # 課程主題 (F欄) - 新增
+            'content': row[6] if len(row) > 6 else '',         # 課程內容 (G欄)
+            'photos': [],                                      # 課程照片 (H欄)
+            'price_list_name': row[8] if len(row) > 8 else '', # 報價單品名 (I欄)
+            'price_list_unit': row[9] if len(row) > 9 else '', # 報價單單位 (J欄)
+            'price_list_quantity': row[10] if len(row) > 10 else '', # 報價單數量 (K欄)
+            'price_list_price': row[11] if len(row) > 11 else '',    # 報價單單價 (L欄)
+            'price_list_amount': row[12] if len(row) > 12 else '',   # 報價單預計金額 (M欄)
+            'price_list_usage': row[13] if len(row) > 13 else '',    # 報價單用途說明 (N欄)
+            'bank_account': '',                                      # 公司存摺 (O欄)
+            'course': row[15] if len(row) > 15 else '',             # 課程分類 (P欄)
+            'assets': {}                                             # 照片實際路徑對應大小和雜湊
+        }
+        
+        # 照片資料夾只列出一次，之後的查詢都在本機完成
+        folder_index = self._get_folder_index()
+        
+        # 處理課程照片
+        if len(row) > 7:
+            try:
+                # 從課程分類建立搜尋條件
+                course_type = row[15].strip() if len(row) > 15 else ''  # 使用 P 欄的課程分類
+                if course_type:  # 只有當課程分類存在時才處理
+                    # 只取符合 課程分類_數字 格式的照片
+                    for file in folder_index.find_numbered(course_type):
+                        save_path = self._add_asset(course_data, file, f'images/courses/{file["name"]}', download_engine, 'photos')
+                        course_data['photos'].append(save_path)
+            except Exception as split_error:
+                print(f"處理照片列表時發生錯誤: {str(split_error)}")
+        
+        # 處司存摺（O欄）
+        if len(row) > 14 and row[14]:
+            try:
+                save_path = f'images/courses/{row[14]}'
+                file = folder_index.find(row[14])
+                if file:
+                    save_path = self._add_asset(course_data, file, save_path, download_engine, 'bank_account')
+                else:
+                    print(f"找不到檔案：{row[14]}")
+                course_data['bank_account'] = save_path
+            except Exception as bank_error:
+                print(f"跳過公司存摺照片: {str(bank_error)}")
+                course_data['bank_account'] = ''
+        
+        return course_data
+    
+    def _course_photo_paths(self, course_data):
+        paths = list(course_data.get('photos', []))
+        paths.append(course_data.get('bank_account'))
+        return [path for path in paths if path]
+
+# 讀取試算表和照片所需的權限
+SCOPES = [
+    'https://www.googleapis.com/auth/spreadsheets',
+    'https://www.googleapis.com/auth/drive.readonly'
+]
+
+def get_service_account_creds(scopes=SCOPES):
+    try:
+        from google.oauth2 import service_account
+        
+        # 確定資源目錄
+        if getattr(sys, 'frozen', False):
+            # 如果是打包後的執行檔
+            base_path = sys._MEIPASS  # PyInstaller 的特殊路徑
+        else:
+            # 如果是直接執行 Python 腳本
+            base_path = os.path.dirname(os.path.abspath(__file__))
+        
+        # 先嘗試從環境變數讀取
+        credentials_json = os.getenv('GOOGLE_CREDENTIALS')
+        if credentials_json:
+            try:
+                credentials_info = json.loads(credentials_json)
+                creds = service_account.Credentials.from_service_account_info(
+                    credentials_info,
+                    scopes=scopes
+                )
+                return creds
+            except Exception as env_error:
+                print(f"從環境變數載入憑證失敗：{str(env_error)}")
+        
+        # 如果環境變數不存在或失敗，則從檔案讀取
+        try:
+            # 只在資源目錄中尋找憑證檔案
+            cred_file = os.path.join(base_path, 'credentials.json')
+            
+            if not os.path.exists(cred_file):
+                raise FileNotFoundError(f"找不到憑證檔案：{cred_file}")
+            
+            with open(cred_file, 'r', encoding='utf-8') as f:
+                credentials_info = json.load(f)
+                creds = service_account.Credentials.from_service_account_info(
+                    credentials_info,
+                    scopes=scopes
+                )
+                return creds
+            
+        except Exception as file_error:
+            print(f"從檔案載入憑證失敗：{str(file_error)}")
+            raise
+    
+    except Exception as e:
+        print(f"讀取憑證時發生錯誤：{str(e)}")
+        raise
+
+def login_and_sync(creds, login_code, teacher_manager, course_manager, download_workers=8,
+                   incremental=True, force=False, progress_callback=None, cancel_event=None, clients=None,
+                   thumbnails=True, change_feed=None):
+    # 驗證登入碼，試算表或照片有變動時同步資料；force 為 True 時不論是否變動都同步並重新檢查所有照片
+    # 回傳 dict：is_valid、need_update、cancelled、errors
+    result = {'is_valid': False, 'need_update': False, 'cancelled': False, 'errors': []}
+    if progress_callback:
+        progress_callback('驗證登入碼', 0, 0, '')
+    login_manager = LoginManager(creds, clients)
+    is_valid = login_manager.verify_login(login_code)
+    result['is_valid'] = is_valid
+    
+    if is_valid:
+        sync_service = DataSyncService(
+            creds,
+            teacher_manager,
+            course_manager,
+            login_manager=login_manager,
+            download_workers=download_workers,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
+            thumbnails=thumbnails,
+            change_feed=change_feed
+        )
+        photo_changes = None
+        if force or not incremental:
+            result['need_update'] = True
+        else:
+            if progress_callback:
+                progress_callback('檢查資料變動', 0, 0, '')
+            changes = sync_service.detect_changes()
+            result['need_update'] = changes['changed']
+            photo_changes = changes['photos']
+        
+        print(f"登入成功，需要更新：{result['need_update']}")
+        if not result['need_update']:
+            sync_service.mark_unchanged()
+        else:
+            print("開始更新資料...")
+            start = time.perf_counter()
+            try:
+                sync_service.sync(incremental, photo_changes)
+            except SyncCancelled:
+                print("使用者取消同步，沿用現有資料")
+                result['cancelled'] = True
+            login_manager.timings['同步資料'] = time.perf_counter() - start
+            print(f"同步資料：{login_manager.timings['同步資料'] * 1000:.0f} ms")
+            result['errors'] = sync_service.errors
+    
+    return result
+
+# 每個產生文件的子行程各自保留的 DocumentProcessor（含已解析的範本和照片快取）
+_RENDER_PROCESSORS = {}
+
+class StartupTimer:
+    # 記錄啟動時各階段的耗時，最後一起印出，方便發現啟動變慢
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.last = self.start
+        self.timings = {}
+    
+    def mark(self, phase, now=None):
+        now = time.perf_counter() if now is None else now
+        self.timings[phase] = now - self.last
+        self.last = now
+    
+    def print_timings(self):
+        print("啟動時間：")
+        for phase, seconds in self.timings.items():
+            print(f"  {phase}：{seconds * 1000:.0f} ms")
+        print(f"  合計：{(self.last - self.start) * 1000:.0f} ms")
+
+# 啟動報告中個別測量載入時間的套件
+STARTUP_MODULES = [
+    'PyQt6.QtWidgets',
+    'teacher_doc_core',
+    'teacher_doc_generator',
+    'docx',
+    'odf.opendocument',
+    'PIL.Image',
+    'google.oauth2.service_account',
+    'googleapiclient.discovery'
+]
+
+def measure_import_times(modules=STARTUP_MODULES):
+    # 每個套件在新的行程中載入，測得的是沒有其他套件預先載入時的時間；無法載入的套件為 None
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        code = f"import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+        completed = subprocess.run([sys.executable, '-c', code], cwd=base_dir, capture_output=True, text=True)
+        if completed.returncode == 0:
+            results[module] = float(completed.stdout.strip().splitlines()[-1])
+        else:
+            print(f"無法載入 {module}：{completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else completed.returncode}")
+            results[module] = None
+    return results
+
+def com_initialize():
+    # 操作 Word COM 的執行緒需要先初始化；不是 Windows 時沒有 pythoncom，不需初始化
+    try:
+        import pythoncom
+    except ImportError:
+        return False
+    pythoncom.CoInitialize()
+    return True
+
+def com_uninitialize():
+    try:
+        import pythoncom
+    except ImportError:
+        return
+    pythoncom.CoUninitialize()
+
+def _init_render_process():
+    # 子行程若要操作 Word COM 需要先初始化
+    com_initialize()
+
+def render_document_job(template_path, data, output_path):
+    # 在子行程中產生一份文件，只回傳輸出路徑
+    processor = _RENDER_PROCESSORS.get(template_path)
+    if processor is None:
+        processor = DocumentProcessor(template_path, image_cache={})
+        _RENDER_PROCESSORS[template_path] = processor
+    return processor.process_document(data, output_path)
+
+class ParallelRenderer:
+    # 以多個子行程同時產生文件，python-docx 的處理和壓縮檔寫入可以使用多核心
+    def __init__(self, workers=None, progress_callback=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.progress_callback = progress_callback
+    
+    def render(self, template_path, items):
+        # 行程數不超過文件數
+        summary = {'total': len(items), 'succeeded': 0, 'failed': [], 'elapsed': 0.0, 'per_minute': 0.0,
+                   'workers': min(self.workers, len(items)) or 1}
+        start = time.perf_counter()
+        
+        # .docx 和直接處理的 .odt 可以平行處理；需要用 Word 或 LibreOffice 轉回原格式的範本
+        # 各行程的轉檔池會使用同一組設定檔而互相鎖定，改為逐份產生
+        file_ext = os.path.splitext(template_path)[1].lower()
+        if summary['workers'] > 1 and (file_ext == '.docx' or (file_ext == '.odt' and DocumentProcessor.NATIVE_ODT)):
+            print(f"使用 {summary['workers']} 個行程產生 {len(items)} 份文件...")
+            self._render_parallel(template_path, items, summary)
+        else:
+            summary['workers'] = 1
+            self._render_serial(template_path, items, summary)
+        
+        summary['elapsed'] = time.perf_counter() - start
+        if summary['elapsed'] > 0:
+            summary['per_minute'] = summary['succeeded'] * 60 / summary['elapsed']
+        return summary
+    
+    def _report(self, completed, total, label):
+        if self.progress_callback:
+            self.progress_callback(completed, total, label)
+    
+    def _render_serial(self, template_path, items, summary):
+        processor = DocumentProcessor(template_path, image_cache={})
+        for index, item in enumerate(items):
+            try:
+                processor.process_document(item['data'], item['output_path'])
+                summary['succeeded'] += 1
+            except Exception as e:
+                print(f"批次產生失敗：{item['label']}：{str(e)}")
+                summary['failed'].append((item['label'], str(e)))
+            self._report(index + 1, len(items), item['label'])
+    
+    def _render_parallel(self, template_path, items, summary):
+        # 統一使用 spawn：避免在有背景執行緒的 Qt 程式中 fork，行為也和 Windows 相同
+        mp_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=summary['workers'], mp_context=mp_context,
+                                 initializer=_init_render_process) as executor:
+            futures = {
+                executor.submit(render_document_job, template_path, item['data'], item['output_path']): item
+                for item in items
+            }
+            completed = 0
+            for future in as_completed(futures):
+                item = futures[future]
+                completed += 1
+                try:
+                    future.result()
+                    summary['succeeded'] += 1
+                except Exception as e:
+                    print(f"批次產生失敗：{item['label']}：{str(e)}")
+                    summary['failed'].append((item['label'], str(e)))
+                self._report(completed, len(items), item['label'])
+
+def write_json_atomic(path, data, compact=False):
+    # 先寫入同目錄的暫存檔再改名，中途當機也不會留下寫一半的檔案
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.json', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            if compact:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            else:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def merge_records(teacher_data, course_data):
+    # 合併教師和課程資料供文件使用，兩邊的照片資訊都要保留
+    combined = {**teacher_data, **course_data}
+    combined['assets'] = {**teacher_data.get('assets', {}), **course_data.get('assets', {})}
+    return combined
+
+def output_path_for(template_path, teacher_data, course_data):
+    # 輸出檔案放在範本檔的目錄，檔名加入日期，格式與範本相同
+    timestamp = datetime.now().strftime('%Y%m%d')
+    file_ext = os.path.splitext(template_path)[1].lower()
+    output_filename = f"{course_data.get('course_name', 'unknown')} - {teacher_data.get('name', 'unknown')}_{timestamp}{file_ext}"
+    return os.path.join(os.path.dirname(os.path.abspath(template_path)), output_filename)
+
+def build_batch_items(teacher_manager, course_manager, course_choices, template_path):
+    # course_choices 為 [(課程分類, 課程ID)]，每位符合分類的教師產生一份文件
+    items = []
+    for course_type, course_id in course_choices:
+        course_data = course_manager.courses.get(course_id)
+        if not course_data:
+            continue
+        for teacher_id, teacher_data in teacher_manager.find_by_course_type(course_type):
+            items.append({
+                'label': f"{course_data.get('course_name', 'unknown')} - {teacher_data.get('name', 'unknown')}",
+                'data': merge_records(teacher_data, course_data),
+                'output_path': output_path_for(template_path, teacher_data, course_data)
+            })
+    return items
+
+def split_course_types(value):
+    # 教師的課程分類以「、」分隔，例如：3D筆、桌遊
+    return [course_type.strip() for course_type in (value or '').split('、') if course_type.strip()]
+
+class InvertedIndex:
+    def __init__(self, key_func):
+        # key_func 回傳一筆紀錄對應的所有鍵，例如教師的所有課程分類
+        self.key_func = key_func
+        # 以 dict 當作有序集合，保留紀錄加入的順序
+        self.ids_by_key = {}
+        self.keys_by_id = {}
+    
+    def add(self, record_id, record):
+        self.remove(record_id)
+        keys = self.key_func(record)
+        self.keys_by_id[record_id] = keys
+        for key in keys:
+            self.ids_by_key.setdefault(key, {})[record_id] = None
+    
+    def remove(self, record_id):
+        for key in self.keys_by_id.pop(record_id, []):
+            ids = self.ids_by_key.get(key)
+            if ids is not None:
+                ids.pop(record_id, None)
+                if not ids:
+                    del self.ids_by_key[key]
+    
+    def clear(self):
+        self.ids_by_key = {}
+        self.keys_by_id = {}
+    
+    def rebuild(self, records):
+        self.clear()
+        for record_id, record in records.items():
+            self.add(record_id, record)
+    
+    def get(self, key):
+        return list(self.ids_by_key.get(key, {}))
+    
+    def keys(self):
+        return list(self.ids_by_key)
+
+class SQLiteRecordMapping(MutableMapping):
+    def __init__(self, conn, table, columns):
+        self.conn = conn
+        self.table = table
+        # 額外建立索引的欄位：{資料表欄位: 紀錄欄位}
+        self.columns = columns
+    
+    def __getitem__(self, record_id):
+        row = self.conn.execute(
+            f"SELECT data FROM {self.table} WHERE id = ?", (record_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(record_id)
+        return json.loads(row[0])
+    
+    @contextmanager
+    def _write(self):
+        # 不在批次交易中時，每次寫入各自成為一個交易
+        if self.conn.in_transaction:
+            yield
+            return
+        self.conn.execute("BEGIN")
+        try:
+            yield
+        except Exception:
+            self.conn.rollback()
+            raise
+        else:
+            self.conn.commit()
+    
+    def __setitem__(self, record_id, record):
+        with self._write():
+            self._upsert(record_id, record)
+    
+    def _upsert(self, record_id, record):
+        columns = list(self.columns)
+        values = [str(record.get(field, '') or '') for field in self.columns.values()]
+        self.conn.execute(
+            f"INSERT INTO {self.table} (id, position, {', '.join(columns)}, data) "
+            f"VALUES (?, COALESCE((SELECT MAX(position) FROM {self.table}), 0) + 1, "
+            f"{', '.join('?' for _ in columns)}, ?) "
+            f"ON CONFLICT(id) DO UPDATE SET "
+            f"{', '.join(f'{column} = excluded.{column}' for column in columns)}, data = excluded.data",
+            [record_id] + values + [json.dumps(record, ensure_ascii=False)]
+        )
+        self._after_write(record_id, record)
+    
+    def __delitem__(self, record_id):
+        with self._write():
+            cursor = self.conn.execute(f"DELETE FROM {self.table} WHERE id = ?", (record_id,))
+            if cursor.rowcount == 0:
+                raise KeyError(record_id)
+            self._after_delete(record_id)
+    
+    def __iter__(self):
+        rows = self.conn.execute(f"SELECT id FROM {self.table} ORDER BY position").fetchall()
+        return iter([row[0] for row in rows])
+    
+    def __len__(self):
+        return self.conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+    
+    def __contains__(self, record_id):
+        return self.conn.execute(
+            f"SELECT 1 FROM {self.table} WHERE id = ?", (record_id,)
+        ).fetchone() is not None
+    
+    def items(self):
+        rows = self.conn.execute(f"SELECT id, data FROM {self.table} ORDER BY position").fetchall()
+        return [(record_id, json.loads(data)) for record_id, data in rows]
+    
+    def values(self):
+        return [record for _, record in self.items()]
+    
+    def clear(self):
+        with self._write():
+            self.conn.execute(f"DELETE FROM {self.table}")
+            self._after_clear()
+    
+    def find(self, column, value):
+        rows = self.conn.execute(
+            f"SELECT id, data FROM {self.table} WHERE {column} = ? ORDER BY position", (value,)
+        ).fetchall()
+        return [(record_id, json.loads(data)) for record_id, data in rows]
+    
+    def _after_write(self, record_id, record):
+        pass
+    
+    def _after_delete(self, record_id):
+        pass
+    
+    def _after_clear(self):
+        pass
+
+class SQLiteTeacherMapping(SQLiteRecordMapping):
+    def __init__(self, conn):
+        super().__init__(conn, 'teachers', {'region': 'region', 'name': 'name'})
+    
+    def _after_write(self, teacher_id, teacher):
+        # 課程分類正規化成多對多的對照表
+        self.conn.execute("DELETE FROM teacher_course_types WHERE teacher_id = ?", (teacher_id,))
+        for course_type in split_course_types(teacher.get('course_type', '')):
+            self.conn.execute("INSERT OR IGNORE INTO course_types (name) VALUES (?)", (course_type,))
+            self.conn.execute(
+                "INSERT OR IGNORE INTO teacher_course_types (teacher_id, course_type_id) "
+                "SELECT ?, id FROM course_types WHERE name = ?",
+                (teacher_id, course_type)
+            )
+    
+    def _after_delete(self, teacher_id):
+        self.conn.execute("DELETE FROM teacher_course_types WHERE teacher_id = ?", (teacher_id,))
+    
+    def _after_clear(self):
+        self.conn.execute("DELETE FROM teacher_course_types")
+    
+    def _course_type_rows(self, columns, course_type):
+        return self.conn.execute(
+            f"SELECT {columns} FROM teachers t "
+            "JOIN teacher_course_types tc ON tc.teacher_id = t.id "
+            "JOIN course_types c ON c.id = tc.course_type_id "
+            "WHERE c.name = ? ORDER BY t.position",
+            (course_type,)
+        ).fetchall()
+    
+    def find_by_course_type(self, course_type):
+        return [(teacher_id, json.loads(data)) for teacher_id, data in self._course_type_rows('t.id, t.data', course_type)]
+    
+    def names_by_course_type(self, course_type):
+        # 只讀取 ID 和姓名欄位，不需解析整筆資料
+        return [(teacher_id, name or '') for teacher_id, name in self._course_type_rows('t.id, t.name', course_type)]
+
+class SQLiteDataStore:
+    DB_PATH = 'teacherdoc.db'
+    
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        # 資料管理器可能在同步用的背景執行緒中使用，但同一時間只有一個執行緒存取
+        # 交易由 begin/commit 自行控制
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._create_tables()
+    
+    def _create_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS teachers (
+                id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                region TEXT,
+                name TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_teachers_region ON teachers (region);
+            CREATE INDEX IF NOT EXISTS idx_teachers_name ON teachers (name);
+            
+            CREATE TABLE IF NOT EXISTS course_types (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE
+            );
+            
+            CREATE TABLE IF NOT EXISTS teacher_course_types (
+                teacher_id TEXT NOT NULL,
+                course_type_id INTEGER NOT NULL,
+                PRIMARY KEY (teacher_id, course_type_id)
+            );
+            CREATE INDEX IF NOT EXISTS idx_teacher_course_types_type
+                ON teacher_course_types (course_type_id);
+            
+            CREATE TABLE IF NOT EXISTS courses (
+                id TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                course_name TEXT,
+                course TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_courses_course ON courses (course);
+            CREATE INDEX IF NOT EXISTS idx_courses_name ON courses (course_name);
+        """)
+    
+    def teacher_records(self):
+        return SQLiteTeacherMapping(self.conn)
+    
+    def course_records(self):
+        return SQLiteRecordMapping(self.conn, 'courses', {'course_name': 'course_name', 'course': 'course'})
+    
+    def begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+    
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.commit()
+    
+    def rollback(self):
+        if self.conn.in_transaction:
+            self.conn.rollback()
+    
+    def close(self):
+        self.conn.close()
+
+class TeacherDataManager:
+    def __init__(self, compact=False, backend='json'):
+        self.compact = compact
+        # backend 可選 'json'（teachers.json）或 'sqlite'（teacherdoc.db）
+        self.store = SQLiteDataStore() if backend == 'sqlite' else None
+        self.teachers = self._load_teachers()
+        # 課程分類 → 教師 ID 的索引，以及教師姓名，切換課程時不需讀取資料；
+        # SQLite 直接查詢 teacher_course_types 對照表，啟動時不需載入所有資料建立索引
+        self.course_index = InvertedIndex(lambda teacher: split_course_types(teacher.get('course_type', '')))
+        self.teacher_names = {}
+        if self.store is None:
+            self._rebuild_index()
+        self._batch_depth = 0
+        self._batch_snapshot = None
+        self._dirty = False
+    
+    def _load_teachers(self):
+        if self.store is not None:
+            teachers = self.store.teacher_records()
+            # 第一次使用 SQLite 時匯入原本的 JSON 資料
+            if len(teachers) == 0 and os.path.exists('teachers.json'):
+                self.store.begin()
+                with open('teachers.json', 'r', encoding='utf-8') as f:
+                    for record_id, record in json.load(f).items():
+                        teachers[record_id] = record
+                self.store.commit()
+            return teachers
+        
+        if os.path.exists('teachers.json'):
+            with open('teachers.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+    
+    @contextmanager
+    def batch(self):
+        # 批次內的新增只寫入記憶體，離開時才一次存檔；發生錯誤則還原
+        if self._batch_depth == 0:
+            # SQLite 使用交易還原，JSON 則保留一份記憶體中的副本
+            self._batch_snapshot = dict(self.teachers) if self.store is None else None
+            self._dirty = False
+            if self.store is not None:
+                self.store.begin()
+        self._batch_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                if self.store is not None:
+                    self.store.rollback()
+                else:
+                    self.teachers = self._batch_snapshot
+                    self._rebuild_index()
+                self._batch_snapshot = None
+                self._dirty = False
+            raise
+        else:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._batch_snapshot = None
+                if self._dirty:
+                    self._save_teachers()
+                    self._dirty = False
+    
+    def _next_id(self):
+        return str(max((int(tid) for tid in self.teachers if tid.isdigit()), default=0) + 1)
+    
+    def add_teacher(self, teacher_data, teacher_id=None):
+        if teacher_id is None:
+            teacher_id = self._next_id()
+        self.teachers[teacher_id] = teacher_data
+        if self.store is None:
+            self.course_index.add(teacher_id, teacher_data)
+            self.teacher_names[teacher_id] = teacher_data.get('name', '')
+        self._changed()
+        return teacher_id
+    
+    def add_many(self, teachers):
+        # 可傳入 {ID: 資料} 或資料列表
+        with self.batch():
+            if isinstance(teachers, dict):
+                return [self.add_teacher(data, teacher_id) for teacher_id, data in teachers.items()]
+            return [self.add_teacher(data) for data in teachers]
+    
+    def replace_teachers(self, teachers):
+        with self.batch():
+            self.teachers.clear()
+            self.course_index.clear()
+            self.teacher_names = {}
+            self.add_many(teachers)
+    
+    def _changed(self):
+        if self._batch_depth > 0:
+            self._dirty = True
+        else:
+            self._save_teachers()
+        
+    def _rebuild_index(self):
+        teachers = dict(self.teachers.items())
+        self.course_index.rebuild(teachers)
+        self.teacher_names = {teacher_id: teacher.get('name', '') for teacher_id, teacher in teachers.items()}
+    
+    def teachers_for_course(self, course_type):
+        # 回傳 [(教師ID, 姓名)]，JSON 只查記憶體中的索引，SQLite 以對照表查詢
+        if self.store is not None:
+            return self.teachers.names_by_course_type(course_type)
+        return [(teacher_id, self.teacher_names[teacher_id]) for teacher_id in self.course_index.get(course_type)]
+    
+    def find_by_course_type(self, course_type):
+        if self.store is not None:
+            return self.teachers.find_by_course_type(course_type)
+        return [(teacher_id, self.teachers[teacher_id]) for teacher_id in self.course_index.get(course_type)]
+    
+    def find_by_region(self, region):
+        if self.store is not None:
+            return self.teachers.find('region', region)
+        return [(teacher_id, teacher) for teacher_id, teacher in self.teachers.items() if teacher.get('region') == region]
+    
+    def find_by_name(self, name):
+        if self.store is not None:
+            return self.teachers.find('name', name)
+        return [(teacher_id, teacher) for teacher_id, teacher in self.teachers.items() if teacher.get('name') == name]
+        
+    def _save_teachers(self):
+        if self.store is not None:
+            self.store.commit()
+        else:
+            write_json_atomic('teachers.json', self.teachers, self.compact)
+
+class CourseDataManager:
+    def __init__(self, compact=False, backend='json'):
+        self.compact = compact
+        # backend 可選 'json'（courses.json）或 'sqlite'（teacherdoc.db）
+        self.store = SQLiteDataStore() if backend == 'sqlite' else None
+        self.courses = self._load_courses()
+        # 課程分類 → 課程 ID 的索引
+        self.type_index = InvertedIndex(lambda course: [course['course']] if course.get('course') else [])
+        self.type_index.rebuild(dict(self.courses.items()))
+        self._batch_depth = 0
+        self._batch_snapshot = None
+        self._dirty = False
+    
+    def _load_courses(self):
+        if self.store is not None:
+            courses = self.store.course_records()
+            # 第一次使用 SQLite 時匯入原本的 JSON 資料
+            if len(courses) == 0 and os.path.exists('courses.json'):
+                self.store.begin()
+                with open('courses.json', 'r', encoding='utf-8') as f:
+                    for record_id, record in json.load(f).items():
+                        courses[record_id] = record
+                self.store.commit()
+            return courses
+        
+        if os.path.exists('courses.json'):
+            with open('courses.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+    
+    @contextmanager
+    def batch(self):
+        # 批次內的新增只寫入記憶體，離開時才一次存檔；發生錯誤則還原
+        if self._batch_depth == 0:
+            # SQLite 使用交易還原，JSON 則保留一份記憶體中的副本
+            self._batch_snapshot = dict(self.courses) if self.store is None else None
+            self._dirty = False
+            if self.store is not None:
+                self.store.begin()
+        self._batch_depth += 1
+        try:
+            yield self
+        except Exception:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                if self.store is not None:
+                    self.store.rollback()
+                else:
+                    self.courses = self._batch_snapshot
+                self.type_index.rebuild(dict(self.courses.items()))
+                self._batch_snapshot = None
+                self._dirty = False
+            raise
+        else:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._batch_snapshot = None
+                if self._dirty:
+                    self._save_courses()
+                    self._dirty = False
+    
+    def _next_id(self):
+        return str(max((int(cid) for cid in self.courses if cid.isdigit()), default=0) + 1)
+    
+    def add_course(self, course_data, course_id=None):
+        if course_id is None:
+            course_id = self._next_id()
+        self.courses[course_id] = course_data
+        self.type_index.add(course_id, course_data)
+        self._changed()
+        return course_id
+    
+    def add_many(self, courses):
+        # 可傳入 {ID: 資料} 或資料列表
+        with self.batch():
+            if isinstance(courses, dict):
+                return [self.add_course(data, course_id) for course_id, data in courses.items()]
+            return [self.add_course(data) for data in courses]
+    
+    def replace_courses(self, courses):
+        with self.batch():
+            self.courses.clear()
+            self.type_index.clear()
+            self.add_many(courses)
+    
+    def _changed(self):
+        if self._batch_depth > 0:
+            self._dirty = True
+        else:
+            self._save_courses()
+    
+    def find_by_course_type(self, course_type):
+        return [(course_id, self.courses[course_id]) for course_id in self.type_index.get(course_type)]
+    
+    def course_type_choices(self):
+        # 不重複的課程分類，每個分類對應最後一筆課程的 ID
+        return sorted((course_type, self.type_index.get(course_type)[-1]) for course_type in self.type_index.keys())
+    
+    def _save_courses(self):
+        if self.store is not None:
+            self.store.commit()
+        else:
+            write_json_atomic('courses.json', self.courses, self.compact)
+
+class FileHashCache:
+    # 檔案內容的 md5，以 (路徑, 修改時間, 大小) 記住結果，檔案沒變動時不再重新讀取
+    def __init__(self):
+        self.hashes = {}
+        self.lock = threading.Lock()
+    
+    def md5(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            file_hash = self.hashes.get(key)
+        if file_hash is None:
+            md5 = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    md5.update(chunk)
+            file_hash = md5.hexdigest()
+            with self.lock:
+                self.hashes[key] = file_hash
+        return file_hash
+
+FILE_HASHES = FileHashCache()
+
+class ImageDerivativeCache:
+    # 嵌入文件用的縮圖：依 EXIF 轉正、縮小到版面尺寸並重新壓縮成 JPEG
+    # 以本機原始檔內容的 md5（照片快取清單記錄的值）和像素寬度命名，同一張照片只處理一次
+    DERIVATIVE_DIR = 'images/derivatives'
+    # 命名方式變更時調高版本，舊的縮圖會在下次同步時清除
+    # （版本 2：舊版以 Drive 的 md5 命名，下載失敗時可能以新 md5 保存了舊照片的縮圖）
+    NAME_VERSION = 2
+    SLOT_WIDTH_INCHES = 2
+    DPI = 200
+    JPEG_QUALITY = 85
+    
+    def __init__(self, derivative_dir=DERIVATIVE_DIR):
+        self.derivative_dir = derivative_dir
+        # 已確認存在的縮圖
+        self.known_paths = set()
+        self.lock = threading.Lock()
+    
+    def derivative_path(self, source_path, width_inches=SLOT_WIDTH_INCHES, source_hash=None):
+        width_px = int(width_inches * self.DPI)
+        source_hash = source_hash or FILE_HASHES.md5(source_path)
+        return os.path.join(self.derivative_dir, f"v{self.NAME_VERSION}_{source_hash[:20]}_{width_px}.jpg")
+    
+    def get(self, source_path, width_inches=SLOT_WIDTH_INCHES, source_hash=None):
+        # 回傳縮圖路徑；無法處理的檔案直接使用原始照片
+        # 已知原始檔 md5 時（同步時記錄）不需再讀取原始檔計算雜湊
+        try:
+            path = self.derivative_path(source_path, width_inches, source_hash)
+            if path in self.known_paths:
+                return path
+            if not os.path.exists(path):
+                self._create(source_path, path, int(width_inches * self.DPI))
+            self.known_paths.add(path)
+            return path
+        except Exception as e:
+            print(f"建立縮圖失敗，使用原始照片：{source_path}：{str(e)}")
+            return source_path
+    
+    def _create(self, source_path, path, width_px):
+        from PIL import Image, ImageOps
+        os.makedirs(self.derivative_dir, exist_ok=True)
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            # 透明背景改為白色，JPEG 不支援透明
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+            # 只縮小不放大
+            if image.width > width_px:
+                height_px = max(1, round(image.height * width_px / image.width))
+                image = image.resize((width_px, height_px), Image.Resampling.LANCZOS)
+            
+            # 先寫入暫存檔再改名，多個行程同時建立同一張縮圖也不會讀到寫到一半的檔案
+            fd, tmp_path = tempfile.mkstemp(dir=self.derivative_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    image.save(f, 'JPEG', quality=self.JPEG_QUALITY, optimize=True, dpi=(self.DPI, self.DPI))
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+    
+    def prepare(self, sources, progress_callback=None):
+        # 同步後先建立所有使用中照片的縮圖，並刪除不再需要的縮圖
+        # sources 為 {原始檔路徑: md5 或 None}
+        keep = set()
+        source_paths = sorted(sources)
+        for index, source_path in enumerate(source_paths):
+            if os.path.exists(source_path):
+                path = self.get(source_path, source_hash=sources[source_path])
+                if path != source_path:
+                    keep.add(os.path.normpath(path))
+            if progress_callback:
+                progress_callback(index + 1, len(source_paths), os.path.basename(source_path))
+        
+        removed = 0
+        if os.path.exists(self.derivative_dir):
+            for name in os.listdir(self.derivative_dir):
+                path = os.path.normpath(os.path.join(self.derivative_dir, name))
+                if path not in keep:
+                    os.remove(path)
+                    self.known_paths.discard(path)
+                    removed += 1
+        print(f"照片縮圖：使用 {len(keep)} 張，清除 {removed} 張")
+
+IMAGE_DERIVATIVES = ImageDerivativeCache()
+
+class AssetIndex:
+    # 照片資料夾中檔案的索引：含副檔名和不含副檔名的路徑都對應到實際檔案
+    # 只在第一次查詢時列出資料夾，之後每個標記都是字典查詢，不再逐一檢查副檔名
+    def __init__(self, photo_dirs=PhotoCache.PHOTO_DIRS):
+        self.photo_dirs = [os.path.normpath(photo_dir) for photo_dir in photo_dirs]
+        self.paths = None
+        self.lock = threading.Lock()
+    
+    def _build(self):
+        paths = {}
+        for photo_dir in self.photo_dirs:
+            if not os.path.exists(photo_dir):
+                continue
+            for root, dirs, files in os.walk(photo_dir):
+                for name in sorted(files):
+                    path = os.path.normpath(os.path.join(root, name))
+                    paths[path] = path
+                    paths.setdefault(os.path.splitext(path)[0], path)
+        print(f"照片索引：{len(set(paths.values()))} 個檔案")
+        return paths
+    
+    def covers(self, path):
+        path = os.path.normpath(path)
+        directory = os.path.dirname(path)
+        return any(directory == photo_dir or directory.startswith(photo_dir + os.sep) for photo_dir in self.photo_dirs)
+    
+    def resolve(self, path):
+        # 回傳實際檔案路徑，找不到時回傳 None
+        with self.lock:
+            if self.paths is None:
+                self.paths = self._build()
+            key = os.path.normpath(path)
+            return self.paths.get(key) or self.paths.get(os.path.splitext(key)[0])
+    
+    def invalidate(self):
+        # 同步改變照片資料夾後呼叫，下次查詢時重新建立
+        with self.lock:
+            self.paths = None
+
+ASSET_INDEX = AssetIndex()
+
+class OfficeInstance:
+    # 一個長時間執行的 headless LibreOffice，使用自己的使用者設定檔，
+    # 多個實例同時轉檔時不會搶同一個設定檔的鎖定
+    FILTERS = {'docx': 'MS Word 2007 XML', 'odt': 'writer8'}
+    
+    def __init__(self, index, soffice, profile_root, use_uno, start_timeout=60, convert_timeout=120):
+        self.index = index
+        self.soffice = soffice
+        self.profile_dir = os.path.join(profile_root, f'profile_{index}')
+        self.use_uno = use_uno
+        self.start_timeout = start_timeout
+        self.convert_timeout = convert_timeout
+        self.process = None
+        self.port = None
+        self.desktop = None
+    
+    def _profile_url(self):
+        return Path(os.path.abspath(self.profile_dir)).as_uri()
+    
+    def start(self):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if not self.use_uno:
+            return
+        # 取得一個未使用的連接埠
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            self.port = sock.getsockname()[1]
+        print(f"啟動 LibreOffice #{self.index}（連接埠 {self.port}）...")
+        self.process = subprocess.Popen([
+            self.soffice,
+            f'-env:UserInstallation={self._profile_url()}',
+            '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+            f'--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext'
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        
+        # 等待 LibreOffice 開始接受連線
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                self.desktop = self._connect()
+                return
+            except Exception as e:
+                if self.process.poll() is not None:
+                    raise Exception(f"LibreOffice #{self.index} 啟動失敗（結束代碼 {self.process.returncode}）")
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise Exception(f"LibreOffice #{self.index} 啟動逾時：{str(e)}")
+                time.sleep(0.5)
+    
+    def _connect(self):
+        import uno
+        local_ctx = uno.getComponentContext()
+        resolver = local_ctx.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local_ctx)
+        ctx = resolver.resolve(f'uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext')
+        return ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+    
+    def is_healthy(self):
+        if not self.use_uno:
+            return True
+        if self.process is None or self.process.poll() is not None or self.desktop is None:
+            return False
+        try:
+            # 能取得目前開啟的文件清單表示連線和程式都正常
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+    
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+    
+    def restart(self):
+        print(f"重新啟動 LibreOffice #{self.index}...")
+        self.stop()
+        self.start()
+    
+    def convert(self, source_path, target_ext, output_dir):
+        output_path = os.path.join(output_dir, os.path.splitext(os.path.basename(source_path))[0] + '.' + target_ext)
+        if self.use_uno:
+            self._convert_uno(source_path, output_path, target_ext)
+        else:
+            self._convert_cli(source_path, target_ext, output_dir)
+        if not os.path.exists(output_path):
+            raise Exception(f"轉換後找不到檔案：{output_path}")
+        return output_path
+    
+    def _convert_uno(self, source_path, output_path, target_ext):
+        import uno
+        from com.sun.star.beans import PropertyValue
+        
+        def prop(name, value):
+            item = PropertyValue()
+            item.Name = name
+            item.Value = value
+            return item
+        
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(source_path)), '_blank', 0, (prop('Hidden', True),)
+        )
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                           (prop('FilterName', self.FILTERS[target_ext]), prop('Overwrite', True)))
+        finally:
+            doc.close(True)
+    
+    def _convert_cli(self, source_path, target_ext, output_dir):
+        # 沒有 uno 模組時改用命令列轉檔，仍使用此位置專用的設定檔
+        result = subprocess.run([
+            self.soffice,
+            f'-env:UserInstallation={self._profile_url()}',
+            '--headless',
+            '--convert-to', target_ext,
+            '--outdir', output_dir,
+            source_path
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=self.convert_timeout)
+        if result.returncode != 0:
+            raise Exception(f"LibreOffice 轉檔失敗（結束代碼 {result.returncode}）")
+
+class OfficeConversionPool:
+    # 固定數量的 LibreOffice 實例，轉檔工作交給閒置的實例處理
+    # 有 uno 模組時實例常駐並以 socket 連線；否則每次轉檔啟動命令列，只是各位置使用獨立設定檔避免互相鎖定，
+    # 沒有省下啟動時間
+    SOFFICE = 'soffice'
+    PROFILE_ROOT = os.path.join(tempfile.gettempdir(), 'teacherdoc_office')
+    
+    def __init__(self, size=2, soffice=SOFFICE, profile_root=PROFILE_ROOT, use_uno=None):
+        if use_uno is None:
+            use_uno = importlib.util.find_spec('uno') is not None
+        self.use_uno = use_uno
+        if not use_uno:
+            # 沒有 uno 就無法操作常駐的 LibreOffice，每次轉檔仍要啟動 soffice，轉檔池不會比較快
+            print("找不到 uno 模組（LibreOffice 附的 Python 才有），每次轉檔都會啟動 soffice，"
+                  "無法省下 LibreOffice 的啟動時間")
+        self.instances = [OfficeInstance(i, soffice, profile_root, use_uno) for i in range(size)]
+        # 後進先出：連續轉檔時優先使用剛用過、已啟動的實例
+        self.idle = queue.LifoQueue()
+        for instance in reversed(self.instances):
+            self.idle.put(instance)
+        self.started = set()
+    
+    def convert(self, source_path, target_ext, output_dir=None, retries=1):
+        output_dir = output_dir or os.path.dirname(os.path.abspath(source_path))
+        instance = self.idle.get()
+        try:
+            for attempt in range(retries + 1):
+                try:
+                    if instance.index not in self.started:
+                        instance.start()
+                        self.started.add(instance.index)
+                    elif not instance.is_healthy():
+                        instance.restart()
+                    return instance.convert(source_path, target_ext, output_dir)
+                except Exception as e:
+                    if attempt >= retries:
+                        raise
+                    # 轉檔失敗可能是 LibreOffice 當掉，重新啟動後再試一次
+                    print(f"LibreOffice #{instance.index} 轉檔失敗，重新啟動後重試：{str(e)}")
+                    try:
+                        instance.restart()
+                    except Exception as restart_error:
+                        print(f"重新啟動 LibreOffice 失敗：{str(restart_error)}")
+        finally:
+            self.idle.put(instance)
+    
+    def shutdown(self):
+        for instance in self.instances:
+            instance.stop()
+        self.started.clear()
+
+_OFFICE_POOL = None
+_OFFICE_POOL_LOCK = threading.Lock()
+
+def get_office_pool():
+    # 整個行程共用一個轉檔池，第一次需要轉檔時才建立
+    global _OFFICE_POOL
+    with _OFFICE_POOL_LOCK:
+        if _OFFICE_POOL is None:
+            _OFFICE_POOL = OfficeConversionPool(size=int(os.getenv('TEACHERDOC_OFFICE_WORKERS', 2)))
+            atexit.register(_OFFICE_POOL.shutdown)
+        return _OFFICE_POOL
+
+class ConvertedTemplateCache:
+    # .odt/.doc 範本轉成的 .docx，以範本內容的 md5 命名存放在程式自己的快取資料夾，
+    # 同一版範本只轉檔一次，也不會覆寫使用者範本旁邊的檔案
+    CACHE_DIR = 'cache/templates'
+    MAX_FILES = 20
+    
+    def __init__(self, cache_dir=CACHE_DIR, max_files=MAX_FILES):
+        self.cache_dir = cache_dir
+        self.max_files = max_files
+        self.lock = threading.Lock()
+    
+    def get(self, template_path):
+        file_ext = os.path.splitext(template_path)[1].lower()
+        cached_path = os.path.join(self.cache_dir, f"{FILE_HASHES.md5(template_path)[:20]}{file_ext.replace('.', '_')}.docx")
+        # 同一個行程中避免兩個執行緒同時轉換同一個範本
+        with self.lock:
+            if os.path.exists(cached_path):
+                return cached_path
+            
+            print(f"轉換範本 {os.path.basename(template_path)} 到 DOCX 格式...")
+            os.makedirs(self.cache_dir, exist_ok=True)
+            work_dir = tempfile.mkdtemp(dir=self.cache_dir)
+            try:
+                if file_ext == '.doc':
+                    converted_path = self._convert_doc(template_path, work_dir)
+                else:
+                    converted_path = get_office_pool().convert(template_path, 'docx', work_dir)
+                # 轉換完成後才改名，中斷時不會留下不完整的快取
+                os.replace(converted_path, cached_path)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+            self._prune()
+            return cached_path
+    
+    def _convert_doc(self, template_path, work_dir):
+        import win32com.client
+        word = win32com.client.Dispatch('Word.Application')
+        doc = word.Documents.Open(os.path.abspath(template_path))
+        docx_path = os.path.join(os.path.abspath(work_dir), os.path.splitext(os.path.basename(template_path))[0] + '.docx')
+        doc.SaveAs2(docx_path, FileFormat=16)  # 16 代表 .docx 格式
+        doc.Close()
+        word.Quit()
+        return docx_path
+    
+    def _prune(self):
+        # 只保留最近使用的幾個版本
+        files = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir) if name.endswith('.docx')]
+        files.sort(key=os.path.getmtime, reverse=True)
+        for path in files[self.max_files:]:
+            os.remove(path)
+
+CONVERTED_TEMPLATES = ConvertedTemplateCache()
+
+class CompiledTemplate:
+    # 已解析的 .docx 範本：保留檔案內容，並記錄每個標記所在的表格儲存格和段落
+    def __init__(self, template_path):
+        self.template_path = template_path
+        with open(template_path, 'rb') as f:
+            self.blob = f.read()
+        self.table_slots = []
+        self.paragraph_slots = []
+        from docx import Document
+        self._index(Document(io.BytesIO(self.blob)))
+    
+    def _index(self, doc):
+        from docx.table import _Cell
+        for table_index, table in enumerate(doc.tables):
+            slots = []
+            seen_cells = set()
+            for i, row in enumerate(table.rows):
+                for j, cell in enumerate(row.cells):
+                    # 合併儲存格在 row.cells 中會重複出現，只記錄一次
+                    # 保留元素本身而不是 id()，lxml 的元素物件釋放後 id 會被其他儲存格重複使用
+                    if cell._tc in seen_cells:
+                        continue
+                    seen_cells.add(cell._tc)
+                    markers = MARKER_PATTERN.findall(cell.text)
+                    if not markers:
+                        continue
+                    table_marker = next((marker for marker in markers if marker in TABLE_MARKERS), None)
+                    slots.append((i, j, table_marker))
+                    if table_marker:
+                        # 表格標記會填入下方各列，同一列其餘儲存格不再處理
+                        break
+            # 直接從表格的儲存格元素核對，含標記的儲存格都必須有位置，否則產生的文件會留下標記
+            expected = 0
+            for tr in table._tbl.tr_lst:
+                for tc in tr.tc_lst:
+                    markers = MARKER_PATTERN.findall(_Cell(tc, table).text)
+                    if markers:
+                        expected += 1
+                        if any(marker in TABLE_MARKERS for marker in markers):
+                            break
+            if expected != len(slots):
+                raise ValueError(f"範本表格 {table_index} 有 {expected} 個含標記的儲存格，只找到 {len(slots)} 個位置")
+            if slots:
+                self.table_slots.append((table_index, slots))
+        
+        for paragraph_index, paragraph in enumerate(doc.paragraphs):
+            if MARKER_PATTERN.search(paragraph.text):
+                self.paragraph_slots.append(paragraph_index)
+        
+        print(f"範本標記位置：表格 {sum(len(slots) for _, slots in self.table_slots)} 個，段落 {len(self.paragraph_slots)} 個")
+    
+    def new_document(self):
+        # 從記憶體中的範本內容建立新文件，不需重新讀檔和尋找標記
+        from docx import Document
+        return Document(io.BytesIO(self.blob))
+
+class TemplateCache:
+    # 以路徑、修改時間和大小為鍵的 LRU 快取，範本檔變更後自動重新解析
+    def __init__(self, max_size=8, factory=CompiledTemplate):
+        self.max_size = max_size
+        self.factory = factory
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+    
+    def _key(self, template_path):
+        stat = os.stat(template_path)
+        return (os.path.abspath(template_path), stat.st_mtime_ns, stat.st_size)
+    
+    def get(self, template_path):
+        key = self._key(template_path)
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None:
+                self.templates.move_to_end(key)
+                return template
+        
+        print(f"解析範本：{template_path}")
+        template = self.factory(template_path)
+        with self.lock:
+            self.templates[key] = template
+            self.templates.move_to_end(key)
+            while len(self.templates) > self.max_size:
+                self.templates.popitem(last=False)
+        return template
+    
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+
+TEMPLATE_CACHE = TemplateCache()
+
+class OdtTemplate:
+    # .odt 範本內容保留在記憶體中，每次產生時從記憶體載入
+    def __init__(self, template_path):
+        self.template_path = template_path
+        with open(template_path, 'rb') as f:
+            self.blob = f.read()
+    
+    def new_document(self):
+        from odf.opendocument import load
+        return load(io.BytesIO(self.blob))
+
+ODT_TEMPLATE_CACHE = TemplateCache(factory=OdtTemplate)
+
+class OdtRenderer:
+    # 直接在 ODF XML 中替換標記和展開表格，不需用 LibreOffice 轉成 .docx 再轉回來
+    # 文字標記只改動所在的文字節點，段落和文字樣式都會保留
+    PARAGRAPH_TAGS = ((TEXTNS, 'p'), (TEXTNS, 'h'))
+    ROW_TAG = (TABLENS, 'table-row')
+    CELL_TAGS = ((TABLENS, 'table-cell'), (TABLENS, 'covered-table-cell'))
+    # 巢狀表格、圖框和註腳中的文字不屬於外層的段落或表格
+    SKIP_TAGS = ((TABLENS, 'table'), (DRAWNS, 'frame'), (TEXTNS, 'note'))
+    # 展開重複的列或儲存格時的上限，避免空白列重複上千次
+    MAX_REPEAT = 100
+    
+    def __init__(self, processor):
+        self.processor = processor
+        self.doc = None
+        self.pictures = {}
+        self.image_count = 0
+    
+    def render(self, template, data, output_path):
+        self.doc = template.new_document()
+        self.pictures = {}
+        self.image_count = 0
+        
+        # 先處理表格標記（會新增列並填入資料），再處理所有段落中的文字和照片標記
+        tables = [node for node in self._walk(self.doc.text) if node.qname == (TABLENS, 'table')]
+        for table in tables:
+            self._process_table(table, data)
+        for paragraph in [node for node in self._walk(self.doc.text) if node.qname in self.PARAGRAPH_TAGS]:
+            self._process_paragraph(paragraph, data)
+        
+        print(f"儲存文件到 {output_path}...")
+        self.doc.save(output_path)
+        return output_path
+    
+    def _walk(self, node):
+        for child in node.childNodes:
+            if child.nodeType == child.ELEMENT_NODE:
+                yield child
+                yield from self._walk(child)
+    
+    def _paragraphs(self, node):
+        # 這個節點中的段落，不包含巢狀表格中的段落
+        result = []
+        for child in node.childNodes:
+            if child.nodeType != child.ELEMENT_NODE:
+                continue
+            if child.qname in self.PARAGRAPH_TAGS:
+                result.append(child)
+            elif child.qname != (TABLENS, 'table'):
+                result.extend(self._paragraphs(child))
+        return result
+    
+    def _text_nodes(self, node, nodes):
+        for child in node.childNodes:
+            if child.nodeType == child.TEXT_NODE:
+                nodes.append(child)
+            elif child.nodeType == child.ELEMENT_NODE and child.qname not in self.SKIP_TAGS:
+                self._text_nodes(child, nodes)
+        return nodes
+    
+    def _node_text(self, node):
+        from odf import teletype
+        return '\n'.join(teletype.extractText(paragraph) for paragraph in self._paragraphs(node))
+    
+    def _replace_in_paragraph(self, paragraph, replace):
+        # 標記可能跨越多個文字節點（例如部分套用不同樣式）：
+        # 替換文字放在標記開頭所在的節點，其餘節點只移除標記的部分
+        nodes = self._text_nodes(paragraph, [])
+        full_text = ''.join(node.data for node in nodes)
+        matches = list(MARKER_PATTERN.finditer(full_text))
+        if not matches:
+            return False
+        
+        starts = []
+        position = 0
+        for node in nodes:
+            starts.append(position)
+            position += len(node.data)
+        
+        changed = False
+        # 由後往前替換，前面節點的位置不受影響
+        for match in reversed(matches):
+            value = replace(match)
+            if value is None:
+                continue
+            changed = True
+            start, end = match.span()
+            first = True
+            for node, node_start in zip(nodes, starts):
+                node_end = node_start + len(node.data)
+                if node_end <= start or node_start >= end:
+                    continue
+                a = max(start, node_start) - node_start
+                b = min(end, node_end) - node_start
+                node.data = node.data[:a] + (value if first else '') + node.data[b:]
+                first = False
+        return changed
+    
+    def _process_paragraph(self, paragraph, data):
+        images = []
+        if self._replace_in_paragraph(paragraph, lambda match: self.processor._marker_value(match.group(0), data, images)):
+            if images:
+                self._insert_images(paragraph, images)
+    
+    def _insert_images(self, paragraph, images):
+        from odf import text
+        for img_path, line_break in images:
+            full_path = self.processor._resolve_image_path(img_path)
+            if full_path:
+                print(f"插入照片：{full_path}")
+                paragraph.addElement(self._image_frame(full_path))
+                if line_break:
+                    paragraph.addElement(text.LineBreak())  # 在每張照片後添加換行
+            else:
+                print(f"找不到照片：{img_path}")
+    
+    def _image_frame(self, full_path):
+        # 同一張照片在文件中只存一份
+        path = self.processor._derivative_path(full_path)
+        from odf import draw
+        from PIL import Image
+        picture = self.pictures.get(path)
+        if picture is None:
+            blob = self.processor._image_bytes(path)
+            with Image.open(io.BytesIO(blob)) as image:
+                width_px, height_px = image.size
+            mediatype = mimetypes.guess_type(path)[0] or 'image/jpeg'
+            href = self.doc.addPicture(f"Pictures/{len(self.pictures) + 1}_{os.path.basename(path)}", mediatype, blob)
+            picture = (href, width_px, height_px)
+            self.pictures[path] = picture
+        
+        # 寬度固定 2 英吋，高度依照片比例
+        href, width_px, height_px = picture
+        self.image_count += 1
+        frame = draw.Frame(name=f"照片{self.image_count}", anchortype='as-char',
+                           width='2in', height=f"{2 * height_px / width_px:.3f}in")
+        frame.addElement(draw.Image(href=href))
+        return frame
+    
+    def _rows(self, table):
+        # 表格的列（包含標題列和列群組），不包含巢狀表格
+        rows = []
+        for child in table.childNodes:
+            if child.nodeType != child.ELEMENT_NODE:
+                continue
+            if child.qname == self.ROW_TAG:
+                rows.append(child)
+            elif child.qname != (TABLENS, 'table'):
+                rows.extend(self._rows(child))
+        return rows
+    
+    def _cells(self, row):
+        return [child for child in row.childNodes if child.nodeType == child.ELEMENT_NODE and child.qname in self.CELL_TAGS]
+    
+    def _clone(self, node):
+        from odf import element
+        if node.nodeType == node.TEXT_NODE:
+            return element.Text(node.data)
+        clone = element.Element(qname=node.qname, qattributes=dict(node.attributes), check_grammar=False)
+        for child in node.childNodes:
+            clone.appendChild(self._clone(child))
+        return clone
+    
+    def _insert_after(self, node, new_node):
+        # insertBefore 不會更新 odfpy 的元素快取，和 addElement 一樣補上
+        parent = node.parentNode
+        parent.insertBefore(new_node, node.nextSibling)
+        parent._setOwnerDoc(new_node)
+        self.doc.rebuild_caches(new_node)
+    
+    def _remove_child(self, parent, child):
+        # odfpy 只能移除元素節點，文字節點直接清空
+        if child.nodeType == child.ELEMENT_NODE:
+            parent.removeChild(child)
+        else:
+            child.data = ''
+    
+    def _expand_repeats(self, table):
+        # 重複的列和儲存格展開成獨立的元素，才能用列號和欄號定位
+        for row in self._rows(table):
+            repeat = row.getAttrNS(TABLENS, 'number-rows-repeated')
+            if repeat and int(repeat) > 1:
+                row.removeAttrNS(TABLENS, 'number-rows-repeated')
+                for _ in range(min(int(repeat), self.MAX_REPEAT) - 1):
+                    self._insert_after(row, self._clone(row))
+        for row in self._rows(table):
+            for cell in self._cells(row):
+                repeat = cell.getAttrNS(TABLENS, 'number-columns-repeated')
+                if repeat and int(repeat) > 1:
+                    cell.removeAttrNS(TABLENS, 'number-columns-repeated')
+                    for _ in range(min(int(repeat), self.MAX_REPEAT) - 1):
+                        self._insert_after(cell, self._clone(cell))
+    
+    def _cell(self, rows, row_index, col_index):
+        if row_index < len(rows):
+            cells = self._cells(rows[row_index])
+            if col_index < len(cells):
+                return cells[col_index]
+        return None
+    
+    def _set_cell_text(self, cell, value):
+        from odf import text, teletype
+        # 保留儲存格第一個段落（含樣式），其餘內容清除
+        paragraphs = [child for child in cell.childNodes
+                      if child.nodeType == child.ELEMENT_NODE and child.qname in self.PARAGRAPH_TAGS]
+        for child in list(cell.childNodes):
+            if not paragraphs or child is not paragraphs[0]:
+                self._remove_child(cell, child)
+        if paragraphs:
+            paragraph = paragraphs[0]
+            for child in list(paragraph.childNodes):
+                self._remove_child(paragraph, child)
+        else:
+            paragraph = text.P()
+            cell.addElement(paragraph)
+        if value:
+            teletype.addTextToElement(paragraph, value)
+        return paragraph
+    
+    def _add_row(self, rows):
+        # 複製最後一列並清空內容，與 python-docx 的 add_row 相同
+        new_row = self._clone(rows[-1])
+        for cell in self._cells(new_row):
+            self._set_cell_text(cell, '')
+        self._insert_after(rows[-1], new_row)
+        rows.append(new_row)
+    
+    def _remove_marker(self, cell, marker):
+        for paragraph in self._paragraphs(cell):
+            self._replace_in_paragraph(paragraph, lambda match: '' if match.group(0) == marker else None)
+    
+    def _process_table(self, table, data):
+        handlers = {
+            '@content': self._replace_lines_table,
+            '@course_topic': self._replace_lines_table,
+            '@price_list_table': self._replace_price_list_table,
+            '@photos': self._replace_photos_table
+        }
+        if not any(marker in handlers for marker in MARKER_PATTERN.findall(self._node_text(table))):
+            return
+        
+        self._expand_repeats(table)
+        for i, row in enumerate(self._rows(table)):
+            for j, cell in enumerate(self._cells(row)):
+                table_marker = next((marker for marker in MARKER_PATTERN.findall(self._node_text(cell))
+                                     if marker in handlers), None)
+                if table_marker:
+                    print(f"處理表格標記 {table_marker}...")
+                    self._remove_marker(cell, table_marker)
+                    handlers[table_marker](table, data, i, j, table_marker)
+                    break
+    
+    def _replace_lines_table(self, table, data, start_row, start_col, marker):
+        # @content、@course_topic：每一行填入一列，列數不足時新增
+        value = data.get(marker[1:], '')
+        if not value:
+            print(f"找不到 {marker} 的內容")
+            return
+        rows = self._rows(table)
+        current_row = start_row
+        for line in value.split('\n'):
+            if current_row >= len(rows):
+                self._add_row(rows)
+            cell = self._cell(rows, current_row, start_col)
+            if cell is not None:
+                self._set_cell_text(cell, line.strip())
+            current_row += 1
+    
+    def _replace_price_list_table(self, table, data, start_row, start_col, marker):
+        rows = self._rows(table)
+        current_row = start_row
+        for field, label in PRICE_LIST_FIELDS:
+            if current_row < len(rows):
+                cell = self._cell(rows, current_row, start_col)
+                if cell is not None:
+                    self._set_cell_text(cell, str(data.get(field, '')))
+                current_row += 1
+    
+    def _replace_photos_table(self, table, data, start_row, start_col, marker):
+        photos = data.get('photos', [])
+        if not photos:
+            print("找不到課程照片")
+            return
+        photo_info = self.processor._photos_by_week(photos)
+        rows = self._rows(table)
+        week = 1
+        for current_row in range(start_row, len(rows)):
+            if week in photo_info:
+                full_path = self.processor._resolve_image_path(photo_info[week])
+                cell = self._cell(rows, current_row, start_col)
+                if full_path and cell is not None:
+                    paragraph = self._set_cell_text(cell, '')
+                    self._insert_images(paragraph, [(full_path, False)])
+            week += 1
+
+class DocumentProcessor:
+    # .odt 範本直接以 odfpy 處理；設為 False 則經由 LibreOffice 轉成 .docx 處理後再轉回
+    NATIVE_ODT = True
+    
+    def __init__(self, template_path, image_cache=None, native_odt=None):
+        self.template_path = template_path
+        self.native_odt = self.NATIVE_ODT if native_odt is None else native_odt
+        self.file_type = os.path.splitext(template_path)[1].lower()
+        # 照片路徑對應檔案內容；批次產生時共用，同一張照片只讀一次
+        self.image_cache = image_cache
+        # 目前這份文件資料中同步時記錄的照片資訊
+        self.assets = {}
+    
+    def process_document(self, data, output_path=None):
+        # output_path 未指定時放在範本的資料夾；副檔名一律依範本格式
+        try:
+            print("開始處理文件...")
+            file_ext = os.path.splitext(self.template_path)[1].lower()
+            # 照片路徑以 os.path.normpath 比對，Windows 上的分隔符號不同也能找到
+            self.assets = {os.path.normpath(path): asset for path, asset in data.get('assets', {}).items()}
+            if not output_path:
+                output_path = output_path_for(self.template_path, data, data)
+            output_base = os.path.splitext(output_path)[0]
+            
+            # .odt 範本直接在 ODF 中填入資料
+            if file_ext == '.odt' and self.native_odt:
+                template = ODT_TEMPLATE_CACHE.get(self.template_path)
+                return OdtRenderer(self).render(template, data, output_base + '.odt')
+            
+            # 如果是 .doc 或 .odt 格式，使用快取中轉換好的 .docx（範本變動時才重新轉換）
+            docx_path = self.template_path
+            if file_ext in ['.doc', '.odt']:
+                try:
+                    docx_path = CONVERTED_TEMPLATES.get(self.template_path)
+                except Exception as e:
+                    raise Exception(f"{file_ext[1:].upper()} 轉換失敗：{str(e)}")
+            
+            # 處理 .docx 格式：範本只解析一次，之後從記憶體複製
+            template = TEMPLATE_CACHE.get(docx_path)
+            doc = template.new_document()
+            
+            output_path = output_base + '.docx'
+            
+            # 只處理範本中事先找到標記的位置
+            self._fill_slots(doc, template, data)
+            
+            print(f"儲存文件到 {output_path}...")
+            doc.save(output_path)
+            
+            # 如果需要輸出為原始格式
+            if file_ext in ['.doc', '.odt']:
+                print(f"轉換回 {file_ext} 格式...")
+                if file_ext == '.doc':
+                    import win32com.client
+                    word = win32com.client.Dispatch('Word.Application')
+                    doc = word.Documents.Open(output_path)
+                    doc_path = os.path.splitext(output_path)[0] + '.doc'
+                    doc.SaveAs2(doc_path, FileFormat=0)  # 0 代表 .doc 格式
+                    doc.Close()
+                    word.Quit()
+                    os.remove(output_path)  # 移除中間的 .docx 檔案
+                    output_path = doc_path
+                elif file_ext == '.odt':
+                    try:
+                        odt_path = get_office_pool().convert(output_path, 'odt')
+                    except Exception as e:
+                        raise Exception(f"轉換回 ODT 失敗：{str(e)}")
+                    os.remove(output_path)  # 移除中間的 .docx 檔案
+                    output_path = odt_path
+            
+            return output_path
+            
+        except Exception as e:
+            print(f"處理文件時發生錯誤：{str(e)}")
+            raise
+    
+    def _fill_slots(self, doc, template, data):
+        table_handlers = {
+            '@content': self._replace_course_table,
+            '@course_topic': self._replace_course_topic_table,
+            '@price_list_table': self._replace_price_list_table,
+            '@photos': self._replace_photos_table
+        }
+        
+        # 處理表格中的標記
+        tables = doc.tables
+        for table_index, slots in template.table_slots:
+            table = tables[table_index]
+            for row_index, col_index, table_marker in slots:
+                if table_marker:
+                    table_handlers[table_marker](table, data, row_index, col_index)
+                else:
+                    self._process_cell(table.rows[row_index].cells[col_index], data)
+        
+        # 處理段落中的標記
+        paragraphs = doc.paragraphs
+        for paragraph_index in template.paragraph_slots:
+            self._process_paragraph(paragraphs[paragraph_index], data)
+    
+    def _marker_value(self, marker, data, images):
+        # 回傳標記要替換成的文字，資料中沒有的標記回傳 None（保留原樣）
+        # 照片標記替換成空字串，照片加入 images 之後再插入
+        key = marker[1:]
+        if key not in data:
+            return None
+        value = data[key]
+        print(f"處理標記 {marker}...")
+        if key in MULTI_IMAGE_FIELDS and isinstance(value, list):
+            images.extend((img_path, True) for img_path in value)
+            return ''
+        if key in IMAGE_FIELDS and value:
+            images.append((value, False))
+            return ''
+        return str(value) if value else ''
+    
+    def _replace_markers(self, text, data):
+        # 一次替換所有文字標記，照片標記先移除，回傳替換後的文字與要插入的照片
+        images = []
+        
+        def replace(match):
+            value = self._marker_value(match.group(0), data, images)
+            return match.group(0) if value is None else value
+        
+        return MARKER_PATTERN.sub(replace, text), images
+    
+    def _resolve_image_path(self, img_path):
+        # 照片資料夾中的檔案從索引查詢，不需逐一檢查檔案
+        if ASSET_INDEX.covers(img_path):
+            return ASSET_INDEX.resolve(img_path)
+        # 其他位置的照片才逐一檢查各種可能的副檔名
+        if os.path.exists(img_path):
+            return img_path
+        base_path = os.path.splitext(img_path)[0]
+        for ext in IMAGE_EXTENSIONS:
+            for test_path in (f"{img_path}{ext}", f"{base_path}{ext}"):
+                if os.path.exists(test_path):
+                    return test_path
+        return None
+    
+    def _derivative_path(self, full_path):
+        # 使用縮小過的照片，文件不會因原始解析度而過大
+        return IMAGE_DERIVATIVES.get(full_path, source_hash=self.assets.get(os.path.normpath(full_path), {}).get('md5'))
+    
+    def _image_bytes(self, path):
+        blob = self.image_cache.get(path) if self.image_cache is not None else None
+        if blob is None:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            if self.image_cache is not None:
+                self.image_cache[path] = blob
+        return blob
+    
+    def _image_source(self, full_path):
+        path = self._derivative_path(full_path)
+        if self.image_cache is None:
+            return path
+        return io.BytesIO(self._image_bytes(path))
+    
+    def _insert_images(self, paragraph, images):
+        from docx.shared import Inches
+        for img_path, line_break in images:
+            full_path = self._resolve_image_path(img_path)
+            if full_path:
+                print(f"插入照片：{full_path}")
+                run = paragraph.add_run()
+                run.add_picture(self._image_source(full_path), width=Inches(2))
+                if line_break:
+                    run.add_text('\n')  # 在每張照片後添加換行
+            else:
+                print(f"找不到照片：{img_path}")
+    
+    def _process_cell(self, cell, data, cell_text=None):
+        try:
+            if cell_text is None:
+                cell_text = cell.text
+            new_text, images = self._replace_markers(cell_text, data)
+            if new_text != cell_text:
+                cell.text = new_text
+            if images:
+                self._insert_images(cell.paragraphs[0], images)
+        except Exception as e:
+            print(f"處理儲存格時發生錯誤：{str(e)}")
+            print(f"錯誤類型：{type(e)}")
+            print(f"錯誤詳情：{e.__dict__}")
+            raise
+    
+    def _process_paragraph(self, paragraph, data):
+        try:
+            paragraph_text = paragraph.text
+            if '@' not in paragraph_text:
+                return
+            new_text, images = self._replace_markers(paragraph_text, data)
+            if new_text != paragraph_text:
+                paragraph.text = new_text
+            if images:
+                self._insert_images(paragraph, images)
+        except Exception as e:
+            print(f"處理段落時發生錯誤：{str(e)}")
+            raise
+    
+    def _replace_course_table(self, table, data, start_row, start_col):
+        try:
+            print("開始處理課程��容表格...")
+            
+            # 清除標記所在儲存格中的標記
+            marker_cell = table.rows[start_row].cells[start_col]
+            marker_cell.text = marker_cell.text.replace('@content', '')
+            
+            # 取得課程內容
+            content = data.get('content', '')
+            if not content:
+                print("找不到課程內容")
+                return
+            
+            # 將課程內容分行
+            content_lines = content.split('\n')
+            print(f"課程內共 {len(content_lines)} 行")
+            
+            # 確保表格有足夠的列數
+            current_row = start_row
+            for content_line in content_lines:
+                if current_row >= len(table.rows):
+                    table.add_row()
+                
+                # 從指定的欄位開始填入
+                if start_col < len(table.rows[current_row].cells):
+                    table.rows[current_row].cells[start_col].text = content_line.strip()
+                current_row += 1
+            
+            print("課程內容表格處理完成")
+            
+        except Exception as e:
+            print(f"處理課程內容表格時發生錯誤：{str(e)}")
+            raise
+    
+    def _replace_price_list_table(self, table, data, start_row, start_col):
+        try:
+            print("開始處理報價單表格...")
+            
+            # 清除標記所在儲存格中的標記
+            marker_cell = table.rows[start_row].cells[start_col]
+            marker_cell.text = marker_cell.text.replace('@price_list_table', '')
+            
+            # 填入報價單資料
+            current_row = start_row
+            for field, label in PRICE_LIST_FIELDS:
+                if current_row < len(table.rows):
+                    value = data.get(field, '')
+                    # 從指定的欄位開始填
+                    if start_col < len(table.rows[current_row].cells):
+                        table.rows[current_row].cells[start_col].text = str(value)
+                    current_row += 1  # 移到下一行
+            
+            print("報價單表格處理完成")
+            
+        except Exception as e:
+            print(f"處理報價單表格時發生錯誤：{str(e)}")
+            raise
+    
+    def _replace_photos_table(self, table, data, start_row, start_col):
+        from docx.shared import Inches
+        try:
+            print("開始處理課程照片表格...")
+            
+            # 清除標記所在儲存格中的標記
+            marker_cell = table.rows[start_row].cells[start_col]
+            marker_cell.text = marker_cell.text.replace('@photos', '')
+            
+            # 取得照片列表
+            photos = data.get('photos', [])
+            if not photos:
+                print("找不到課程照片")
+                return
+            
+            # 解析照片資訊
+            photo_info = self._photos_by_week(photos)
+            
+            # 填入照片
+            current_row = start_row
+            week = 1
+            while current_row < len(table.rows):
+                if week in photo_info:
+                    full_path = self._resolve_image_path(photo_info[week])
+                    if full_path:
+                        cell = table.rows[current_row].cells[start_col]
+                        cell.text = ''  # 清空儲存格
+                        paragraph = cell.paragraphs[0]
+                        run = paragraph.add_run()
+                        run.add_picture(self._image_source(full_path), width=Inches(2))
+                
+                current_row += 1
+                week += 1
+            
+            print("課程照片表格處理完成")
+            
+        except Exception as e:
+            print(f"處理課程照片表格時發生錯誤：{str(e)}")
+            raise
+    
+    def _photos_by_week(self, photos):
+        photo_info = {}  # 用來儲存週次和對應的照片路徑
+        for photo_path in photos:
+            # 從檔名中提取週次資訊
+            base_name = os.path.basename(photo_path)
+            name_without_ext = os.path.splitext(base_name)[0]
+            
+            # 假設檔名格式為 "課程名稱_N"
+            try:
+                week_num = int(name_without_ext.split('_')[-1])
+                photo_info[week_num] = photo_path
+            except (ValueError, IndexError):
+                print(f"無法從檔名 {base_name} 解析週次資訊")
+                continue
+        return photo_info
+    
+    def _replace_course_topic_table(self, table, data, start_row, start_col):
+        try:
+            print("開始處理課程主題表格...")
+            
+            # 清除標記所在儲存格中的標記
+            marker_cell = table.rows[start_row].cells[start_col]
+            marker_cell.text = marker_cell.text.replace('@course_topic', '')
+            
+            # 取得課程主題內容
+            topic = data.get('course_topic', '')
+            if not topic:
+                print("找不到課程主題內容")
+                return
+            
+            # 將課程主題分行
+            topic_lines = topic.split('\n')
+            print(f"課程主題共 {len(topic_lines)} 行")
+            
+            # 確保表格有足夠的列數
+            current_row = start_row
+            for topic_line in topic_lines:
+                if current_row >= len(table.rows):
+                    table.add_row()
+                
+                # 從指定的欄位開始填入
+                if start_col < len(table.rows[current_row].cells):
+                    table.rows[current_row].cells[start_col].text = topic_line.strip()
+                current_row += 1
+            
+            print("課程主題表格處理完成")
+            
+        except Exception as e:
+            print(f"處理課程主題表格時發生錯誤：{str(e)}")
+            raise
+
+def benchmark_odt(template_path, data, runs=3):
+    # 比較直接處理 .odt 和經由 LibreOffice 轉檔的耗時，在暫存資料夾中產生避免覆寫輸出
+    results = {}
+    work_dir = tempfile.mkdtemp()
+    try:
+        work_template = os.path.join(work_dir, os.path.basename(template_path))
+        shutil.copy(template_path, work_template)
+        for label, native_odt in (('odfpy', True), ('soffice', False)):
+            processor = DocumentProcessor(work_template, image_cache={}, native_odt=native_odt)
+            timings = []
+            try:
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    processor.process_document(data)
+                    timings.append(time.perf_counter() - start)
+                results[label] = {'first': timings[0], 'best': min(timings), 'mean': sum(timings) / len(timings)}
+            except Exception as e:
+                print(f"{label} 測試失敗：{str(e)}")
+                results[label] = {'error': str(e)}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print(f"ODT 產生時間（{runs} 次）：")
+    if _OFFICE_POOL is not None and not _OFFICE_POOL.use_uno:
+        print("  注意：soffice 為每次轉檔各自啟動的命令列（找不到 uno 模組），不是常駐的轉檔池")
+    for label, result in results.items():
+        if 'error' in result:
+            print(f"  {label}：無法測試（{result['error']}）")
+        else:
+            print(f"  {label}：第一次 {result['first'] * 1000:.0f} ms，最快 {result['best'] * 1000:.0f} ms，平均 {result['mean'] * 1000:.0f} ms")
+    if 'best' in results.get('odfpy', {}) and 'best' in results.get('soffice', {}):
+        print(f"  直接處理約快 {results['soffice']['mean'] / results['odfpy']['mean']:.1f} 倍")
+    return results
+
+def benchmark_batch(template_path, items, workers):
+    # 同一批文件先在本行程逐份產生，再交給 workers 個子行程平行產生，比較實際耗時
+    # 輸出放在暫存資料夾，不覆寫範本資料夾中的文件
+    results = {}
+    work_dir = tempfile.mkdtemp()
+    try:
+        work_template = os.path.join(work_dir, os.path.basename(template_path))
+        shutil.copy(template_path, work_template)
+        for label, run_workers in (('serial', 1), ('parallel', workers)):
+            output_dir = os.path.join(work_dir, label)
+            os.makedirs(output_dir)
+            run_items = [
+                {**item, 'output_path': os.path.join(output_dir, f"{index}_{os.path.basename(item['output_path'])}")}
+                for index, item in enumerate(items)
+            ]
+            results[label] = ParallelRenderer(workers=run_workers).render(work_template, run_items)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    serial, parallel = results['serial'], results['parallel']
+    print(f"批次產生 {len(items)} 份文件：")
+    print(f"  逐份產生：{serial['elapsed']:.2f} 秒（失敗 {len(serial['failed'])} 份）")
+    print(f"  {parallel['workers']} 個行程：{parallel['elapsed']:.2f} 秒（失敗 {len(parallel['failed'])} 份）")
+    if parallel['elapsed'] > 0:
+        results['speedup'] = serial['elapsed'] / parallel['elapsed']
+        print(f"  平行產生為逐份產生的 {results['speedup']:.2f} 倍速度")
+    return results
@@ -1,103 +1,169 @@
-from docx import Document
-from docx.shared import Inches
-from odf import text, teletype
-from odf.opendocument import load
+# 教師資料文件產生器的圖形介面；登入、同步和產生文件的功能在 teacher_doc_core 中
 import os
-import json
-from datetime import datetime
-import pandas as pd
-from PIL import Image
-import shutil
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-import io
+import time
+import threading
+import queue
+import multiprocessing
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QPushButton, 
                             QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, 
                             QTabWidget, QScrollArea, QComboBox, QMessageBox,
-                            QFileDialog, QFrame, QGridLayout)
-from PyQt6.QtCore import Qt, QTimer
+                            QFileDialog, QFrame, QGridLayout, QProgressBar)
+from PyQt6.QtCore import Qt, QTimer, QThread, QObject, QEvent, pyqtSignal
 from PyQt6.QtGui import QFont
-from googleapiclient.http import MediaIoBaseDownload
-import win32com.client
-from subprocess import run
+from teacher_doc_core import (TEACHER_TAGS, COURSE_TAGS, PRICE_LIST_TAGS, SCOPES,
+                              TeacherDataManager, CourseDataManager, DocumentProcessor, ParallelRenderer,
+                              GoogleClientFactory, StartupTimer, com_initialize, com_uninitialize,
+                              get_service_account_creds, login_and_sync, merge_records,
+                              output_path_for, build_batch_items)
 
-class LoginManager:
-    def __init__(self, creds):
-        self.SPREADSHEET_ID = '171kBtkTN5LUTNVMkCEhJ-L-l4xh7Wj9sJE76W0HmZ9w'
+class SyncWorker(QObject):
+    progress = pyqtSignal(str, int, int, str)
+    finished = pyqtSignal(dict)
+    failed = pyqtSignal(str)
+    
+    def __init__(self, creds, login_code, teacher_manager, course_manager,
+                 download_workers=8, incremental=True, clients=None, thumbnails=True):
+        super().__init__()
+        self.thumbnails = thumbnails
         self.creds = creds
-        self.service = build('sheets', 'v4', credentials=creds)
+        self.clients = clients
+        self.login_code = login_code
+        self.teacher_manager = teacher_manager
+        self.course_manager = course_manager
+        self.download_workers = download_workers
+        self.incremental = incremental
+        self.cancel_event = threading.Event()
+    
+    def cancel(self):
+        self.cancel_event.set()
     
-    def verify_login(self, login_code):
+    def run(self):
+        # 在背景執行緒中驗證登入並同步資料，不可操作任何介面元件
         try:
-            # 讀取登入碼（A欄
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='login!A:A'
-            ).execute()
-            login_codes = result.get('values', [])
+            result = login_and_sync(
+                self.creds,
+                self.login_code,
+                self.teacher_manager,
+                self.course_manager,
+                download_workers=self.download_workers,
+                incremental=self.incremental,
+                progress_callback=self.progress.emit,
+                cancel_event=self.cancel_event,
+                clients=self.clients,
+                thumbnails=self.thumbnails
+            )
+            self.finished.emit(result)
             
-            # 檢查登入碼是否存在
-            if not any(code[0] == login_code for code in login_codes if code):
-                return False, None
-            
-            # 找到對應的最後更新日期（C欄）
-            for i, code in enumerate(login_codes):
-                if code and code[0] == login_code:
-                    row_num = i + 1
+        except Exception as e:
+            error_msg = f"登入失敗：{str(e)}\n錯誤類型：{type(e)}"
+            print(error_msg)
+            self.failed.emit(error_msg)
+
+class DocumentJobWorker(QObject):
+    job_started = pyqtSignal(int, str)
+    job_finished = pyqtSignal(int, str, str, float)
+    job_failed = pyqtSignal(int, str, str)
+    batch_progress = pyqtSignal(int, int, int, str)
+    batch_finished = pyqtSignal(int, str, dict)
+    queue_changed = pyqtSignal(int)
+    
+    def __init__(self):
+        super().__init__()
+        self.jobs = queue.Queue()
+    
+    def submit(self, job):
+        # job 為 dict：id、label、template_path，以及 data、output_path
+        # 批次工作則以 items 列出每份文件的 label、data、output_path
+        self.jobs.put(job)
+        self.queue_changed.emit(self.jobs.qsize())
+    
+    def stop(self):
+        # 丟棄尚未開始的工作，再放入結束訊號
+        try:
+            while True:
+                self.jobs.get_nowait()
+        except queue.Empty:
+            pass
+        self.jobs.put(None)
+    
+    def run(self):
+        # 在背景執行緒中依序產生文件；Word COM 需要在每個執行緒各自初始化
+        com_initialize()
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
                     break
-            
-            # 讀取該使用者的最後更新日期
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=f'login!C{row_num}'
-            ).execute()
-            last_update = result.get('values', [[None]])[0][0]
-            
-            # 讀取師資和課程的最後更新日期
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='login!D2:E2'
-            ).execute()
-            data_update = result.get('values', [[None, None]])[0]
-            
-            need_update = False
-            if last_update:
-                try:
-                    # 移除秒數部分，只保留到分鐘
-                    last_update = last_update.split(':')[0] + ':' + last_update.split(':')[1]
-                    last_update = datetime.strptime(last_update, '%Y-%m-%d %H:%M')
-                    
-                    if data_update[0]:  # 檢查師資更新日期
-                        teacher_update = data_update[0].split(':')[0] + ':' + data_update[0].split(':')[1]
-                        teacher_update = datetime.strptime(teacher_update, '%Y-%m-%d %H:%M')
-                        if teacher_update > last_update:
-                            need_update = True
-                            
-                    if data_update[1]:  # 檢查課程更新日期
-                        course_update = data_update[1].split(':')[0] + ':' + data_update[1].split(':')[1]
-                        course_update = datetime.strptime(course_update, '%Y-%m-%d %H:%M')
-                        if course_update > last_update:
-                            need_update = True
-                except ValueError as e:
-                    print(f"日期格式錯誤：{str(e)}")
-                    need_update = True
-            else:
-                need_update = True
-            
-            # 更新最後更新日期（使用統一的格式）
-            now = datetime.now().strftime('%Y-%m-%d %H:%M')
-            self.service.spreadsheets().values().update(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range=f'login!C{row_num}',
-                valueInputOption='RAW',
-                body={'values': [[now]]}
-            ).execute()
-            
-            return True, need_update
-            
+                self.queue_changed.emit(self.jobs.qsize())
+                if 'items' in job:
+                    self._run_batch(job)
+                else:
+                    self._run_job(job)
+        finally:
+            com_uninitialize()
+    
+    def _run_job(self, job):
+        self.job_started.emit(job['id'], job['label'])
+        start = time.perf_counter()
+        try:
+            processor = DocumentProcessor(job['template_path'])
+            output_path = processor.process_document(job['data'], job['output_path'])
+            elapsed = time.perf_counter() - start
+            print(f"文件產生完成（{elapsed:.1f} 秒）：{output_path}")
+            self.job_finished.emit(job['id'], job['label'], output_path, elapsed)
         except Exception as e:
-            print(f"驗證錯誤：{str(e)}")
-            return False, None
+            error_msg = f"產生文件失敗：{str(e)}\n錯誤類型：{type(e)}"
+            print(error_msg)
+            self.job_failed.emit(job['id'], job['label'], error_msg)
+    
+    def _run_batch(self, job):
+        # 同一個批次共用範本和照片快取，每份文件失敗時記錄後繼續下一份
+        self.job_started.emit(job['id'], job['label'])
+        items = job['items']
+        renderer = ParallelRenderer(
+            workers=job.get('workers', 1),
+            progress_callback=lambda completed, total, label: self.batch_progress.emit(job['id'], completed, total, label)
+        )
+        summary = renderer.render(job['template_path'], items)
+        print(f"批次產生完成：成功 {summary['succeeded']} 份，失敗 {len(summary['failed'])} 份，"
+              f"耗時 {summary['elapsed']:.1f} 秒（每分鐘 {summary['per_minute']:.1f} 份），"
+              f"{summary['workers']} 個行程")
+        self.batch_finished.emit(job['id'], job['label'], summary)
+
+class ToastNotification(QLabel):
+    # 不會搶走焦點的提示訊息，數秒後自動關閉
+    def __init__(self, parent, message, error=False, duration=4000):
+        super().__init__(message, parent)
+        self.setWindowFlags(Qt.WindowType.ToolTip | Qt.WindowType.FramelessWindowHint)
+        self.setAttribute(Qt.WidgetAttribute.WA_ShowWithoutActivating)
+        self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        self.setWordWrap(True)
+        self.setFixedWidth(300)
+        self.setStyleSheet(f"""
+            QLabel {{
+                background-color: {'#c0392b' if error else '#333333'};
+                color: white;
+                padding: 8px;
+                border-radius: 4px;
+            }}
+        """)
+        self.adjustSize()
+        QTimer.singleShot(duration, self.close)
+
+class FirstPaintReporter(QObject):
+    # 視窗第一次繪製時記錄時間，並印出啟動報告
+    def __init__(self, window, timer):
+        super().__init__(window)
+        self.timer = timer
+        window.installEventFilter(self)
+    
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint:
+            obj.removeEventFilter(self)
+            self.timer.mark('第一次繪製視窗')
+            self.timer.print_timings()
+        return False
+
 class TeacherDocApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -110,59 +176,49 @@ class TeacherDocApp(QMainWindow):
         # 加入試算表 ID
         self.SPREADSHEET_ID = '171kBtkTN5LUTNVMkCEhJ-L-l4xh7Wj9sJE76W0HmZ9w'
         
-        # 修改教師標記定義
-        self.teacher_tags = [
-            ("姓名", "@name"),
-            ("綽號", "@nickname"),
-            ("大頭照", "@photo"),
-            ("申請單位", "@unit"),
-            ("出生日期", "@birth"),
-            ("性別", "@gender"),
-            ("手機", "@mobile"),
-            ("身分證字號", "@idno"),
-            ("通訊地址", "@address"),
-            ("Email", "@email"),
-            ("Line ID", "@line"),
-            ("專長", "@skill"),
-            ("最高學歷", "@education"),
-            ("現職", "@job"),
-            ("教學經驗（年）", "@experience"),
-            ("經歷", "@history"),
-            ("身分證正面（照片）", "@id_front"),
-            ("身分證反面（照片）", "@id_back"),
-            ("畢業證書（照片）", "@diploma"),
-            ("其他（良民證、比賽等）", "@other_certs")
-        ]
-        
-        # 修改課程標記定義，分成三個區塊
-        self.course_tags = [
-            ("社團名稱", "@course_name"),
-            ("課程介紹", "@intro"),
-            ("教學目標", "@target"),
-            ("材料費", "@material_fee"),
-            ("材料內容", "@reason"),     
-            ("課程主題（表格）", "@course_topic"),       
-            ("課程內容（表格）", "@content"),
-            ("課程照片（表格照片）", "@photos")
-        ]
-        
-        # 新增報價單標記區塊
-        self.price_list_tags = [
-            ("品名（表格）", "@price_list_name"),
-            ("單位（表格）", "@price_list_unit"),
-            ("數量（表格）", "@price_list_quantity"),
-            ("單價（表格）", "@price_list_price"),
-            ("預計金額（表格）", "@price_list_amount"),
-            ("用途說明（表格）", "@price_list_usage"),
-            ("公司存摺（照片）", "@bank_account")
-        ]
+        # 同時下載照片的連線數
+        self.DOWNLOAD_WORKERS = 8
+        
+        # 只重新處理有變動的試算表列；設為 False 則每次重新處理所有資料
+        self.INCREMENTAL_SYNC = True
+        
+        # 大頭照和課程照片只下載 Drive 產生的縮圖（證件照仍下載原始檔）；設為 False 則全部下載原始檔
+        self.THUMBNAIL_SYNC = True
+        
+        # 批次產生文件的行程數；設為 1 則在背景執行緒中逐份產生
+        # （可用環境變數 TEACHERDOC_RENDER_WORKERS 調整）
+        self.RENDER_WORKERS = int(os.getenv('TEACHERDOC_RENDER_WORKERS', os.cpu_count() or 1))
+        
+        # 登入與同步用的背景執行緒
+        self.sync_thread = None
+        self.sync_worker = None
+        # 登入後建立，所有 Google API 呼叫共用
+        self.google_clients = None
+        
+        # 產生文件用的背景執行緒與工作佇列
+        self.document_thread = None
+        self.document_worker = None
+        self.next_job_id = 1
+        self.pending_jobs = {}
+        self.toasts = []
+        
+        # 標記按鈕定義（與文件處理共用同一份標記清單）
+        self.teacher_tags = TEACHER_TAGS
+        self.course_tags = COURSE_TAGS
+        self.price_list_tags = PRICE_LIST_TAGS
+        
+        # 資料檔是否使用不縮排的精簡格式（檔案較小、寫入較快）
+        self.COMPACT_DATA_FILES = False
+        
+        # 資料儲存方式：'json' 或 'sqlite'（可用環境變數 TEACHERDOC_BACKEND 切換）
+        self.DATA_BACKEND = os.getenv('TEACHERDOC_BACKEND', 'json')
         
         # 初始化 teacher_combo
         self.teacher_combo = QComboBox()
         
         # 初始化資料管理器
-        self.teacher_manager = TeacherDataManager()
-        self.course_manager = CourseDataManager()
+        self.teacher_manager = TeacherDataManager(compact=self.COMPACT_DATA_FILES, backend=self.DATA_BACKEND)
+        self.course_manager = CourseDataManager(compact=self.COMPACT_DATA_FILES, backend=self.DATA_BACKEND)
         
         # 建立資料夾
         self.create_directories()
@@ -200,6 +256,23 @@ class TeacherDocApp(QMainWindow):
         self.login_button.clicked.connect(self.verify_login)
         layout.addWidget(self.login_button, alignment=Qt.AlignmentFlag.AlignCenter)
         
+        # 同步進度（登入後才顯示）
+        self.sync_status_label = QLabel()
+        self.sync_status_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.sync_status_label.hide()
+        layout.addWidget(self.sync_status_label)
+        
+        self.sync_progress = QProgressBar()
+        self.sync_progress.setFixedWidth(200)
+        self.sync_progress.hide()
+        layout.addWidget(self.sync_progress, alignment=Qt.AlignmentFlag.AlignCenter)
+        
+        self.cancel_sync_button = QPushButton("取消同步")
+        self.cancel_sync_button.setFixedWidth(200)
+        self.cancel_sync_button.clicked.connect(self.cancel_sync)
+        self.cancel_sync_button.hide()
+        layout.addWidget(self.cancel_sync_button, alignment=Qt.AlignmentFlag.AlignCenter)
+        
         # 加入彈性空間
         layout.addStretch()
         
@@ -368,103 +441,112 @@ class TeacherDocApp(QMainWindow):
             # 禁用登入按鈕並更改文字
             self.login_button.setEnabled(False)
             self.login_button.setText("資料更新中，請稍後...")
-            QApplication.processEvents()  # 強制更新界面
             
             # 設定 scope
-            self.SCOPES = [
-                'https://www.googleapis.com/auth/spreadsheets',
-                'https://www.googleapis.com/auth/drive.readonly'
-            ]
+            self.SCOPES = SCOPES
             
             # 取憑證
             print("取得服務帳號憑證...")
             self.creds = self.get_service_account_creds()
-            
-            # 建立 Sheets 服務
-            print("建立 Sheets 服務...")
-            self.service = build('sheets', 'v4', credentials=self.creds)
-            
-            # 建立登入管理器
-            login_manager = LoginManager(self.creds)
+            # 之後所有 Google API 呼叫共用同一組服務物件
+            self.google_clients = GoogleClientFactory(self.creds)
             
             # 取得登入碼
             login_code = self.login_input.text()
             print(f"輸入的登入碼: {login_code}")
             
-            # 驗證登入
-            is_valid, need_update = login_manager.verify_login(login_code)
-            
-            if is_valid:
-                print(f"登入成功，需要更新：{need_update}")
-                if need_update:
-                    print("開始更新資料...")
-                    self.update_data()
-                self.initialize_main_window()
-            else:
-                self.login_button.setEnabled(True)
-                self.login_button.setText("登入")
-                QMessageBox.critical(self, "錯誤", "登入碼無效")
-                self.close()
+            # 顯示進度
+            self.setFixedSize(250, 240)
+            self.sync_status_label.setText("驗證登入碼...")
+            self.sync_status_label.show()
+            self.sync_progress.setRange(0, 0)
+            self.sync_progress.show()
+            self.cancel_sync_button.setEnabled(True)
+            self.cancel_sync_button.setText("取消同步")
+            self.cancel_sync_button.show()
+            
+            # 驗證登入和同步資料在背景執行緒中進行，介面不會卡住
+            self.sync_thread = QThread(self)
+            self.sync_worker = SyncWorker(
+                self.creds,
+                login_code,
+                self.teacher_manager,
+                self.course_manager,
+                download_workers=self.DOWNLOAD_WORKERS,
+                incremental=self.INCREMENTAL_SYNC,
+                clients=self.google_clients,
+                thumbnails=self.THUMBNAIL_SYNC
+            )
+            self.sync_worker.moveToThread(self.sync_thread)
+            self.sync_thread.started.connect(self.sync_worker.run)
+            self.sync_worker.progress.connect(self.on_sync_progress)
+            self.sync_worker.finished.connect(self.on_login_finished)
+            self.sync_worker.failed.connect(self.on_login_failed)
+            self.sync_thread.finished.connect(self.sync_worker.deleteLater)
+            self.sync_thread.start()
             
         except Exception as e:
+            self.on_login_failed(f"登入失敗：{str(e)}\n錯誤類型：{type(e)}")
+    
+    def on_sync_progress(self, phase, completed, total, name):
+        if total:
+            self.sync_progress.setRange(0, total)
+            self.sync_progress.setValue(completed)
+            self.sync_status_label.setText(f"{phase} {completed}/{total}")
+        else:
+            # 無法估計進度時顯示忙碌狀態
+            self.sync_progress.setRange(0, 0)
+            self.sync_status_label.setText(f"{phase}...")
+    
+    def cancel_sync(self):
+        if self.sync_worker is not None:
+            self.sync_worker.cancel()
+            self.cancel_sync_button.setEnabled(False)
+            self.cancel_sync_button.setText("取消中...")
+    
+    def _stop_sync_thread(self):
+        # 背景工作已結束，結束執行緒的事件迴圈並等待執行緒停止
+        if self.sync_thread is not None:
+            self.sync_thread.quit()
+            self.sync_thread.wait()
+            self.sync_thread = None
+            self.sync_worker = None
+    
+    def on_login_finished(self, result):
+        self._stop_sync_thread()
+        
+        if not result['is_valid']:
             self.login_button.setEnabled(True)
             self.login_button.setText("登入")
-            error_msg = f"登入失敗：{str(e)}\n錯誤類型：{type(e)}"
-            print(error_msg)
-            print(f"錯誤詳情：{e.__dict__}")
-            QMessageBox.critical(self, "錯誤", error_msg)
+            QMessageBox.critical(self, "錯誤", "登入碼無效")
             self.close()
+            return
+        
+        if result['errors']:
+            QMessageBox.critical(self, "錯誤", "更新失敗：" + "\n".join(result['errors']))
+        elif result['cancelled']:
+            QMessageBox.information(self, "提示", "已取消同步，使用現有資料")
+        
+        self.initialize_main_window()
+    
+    def on_login_failed(self, error_msg):
+        self._stop_sync_thread()
+        self.login_button.setEnabled(True)
+        self.login_button.setText("登入")
+        print(error_msg)
+        QMessageBox.critical(self, "錯誤", error_msg)
+        self.close()
+    
+    def closeEvent(self, event):
+        # 關閉視窗時先停止背景同步
+        if self.sync_thread is not None and self.sync_thread.isRunning():
+            self.sync_worker.cancel()
+            self._stop_sync_thread()
+        self._stop_document_thread()
+        super().closeEvent(event)
     
     def get_service_account_creds(self):
-        try:
-            import os
-            import json
-            import sys
-            
-            # 確定資源目錄
-            if getattr(sys, 'frozen', False):
-                # 如果是打包後的執行檔
-                base_path = sys._MEIPASS  # PyInstaller 的特殊路徑
-            else:
-                # 如果是直接執行 Python 腳本
-                base_path = os.path.dirname(os.path.abspath(__file__))
-            
-            # 先嘗試從環境變數讀取
-            credentials_json = os.getenv('GOOGLE_CREDENTIALS')
-            if credentials_json:
-                try:
-                    credentials_info = json.loads(credentials_json)
-                    creds = service_account.Credentials.from_service_account_info(
-                        credentials_info,
-                        scopes=self.SCOPES
-                    )
-                    return creds
-                except Exception as env_error:
-                    print(f"從環境變數載入憑證失敗：{str(env_error)}")
-            
-            # 如果環境變數不存在或失敗，則從檔案讀取
-            try:
-                # 只在資源目錄中尋找憑證檔案
-                cred_file = os.path.join(base_path, 'credentials.json')
-                
-                if not os.path.exists(cred_file):
-                    raise FileNotFoundError(f"找不到憑證檔案：{cred_file}")
-                
-                with open(cred_file, 'r', encoding='utf-8') as f:
-                    credentials_info = json.load(f)
-                    creds = service_account.Credentials.from_service_account_info(
-                        credentials_info,
-                        scopes=self.SCOPES
-                    )
-                    return creds
-                
-            except Exception as file_error:
-                print(f"從檔案載入憑證失敗：{str(file_error)}")
-                raise
-        
-        except Exception as e:
-            print(f"讀取憑證時發生錯誤：{str(e)}")
-            raise
+        return get_service_account_creds(self.SCOPES)
     
     def create_doc_tab(self):
         doc_widget = QWidget()
@@ -532,6 +614,34 @@ class TeacherDocApp(QMainWindow):
         generate_btn.clicked.connect(self.generate_document)
         layout.addWidget(generate_btn)
         
+        # 批次產生區域
+        batch_group = QFrame()
+        batch_group.setFrameStyle(QFrame.Shape.Box)
+        batch_layout = QVBoxLayout()
+        
+        batch_label = QLabel("批次產生")
+        batch_label.setFont(QFont('', 12, QFont.Weight.Bold))
+        batch_layout.addWidget(batch_label)
+        
+        self.batch_mode_combo = QComboBox()
+        self.batch_mode_combo.addItem("所選課程的所有教師", 'course')
+        self.batch_mode_combo.addItem("所有課程與符合的教師", 'all')
+        batch_layout.addWidget(self.batch_mode_combo)
+        
+        batch_btn = QPushButton("批次產生")
+        batch_btn.setFixedHeight(40)
+        batch_btn.setFont(QFont('', 12))
+        batch_btn.clicked.connect(self.generate_batch)
+        batch_layout.addWidget(batch_btn)
+        
+        batch_group.setLayout(batch_layout)
+        layout.addWidget(batch_group)
+        
+        # 背景產生文件的狀態
+        self.job_status_label = QLabel("沒有進行中的文件")
+        self.job_status_label.setWordWrap(True)
+        layout.addWidget(self.job_status_label)
+        
         layout.addStretch()
         doc_widget.setLayout(layout)
         return doc_widget
@@ -582,24 +692,27 @@ class TeacherDocApp(QMainWindow):
                 raise ValueError(f"找不到課程資料: {course_id}")
             
             print("併資料...")
-            combined_data = {**teacher_data, **course_data}
-            
-            # 使用範本檔的目錄
-            template_dir = os.path.dirname(self.file_path.text())
-            print(f"範本目錄: {template_dir}")
+            combined_data = merge_records(teacher_data, course_data)
             
-            # 建立新的檔名
-            output_filename = f"{course_data.get('course_name', 'unknown')} - {teacher_data.get('name', 'unknown')}.docx"
-            output_path = os.path.join(template_dir, output_filename)
+            # 建立新的檔名（放在範本檔的目錄）
+            output_path = self._output_path(teacher_data, course_data)
             print(f"輸出檔案路徑: {output_path}")
             
-            # 處理文件
-            print("開始處理文件...")
-            processor = DocumentProcessor(self.file_path.text())
-            output_path = processor.process_document(combined_data, output_path)
-            
-            print("文件成完成")
-            QMessageBox.information(self, "成功", f"文件已產生：{output_path}")
+            # 交給背景執行緒處理，產生期間仍可選擇下一位教師或課程
+            label = f"{course_data.get('course_name', 'unknown')} - {teacher_data.get('name', 'unknown')}"
+            job = {
+                'id': self.next_job_id,
+                'label': label,
+                'template_path': self.file_path.text(),
+                'data': combined_data,
+                'output_path': output_path
+            }
+            self.next_job_id += 1
+            self.pending_jobs[job['id']] = label
+            self._ensure_document_worker()
+            self.document_worker.submit(job)
+            print(f"已加入產生佇列：{label}")
+            self.update_job_status()
             
         except Exception as e:
             error_msg = f"產生文件失敗：{str(e)}\n錯誤類型：{type(e)}"
@@ -607,58 +720,138 @@ class TeacherDocApp(QMainWindow):
             print(f"錯誤詳情：{e.__dict__}")
             QMessageBox.critical(self, "錯誤", error_msg)
     
-    def _download_and_save_photo(self, drive_service, folder_id, photo_name, save_path):
+    def _output_path(self, teacher_data, course_data):
+        return output_path_for(self.file_path.text(), teacher_data, course_data)
+    
+    def generate_batch(self):
         try:
-            print(f"開始處理照片：{photo_name}")
-            
-            # 搜尋特定檔案（考慮常見的圖片副檔）
-            possible_extensions = ['.jpg', '.jpeg', '.png', '.gif']
+            if not self.file_path.text():
+                print("未選擇範本檔案")
+                QMessageBox.warning(self, "警告", "請選擇範本檔案")
+                return
             
-            # 如果檔名已經包含副檔名
-            if any(photo_name.lower().endswith(ext) for ext in possible_extensions):
-                query = f"name = '{photo_name}' and '{folder_id}' in parents and trashed = false"
+            # 決定要產生的課程分類
+            if self.batch_mode_combo.currentData() == 'course':
+                if not self.course_combo.currentText():
+                    QMessageBox.warning(self, "警告", "請選擇課程")
+                    return
+                course_choices = [(self.course_combo.currentText(), self.course_combo.currentData())]
+                job_label = f"批次產生（{self.course_combo.currentText()}）"
             else:
-                # 如果檔名不包含副檔名，使用 OR 條件搜尋所有可能的副檔名
-                extension_conditions = [f"name = '{photo_name}{ext}'" for ext in possible_extensions]
-                query = f"({' or '.join(extension_conditions)}) and '{folder_id}' in parents and trashed = false"
+                course_choices = self.course_manager.course_type_choices()
+                job_label = "批次產生（所有課程）"
             
-            results = drive_service.files().list(
-                q=query,
-                fields="files(id, name)",
-                pageSize=1
-            ).execute()
+            # 在介面執行緒中先取好資料，背景執行緒不會讀取資料管理器
+            items = build_batch_items(self.teacher_manager, self.course_manager, course_choices, self.file_path.text())
             
-            matching_files = results.get('files', [])
-            
-            if not matching_files:
-                print(f"找不到檔案：{photo_name}")
+            if not items:
+                QMessageBox.warning(self, "警告", "沒有符合的教師")
                 return
             
-            file_id = matching_files[0]['id']
-            file_name = matching_files[0]['name']
-            
-            # 更新儲存路徑以含正確的副檔名
-            save_path = os.path.splitext(save_path)[0] + os.path.splitext(file_name)[1]
-            
-            # 下載檔案
-            request = drive_service.files().get_media(fileId=file_id)
-            fh = io.BytesIO()
-            downloader = MediaIoBaseDownload(fh, request)
-            
-            done = False
-            while done is False:
-                status, done = downloader.next_chunk()
-            
-            # 儲存檔案
-            fh.seek(0)
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, 'wb') as f:
-                f.write(fh.read())
+            job = {
+                'id': self.next_job_id,
+                'label': job_label,
+                'template_path': self.file_path.text(),
+                'items': items,
+                'workers': self.RENDER_WORKERS
+            }
+            self.next_job_id += 1
+            self.pending_jobs[job['id']] = f"{job_label} 0/{len(items)}"
+            self._ensure_document_worker()
+            self.document_worker.submit(job)
+            print(f"已加入產生佇列：{job_label}，共 {len(items)} 份")
+            self.update_job_status()
             
         except Exception as e:
-            print(f"下載照片失敗 {photo_name}: {str(e)}")
-            if hasattr(e, 'resp') and hasattr(e.resp, 'status'):
-                print(f"HTTP狀態碼：{e.resp.status}")
+            error_msg = f"批次產生失敗：{str(e)}\n錯誤類型：{type(e)}"
+            print(error_msg)
+            QMessageBox.critical(self, "錯誤", error_msg)
+    
+    def _ensure_document_worker(self):
+        if self.document_thread is not None:
+            return
+        self.document_thread = QThread(self)
+        self.document_worker = DocumentJobWorker()
+        self.document_worker.moveToThread(self.document_thread)
+        self.document_thread.started.connect(self.document_worker.run)
+        self.document_worker.job_started.connect(self.on_job_started)
+        self.document_worker.job_finished.connect(self.on_job_finished)
+        self.document_worker.job_failed.connect(self.on_job_failed)
+        self.document_worker.batch_progress.connect(self.on_batch_progress)
+        self.document_worker.batch_finished.connect(self.on_batch_finished)
+        self.document_thread.finished.connect(self.document_worker.deleteLater)
+        self.document_thread.start()
+    
+    def _stop_document_thread(self):
+        if self.document_thread is not None:
+            # 等待目前這份文件完成，排隊中的工作直接捨棄
+            self.document_worker.stop()
+            self.document_thread.quit()
+            self.document_thread.wait()
+            self.document_thread = None
+            self.document_worker = None
+    
+    def on_job_started(self, job_id, label):
+        self.pending_jobs[job_id] = f"{label}（產生中）"
+        self.update_job_status()
+    
+    def on_job_finished(self, job_id, label, output_path, elapsed):
+        self.pending_jobs.pop(job_id, None)
+        self.update_job_status()
+        self.show_toast(f"文件已產生：{output_path}")
+    
+    def on_job_failed(self, job_id, label, error_msg):
+        self.pending_jobs.pop(job_id, None)
+        self.update_job_status()
+        self.show_toast(f"{label}\n{error_msg}", error=True, duration=8000)
+    
+    def on_batch_progress(self, job_id, completed, total, label):
+        self.pending_jobs[job_id] = f"批次產生 {completed}/{total}：{label}"
+        self.update_job_status()
+    
+    def on_batch_finished(self, job_id, label, summary):
+        self.pending_jobs.pop(job_id, None)
+        self.update_job_status()
+        message = (f"{label}完成：成功 {summary['succeeded']}/{summary['total']} 份，"
+                   f"耗時 {summary['elapsed']:.1f} 秒（每分鐘 {summary['per_minute']:.1f} 份）")
+        if summary['workers'] > 1:
+            message += f"\n使用 {summary['workers']} 個行程"
+
+        if summary['failed']:
+            failed_lines = [f"{item_label}：{error}" for item_label, error in summary['failed'][:5]]
+            if len(summary['failed']) > 5:
+                failed_lines.append(f"...另有 {len(summary['failed']) - 5} 份失敗")
+            self.show_toast(message + "\n失敗：\n" + "\n".join(failed_lines), error=True, duration=10000)
+        else:
+            self.show_toast(message, duration=6000)
+    
+    def update_job_status(self):
+        if not self.pending_jobs:
+            self.job_status_label.setText("沒有進行中的文件")
+        else:
+            lines = [f"待處理文件：{len(self.pending_jobs)} 份"]
+            lines.extend(self.pending_jobs.values())
+            self.job_status_label.setText("\n".join(lines))
+    
+    def show_toast(self, message, error=False, duration=4000):
+        toast = ToastNotification(self, message, error=error, duration=duration)
+        toast.destroyed.connect(lambda: self._remove_toast(toast))
+        self.toasts.append(toast)
+        self._layout_toasts()
+        toast.show()
+    
+    def _remove_toast(self, toast):
+        if toast in self.toasts:
+            self.toasts.remove(toast)
+            self._layout_toasts()
+    
+    def _layout_toasts(self):
+        # 由視窗底部往上依序排列
+        bottom = self.geometry().bottom() - 40
+        for toast in reversed(self.toasts):
+            bottom -= toast.height()
+            toast.move(self.geometry().left() + (self.width() - toast.width()) // 2, bottom)
+            bottom -= 6
     
     def update_teacher_list(self):
         self.teacher_combo.clear()
@@ -700,295 +893,11 @@ class TeacherDocApp(QMainWindow):
         current = self.isActiveWindow()
         self.setWindowFlags(self.windowFlags() | Qt.WindowStaysOnTopHint if not current else self.windowFlags() & ~Qt.WindowStaysOnTopHint)
     
-    def update_data(self):
-        try:
-            print("開始更新資料...")
-            
-            # 清除所有現有資料
-            self.clear_all_data()
-                       
-            # 更新師資資料
-            self.import_teacher_data_from_google()
-            print("師資資料更新成")
-            
-            # 更新課程資料
-            self.import_course_data_from_google()
-            print("課程資料更新完成")
-            
-        except Exception as e:
-            print(f"更新過程發生錯誤：{str(e)}")
-            QMessageBox.critical(self, "錯誤", f"更新失敗：{str(e)}")
-    
-    def clear_all_data(self):
-        # 清除 JSON 檔案
-        if os.path.exists('teachers.json'):
-            os.remove('teachers.json')
-        if os.path.exists('courses.json'):
-            os.remove('courses.json')
-        
-        # 清除圖片資料夾
-        if os.path.exists('images'):
-            shutil.rmtree('images')
-        os.makedirs('images/teachers', exist_ok=True)
-        os.makedirs('images/courses', exist_ok=True)
-        
-        # 重置資料管理器
-        self.teacher_manager = TeacherDataManager()
-        self.course_manager = CourseDataManager()
-    
-    def import_teacher_data_from_google(self):
-        try:
-            print("取師資料...")
-            # 取得使用者地區
-            login_sheet = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='login!B2:B'
-            ).execute()
-            user_region = login_sheet.get('values', [[None]])[0][0]
-            print(f"使用者地區：{user_region}")
-            
-            # 讀取資資料
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='師資!A2:V'
-            ).execute()
-            values = result.get('values', [])
-            
-            # 清除現有資料
-            if os.path.exists('teachers.json'):
-                os.remove('teachers.json')
-            if os.path.exists('images/teachers'):
-                shutil.rmtree('images/teachers')
-                os.makedirs('images/teachers')
-            
-            # 建立 Drive 服務
-            drive_service = build('drive', 'v3', credentials=self.creds)
-            # 確保資料夾存在
-            if not os.path.exists('images/teachers'):
-                os.makedirs('images/teachers')
-            if not os.path.exists('images/courses'):
-                os.makedirs('images/courses')
-
-            # 設正確的資料夾 ID（確認這是正確的資料夾 ID）
-            folder_id = "1I_LHNBh8pDMJRbtRmQRblqumIZ9vayfa"
-            
-            # 處理每一筆教師資料
-            for row in values:
-                try:
-                    if len(row) > 0 and row[0] != user_region:
-                        continue
-                    
-                    # 確保姓名欄位存在
-                    name = row[1] if len(row) > 1 else ''
-                    
-                    # 使用預設值處理所有欄位
-                    teacher_data = {
-                        'region': row[0] if len(row) > 0 else '',      # 地區 (A欄)
-                        'name': row[1] if len(row) > 1 else '',        # 姓名 (B欄)
-                        'nickname': row[2] if len(row) > 2 else '',    # 綽號 (C欄)
-                        'photo': '',                                   # 大頭照 (D欄)
-                        'unit': row[4] if len(row) > 4 else '',       # 申請單位 (E欄)
-                        'birth': row[5] if len(row) > 5 else '',      # 出生日期 (F欄)
-                        'gender': row[6] if len(row) > 6 else '',     # 性別 (G欄)
-                        'mobile': row[7] if len(row) > 7 else '',     # 手機 (H欄)
-                        'idno': row[8] if len(row) > 8 else '',       # 身分證字號 (I欄)
-                        'address': row[9] if len(row) > 9 else '',    # 通訊地址 (J欄)
-                        'email': row[10] if len(row) > 10 else '',    # Email (K欄)
-                        'line': row[11] if len(row) > 11 else '',     # Line ID (L欄)
-                        'skill': row[12] if len(row) > 12 else '',    # 專長 (M欄)
-                        'experience': row[13] if len(row) > 13 else '',# 教學經驗 (N欄)
-                        'history': row[14] if len(row) > 14 else '',  # 經歷 (O欄)
-                        'education': row[15] if len(row) > 15 else '', # 最高學歷 (P欄)
-                        'job': row[16] if len(row) > 16 else '',      # 現職 (Q欄)
-                        'id_front': '',                               # 身分證正面 (R欄)
-                        'id_back': '',                                # 身分證反面 (S欄)
-                        'diploma': '',                                # 畢業證書 (T欄)
-                        'other_certs': [],                           # 其他證明 (U欄)
-                        'course_type': row[21] if len(row) > 21 else '' # 課程分類 (V欄)
-                    }
-                    
-                    # 修改照欄位對應
-                    photo_fields = {
-                        3: ('photo', '大頭照'),       # D欄
-                        17: ('id_front', '身分證正'),   # S欄
-                        18: ('id_back', '身分證反'),    # T欄
-                        19: ('diploma', '畢業證書')     # U欄
-                    }
-                    
-                    # 修改這部分，加入錯誤處理
-                    for col_idx, (field_name, photo_type) in photo_fields.items():
-                        try:
-                            if len(row) > col_idx and row[col_idx]:
-                                try:
-                                    # 使用教師姓名和照片類型建立檔名
-                                    photo_name = f"{row[1]}{photo_type}"  # 例如：林顯庭大頭照
-                                    save_path = f'images/teachers/{photo_name}'
-                                    self._download_and_save_photo(
-                                        drive_service, 
-                                        folder_id, 
-                                        photo_name, 
-                                        save_path
-                                    )
-                                    teacher_data[field_name] = save_path
-                                except Exception as photo_error:
-                                    print(f"跳過照片 {field_name}: {str(photo_error)}")
-                                    teacher_data[field_name] = ''
-                        except Exception as field_error:
-                            print(f"處理照片欄位 {field_name} 時發生錯誤: {str(field_error)}")
-                            teacher_data[field_name] = ''
-                    
-                    # 處理其他證明
-                    try:
-                        teacher_name = row[1]
-                        # 修改搜尋條件，使用 contains 和 and 組合
-                        query = f"name contains '{teacher_name}其他證明_' and '{folder_id}' in parents and trashed = false"
-                        results = drive_service.files().list(
-                            q=query,
-                            fields="files(id, name)",
-                            orderBy="name"  # 加入排序，確保檔案順序
-                        ).execute()
-                        
-                        other_certs = []
-                        for file in results.get('files', []):
-                            try:
-                                photo_name = file['name']
-                                save_path = f'images/teachers/{photo_name}'
-                                self._download_and_save_photo(drive_service, folder_id, photo_name, save_path)
-                                other_certs.append(save_path)
-                            except Exception as cert_error:
-                                print(f"跳過其他證明照片 {photo_name}: {str(cert_error)}")
-                                continue
-                        
-                        teacher_data['other_certs'] = other_certs
-                    except Exception as other_certs_error:
-                        print(f"處理其他證明時發生錯誤: {str(other_certs_error)}")
-                        teacher_data['other_certs'] = []
-                    
-                    # 只有當姓名不為空時才新增教師資料
-                    if name:
-                        self.teacher_manager.add_teacher(teacher_data)
-                    else:
-                        print(f"跳過沒有姓名的資料")
-                    
-                except Exception as row_error:
-                    print(f"處理教師資料時發生錯誤，跳過此筆資料: {str(row_error)}")
-                    continue
-            
-            self.update_teacher_list()
-            
-        except Exception as e:
-            print(f"更新師資資料時發生錯誤：{str(e)}")
-            QMessageBox.critical(self, "錯誤", f"更新失敗：{str(e)}")
-
-    def import_course_data_from_google(self):
-        try:
-            print("讀取課程資料...")
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=self.SPREADSHEET_ID,
-                range='課程!A2:P'  # 修改範圍到 O 欄
-            ).execute()
-            values = result.get('values', [])
-            print(f"讀取到 {len(values)} 筆課程資料")
-            
-            # 清除現有資料
-            if os.path.exists('courses.json'):
-                os.remove('courses.json')
-            if os.path.exists('images/courses'):
-                shutil.rmtree('images/courses')
-                os.makedirs('images/courses')
-            
-            # 建立 Drive 服務
-            drive_service = build('drive', 'v3', credentials=self.creds)
-            # 確保資料夾存在
-            if not os.path.exists('images/teachers'):
-                os.makedirs('images/teachers')
-            if not os.path.exists('images/courses'):
-                os.makedirs('images/courses')
-
-            # 設定正確的資料夾 ID（請確認這是正確的料夾 ID）
-            folder_id = "1I_LHNBh8pDMJRbtRmQRblqumIZ9vayfa"
-            
-            # 處理每一筆課程資料
-            for row in values:
-                try:
-                    course_data = {
-                        'course_name': row[0] if len(row) > 0 else '',     # 社團名稱 (A欄)
-                        'intro': row[1] if len(row) > 1 else '',           # 課程介紹 (B欄)
-                        'material_fee': row[2] if len(row) > 2 else '',    # 材料費 (C欄)
-                        'reason': row[3] if len(row) > 3 else '',          # 原因 (D欄)
-                        'target': row[4] if len(row) > 4 else '',          # 教學目標 (E欄)
-                        'course_topic': row[5] if len(row) > 5 else '',    # 課程主題 (F欄) - 新增
-                        'content': row[6] if len(row) > 6 else '',         # 課程內容 (G欄)
-                        'photos': [],                                      # 課程照片 (H欄)
-                        'price_list_name': row[8] if len(row) > 8 else '', # 報價單品名 (I欄)
-                        'price_list_unit': row[9] if len(row) > 9 else '', # 報價單單位 (J欄)
-                        'price_list_quantity': row[10] if len(row) > 10 else '', # 報價單數量 (K欄)
-                        'price_list_price': row[11] if len(row) > 11 else '',    # 報價單單價 (L欄)
-                        'price_list_amount': row[12] if len(row) > 12 else '',   # 報價單預計金額 (M欄)
-                        'price_list_usage': row[13] if len(row) > 13 else '',    # 報價單用途說明 (N欄)
-                        'bank_account': '',                                      # 公司存摺 (O欄)
-                        'course': row[15] if len(row) > 15 else ''              # 課程分類 (P欄)
-                    }
-                    
-                    # 處理課程照片
-                    if len(row) > 7:
-                        try:
-                            # 從課程分類建立搜尋條件
-                            course_type = row[15].strip() if len(row) > 15 else ''  # 使用 P 欄的課程分類
-                            if course_type:  # 只有當課程分類存在時才處理
-                                # 修改搜尋條件，使用課程分類名稱
-                                query = f"name contains '{course_type}_' and '{folder_id}' in parents and trashed = false"
-                                results = drive_service.files().list(
-                                    q=query,
-                                    fields="files(id, name)",
-                                    orderBy="name"  # 加入排序，確保檔案順序
-                                ).execute()
-                                
-                                for file in results.get('files', []):
-                                    try:
-                                        photo_name = file['name']
-                                        # 確認檔名格式是否符合 課程分類_數字 的格式
-                                        name_parts = photo_name.rsplit('_', 1)
-                                        if len(name_parts) == 2 and name_parts[1].split('.')[0].isdigit():
-                                            save_path = f'images/courses/{photo_name}'
-                                            self._download_and_save_photo(drive_service, folder_id, photo_name, save_path)
-                                            course_data['photos'].append(save_path)
-                                    except Exception as photo_error:
-                                        print(f"跳過照片 {photo_name}: {str(photo_error)}")
-                        except Exception as split_error:
-                            print(f"處理照片列表時發生錯誤: {str(split_error)}")
-                    
-                    # 處司存摺（O欄）
-                    if len(row) > 14 and row[14]:
-                        try:
-                            save_path = f'images/courses/{row[14]}'
-                            self._download_and_save_photo(drive_service, folder_id, row[14], save_path)
-                            course_data['bank_account'] = save_path
-                        except Exception as bank_error:
-                            print(f"跳過公司存摺照片: {str(bank_error)}")
-                            course_data['bank_account'] = ''
-                    
-                    self.course_manager.add_course(course_data)
-                    
-                except Exception as row_error:
-                    print(f"處理課程資料時發生錯誤，跳過此筆資料: {str(row_error)}")
-                    continue
-                        
-        except Exception as e:
-            print(f"更新課程資料時發生錯誤：{str(e)}")
-            QMessageBox.critical(self, "錯誤", f"更新失敗：{str(e)}")
-
     def update_course_list(self):
         self.course_combo.clear()
         
-        # 收集所有不重複的課程分類
-        course_types = {}  # 改用字典儲存課分類和ID的對應關係
-        for course_id, cdata in self.course_manager.courses.items():
-            if 'course' in cdata and cdata['course']:
-                course_types[cdata['course']] = course_id
-        
-        # 將課程分類加入下拉選單
-        for course_type, course_id in sorted(course_types.items()):
+        # 將不重複的課程分類加入下拉選單
+        for course_type, course_id in self.course_manager.course_type_choices():
             self.course_combo.addItem(course_type, course_id)  # 使用課程ID作為數據
 
     def update_teacher_list_by_course(self):
@@ -999,18 +908,8 @@ class TeacherDocApp(QMainWindow):
             if not selected_course:
                 return
             
-            # 取得所有教師資料
-            with open('teachers.json', 'r', encoding='utf-8') as f:
-                teachers = json.load(f)
-            
-            # 篩選符合課程的教師
-            matching_teachers = []
-            for teacher_id, teacher in teachers.items():
-                # 將課程類型拆分為列表
-                course_types = [ct.strip() for ct in teacher.get('course_type', '').split('、')]
-                # 如果選擇的課程在教師的課程類型列表中
-                if selected_course in course_types:
-                    matching_teachers.append((teacher_id, teacher['name']))
+            # 從課程分類索引取得符合課程的教師
+            matching_teachers = self.teacher_manager.teachers_for_course(selected_course)
             
             # 將符合的教師加入下拉單
             for teacher_id, name in matching_teachers:
@@ -1022,520 +921,33 @@ class TeacherDocApp(QMainWindow):
 
     def verify_drive_api(self):
         try:
-            drive_service = build('drive', 'v3', credentials=self.creds)
             # 測試 API 是否正常運作
-            drive_service.files().list(pageSize=1).execute()
+            with self.google_clients.lease('drive', 'v3') as drive_service:
+                drive_service.files().list(pageSize=1).execute()
             print("Google Drive API 驗證成功")
             return True
         except Exception as e:
             print(f"Google Drive API 驗證敗：{str(e)}")
             return False
 
-class TeacherDataManager:
-    def __init__(self):
-        self.teachers = self._load_teachers()
-    
-    def _load_teachers(self):
-        if os.path.exists('teachers.json'):
-            with open('teachers.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
-    
-    def add_teacher(self, teacher_data):
-        teacher_id = str(len(self.teachers) + 1)
-        self.teachers[teacher_id] = teacher_data
-        self._save_teachers()
-        
-    def _save_teachers(self):
-        with open('teachers.json', 'w', encoding='utf-8') as f:
-            json.dump(self.teachers, f, ensure_ascii=False, indent=2)
-
-class CourseDataManager:
-    def __init__(self):
-        self.courses = self._load_courses()
-    
-    def _load_courses(self):
-        if os.path.exists('courses.json'):
-            with open('courses.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
-    
-    def add_course(self, course_data):
-        course_id = str(len(self.courses) + 1)
-        self.courses[course_id] = course_data
-        self._save_courses()
-    
-    def _save_courses(self):
-        with open('courses.json', 'w', encoding='utf-8') as f:
-            json.dump(self.courses, f, ensure_ascii=False, indent=2)
-
-class DocumentProcessor:
-    def __init__(self, template_path):
-        self.template_path = template_path
-        self.file_type = os.path.splitext(template_path)[1].lower()
-    
-    def process_document(self, data, output_path):
-        try:
-            print("開始處理文件...")
-            file_ext = os.path.splitext(self.template_path)[1].lower()
-            
-            # 如果是 .doc 格式，先轉換為 .docx
-            if file_ext == '.doc':
-                print("轉換 DOC 到 DOCX 格式...")
-                word = win32com.client.Dispatch('Word.Application')
-                doc = word.Documents.Open(self.template_path)
-                docx_path = os.path.splitext(self.template_path)[0] + '.docx'
-                doc.SaveAs2(docx_path, FileFormat=16)  # 16 代表 .docx 格式
-                doc.Close()
-                word.Quit()
-                self.template_path = docx_path
-                file_ext = '.docx'
-            
-            # 如果是 .odt 格式，先轉換為 .docx
-            elif file_ext == '.odt':
-                print("轉換 ODT 到 DOCX 格式...")
-                from odf import text, teletype
-                from odf.opendocument import load
-                from subprocess import run
-                
-                # 使用 LibreOffice 進行轉換
-                docx_path = os.path.splitext(self.template_path)[0] + '.docx'
-                result = run([
-                    'soffice',
-                    '--headless',
-                    '--convert-to', 'docx',
-                    '--outdir', os.path.dirname(self.template_path),
-                    self.template_path
-                ])
-                
-                if result.returncode != 0:
-                    raise Exception("ODT 轉換失敗")
-                
-                self.template_path = docx_path
-                file_ext = '.docx'
-            
-            # 處理 .docx 格式
-            doc = Document(self.template_path)
-            
-            # 修改這裡：在檔名中加入時間戳記，確保檔名唯一
-            timestamp = datetime.now().strftime('%Y%m%d')
-            output_filename = f"{data.get('course_name', 'unknown')} - {data.get('name', 'unknown')}_{timestamp}{file_ext}"
-            output_path = os.path.join(os.path.dirname(self.template_path), output_filename)
-            
-            # 處理表格中的標記
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if '@content' in cell.text:
-                            self._replace_course_table(table, data)
-                            break
-                        elif '@course_topic' in cell.text:
-                            self._replace_course_topic_table(table, data)
-                            break
-                        elif '@price_list_table' in cell.text:
-                            self._replace_price_list_table(table, data)
-                            break
-                        elif '@photos' in cell.text:
-                            self._replace_photos_table(table, data)
-                            break
-                        else:
-                            self._process_cell(cell, data)
-            
-            # 處理段落中的標記
-            for paragraph in doc.paragraphs:
-                self._process_paragraph(paragraph, data)
-            
-            print(f"儲存文件到 {output_path}...")
-            doc.save(output_path)
-            
-            # 如果需要輸出為原始格式
-            if file_ext in ['.doc', '.odt']:
-                print(f"轉換回 {file_ext} 格式...")
-                if file_ext == '.doc':
-                    word = win32com.client.Dispatch('Word.Application')
-                    doc = word.Documents.Open(output_path)
-                    doc_path = os.path.splitext(output_path)[0] + '.doc'
-                    doc.SaveAs2(doc_path, FileFormat=0)  # 0 代表 .doc 格式
-                    doc.Close()
-                    word.Quit()
-                    os.remove(output_path)  # 移除中間的 .docx 檔案
-                    output_path = doc_path
-                elif file_ext == '.odt':
-                    odt_path = os.path.splitext(output_path)[0] + '.odt'
-                    result = run([
-                        'soffice',
-                        '--headless',
-                        '--convert-to', 'odt',
-                        '--outdir', os.path.dirname(output_path),
-                        output_path
-                    ])
-                    if result.returncode != 0:
-                        raise Exception("轉換回 ODT 失敗")
-                    os.remove(output_path)  # 移除中間的 .docx 檔案
-                    output_path = odt_path
-            
-            return output_path
-            
-        except Exception as e:
-            print(f"處理文件時發生錯誤：{str(e)}")
-            raise
-    
-    def _process_cell(self, cell, data):
-        try:
-            for key, value in data.items():
-                marker = f"@{key}"
-                if marker in cell.text:
-                    print(f"處理標記 {marker}...")
-                    if isinstance(value, list) and key == 'other_certs':
-                        # 處理多圖片
-                        print(f"開始處理其他證明照片，共 {len(value)} 張")
-                        cell.text = cell.text.replace(marker, '')
-                        paragraph = cell.paragraphs[0]
-                        
-                        for img_path in value:
-                            print(f"處理照片：{img_path}")
-                            # 檢查檔案是否存在（包含各種可能的副檔名）
-                            possible_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-                            full_path = None
-                            
-                            # 先檢查原始路徑
-                            if os.path.exists(img_path):
-                                full_path = img_path
-                            else:
-                                # 嘗試不同的副檔名
-                                base_path = os.path.splitext(img_path)[0]
-                                for ext in possible_extensions:
-                                    test_path = f"{base_path}{ext}"
-                                    if os.path.exists(test_path):
-                                        full_path = test_path
-                                        break
-                            
-                            if full_path and os.path.exists(full_path):
-                                print(f"插入照片：{full_path}")
-                                run = paragraph.add_run()
-                                run.add_picture(full_path, width=Inches(2))
-                                run.add_text('\n')  # 在每張照片後添加換行
-                            else:
-                                print(f"找不到照片：{img_path}")
-                                
-                    elif key in ['photo', 'id_front', 'id_back', 'diploma', 'bank_account'] and value:
-                        # 處理單張圖片
-                        cell.text = cell.text.replace(marker, '')
-                        paragraph = cell.paragraphs[0]
-                        
-                        # 檢查檔案是否存在（包含各種可能的副檔名）
-                        possible_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-                        full_path = None
-                        for ext in possible_extensions:
-                            test_path = f"{value}{ext}"
-                            if os.path.exists(test_path):
-                                full_path = test_path
-                                break
-                        
-                        if full_path and os.path.exists(full_path):
-                            run = paragraph.add_run()
-                            run.add_picture(full_path, width=Inches(2))
-                    else:
-                        # 處理文字
-                        cell.text = cell.text.replace(marker, str(value) if value else '')
-        except Exception as e:
-            print(f"處理儲存格時發生錯誤：{str(e)}")
-            print(f"錯誤類型：{type(e)}")
-            print(f"錯誤詳情：{e.__dict__}")
-            raise
-    
-    def _process_paragraph(self, paragraph, data):
-        try:
-            for key, value in data.items():
-                marker = f"@{key}"
-                if marker in paragraph.text:
-                    print(f"處理標記 {marker}...")
-                    if isinstance(value, list) and key == 'other_certs':
-                        # 處理多張圖片
-                        paragraph.text = paragraph.text.replace(marker, '')
-                        for img_path in value:
-                            # 檢查檔案是否存在（包含各種可能的副檔名）
-                            possible_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-                            full_path = None
-                            for ext in possible_extensions:
-                                test_path = f"{img_path}{ext}"
-                                if os.path.exists(test_path):
-                                    full_path = test_path
-                                    break
-                            
-                            if full_path and os.path.exists(full_path):
-                                run = paragraph.add_run()
-                                run.add_picture(full_path, width=Inches(2))
-                                run.add_text('\n')
-                    elif key in ['photo', 'id_front', 'id_back', 'diploma', 'bank_account'] and value:
-                        # 處理單張圖片
-                        paragraph.text = paragraph.text.replace(marker, '')
-                        
-                        # 檢查檔案是否存在（包含各種可能的副檔名）
-                        possible_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-                        full_path = None
-                        for ext in possible_extensions:
-                            test_path = f"{value}{ext}"
-                            if os.path.exists(test_path):
-                                full_path = test_path
-                                break
-                        
-                        if full_path and os.path.exists(full_path):
-                            run = paragraph.add_run()
-                            run.add_picture(full_path, width=Inches(2))
-                    else:
-                        # 處理文字
-                        paragraph.text = paragraph.text.replace(marker, str(value) if value else '')
-        except Exception as e:
-            print(f"處理段落時發生錯誤：{str(e)}")
-            raise
-    
-    def _replace_course_table(self, table, data):
-        try:
-            print("開始處理課程��容表格...")
-            
-            # 找到標記所在的儲存格位
-            start_row = 0
-            start_col = 0
-            found = False
-            for i, row in enumerate(table.rows):
-                for j, cell in enumerate(row.cells):
-                    if '@content' in cell.text:
-                        start_row = i
-                        start_col = j
-                        found = True
-                        # 清除標記
-                        cell.text = cell.text.replace('@content', '')
-                        break
-                if found:
-                    break
-            
-            if not found:
-                print("找不到課程內容表格標記")
-                return
-            
-            # 取得課程內容
-            content = data.get('content', '')
-            if not content:
-                print("找不到課程內容")
-                return
-            
-            # 將課程內容分行
-            content_lines = content.split('\n')
-            print(f"課程內共 {len(content_lines)} 行")
-            
-            # 確保表格有足夠的列數
-            current_row = start_row
-            for content_line in content_lines:
-                if current_row >= len(table.rows):
-                    table.add_row()
-                
-                # 從指定的欄位開始填入
-                if start_col < len(table.rows[current_row].cells):
-                    table.rows[current_row].cells[start_col].text = content_line.strip()
-                current_row += 1
-            
-            print("課程內容表格處理完成")
-            
-        except Exception as e:
-            print(f"處理課程內容表格時發生錯誤：{str(e)}")
-            raise
-    
-    def _replace_price_list_table(self, table, data):
-        try:
-            print("開始處理報價單表格...")
-            
-            # 找到標記所在的儲存格位
-            start_row = 0
-            start_col = 0
-            found = False
-            for i, row in enumerate(table.rows):
-                for j, cell in enumerate(row.cells):
-                    if '@price_list_table' in cell.text:
-                        start_row = i
-                        start_col = j
-                        found = True
-                        # 清除標記
-                        cell.text = cell.text.replace('@price_list_table', '')
-                        break
-                if found:
-                    break
-            
-            if not found:
-                print("找不到報價單表格標記")
-                return
-            
-            # 報價單欄位和對應的資料
-            price_list_items = [
-                ('price_list_name', '品項'),
-                ('price_list_unit', '單位'),
-                ('price_list_quantity', '數量'),
-                ('price_list_price', '單價'),
-                ('price_list_amount', '預計金額'),
-                ('price_list_usage', '用途說明')
-            ]
-            
-            # 填入報價單資料
-            current_row = start_row
-            for field, label in price_list_items:
-                if current_row < len(table.rows):
-                    value = data.get(field, '')
-                    # 從指定的欄位開始填
-                    if start_col < len(table.rows[current_row].cells):
-                        table.rows[current_row].cells[start_col].text = str(value)
-                    current_row += 1  # 移到下一行
-            
-            print("報價單表格處理完成")
-            
-        except Exception as e:
-            print(f"處理報價單表格時發生錯誤：{str(e)}")
-            raise
-    
-    def _replace_photos_table(self, table, data):
-        try:
-            print("開始處理課程照片表格...")
-            
-            # 找到標記所在的儲存格位置
-            start_row = 0
-            start_col = 0
-            found = False
-            for i, row in enumerate(table.rows):
-                for j, cell in enumerate(row.cells):
-                    if '@photos' in cell.text:
-                        start_row = i
-                        start_col = j
-                        found = True
-                        # 清除標記
-                        cell.text = cell.text.replace('@photos', '')
-                        break
-                if found:
-                    break
-            
-            if not found:
-                print("找不到課照片表格標記")
-                return
-            
-            # 取得照片列表
-            photos = data.get('photos', [])
-            if not photos:
-                print("找不到課程照片")
-                return
-            
-            # 解析照片資訊
-            photo_info = {}  # 用來儲存週次和對應的照片路徑
-            for photo_path in photos:
-                # 從檔名中提取週次資訊
-                base_name = os.path.basename(photo_path)
-                name_without_ext = os.path.splitext(base_name)[0]
-                
-                # 假設檔名格式為 "課程名稱_N"
-                try:
-                    week_num = int(name_without_ext.split('_')[-1])
-                    photo_info[week_num] = photo_path
-                except (ValueError, IndexError):
-                    print(f"無法從檔名 {base_name} 解析週次資訊")
-                    continue
-            
-            # 填入照片
-            current_row = start_row
-            week = 1
-            while current_row < len(table.rows):
-                if week in photo_info:
-                    photo_path = photo_info[week]
-                    # 檢查檔案是否存在（包含各種可能的副檔名）
-                    possible_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-                    full_path = None
-                    
-                    # 先檢查原始路徑
-                    if os.path.exists(photo_path):
-                        full_path = photo_path
-                    else:
-                        # 嘗試不同的副檔名
-                        base_path = os.path.splitext(photo_path)[0]
-                        for ext in possible_extensions:
-                            test_path = f"{base_path}{ext}"
-                            if os.path.exists(test_path):
-                                full_path = test_path
-                                break
-                    
-                    if full_path and os.path.exists(full_path):
-                        cell = table.rows[current_row].cells[start_col]
-                        cell.text = ''  # 清空儲存格
-                        paragraph = cell.paragraphs[0]
-                        run = paragraph.add_run()
-                        run.add_picture(full_path, width=Inches(2))
-                
-                current_row += 1
-                week += 1
-            
-            print("課程照片表格處理完成")
-            
-        except Exception as e:
-            print(f"處理課程照片表格時發生錯誤：{str(e)}")
-            raise
-    
-    def _replace_course_topic_table(self, table, data):
-        try:
-            print("開始處理課程主題表格...")
-            
-            # 找到標記所在的儲存格位置
-            start_row = 0
-            start_col = 0
-            found = False
-            for i, row in enumerate(table.rows):
-                for j, cell in enumerate(row.cells):
-                    if '@course_topic' in cell.text:
-                        start_row = i
-                        start_col = j
-                        found = True
-                        # 清除標記
-                        cell.text = cell.text.replace('@course_topic', '')
-                        break
-                if found:
-                    break
-            
-            if not found:
-                print("找不到課程主題表格標記")
-                return
-            
-            # 取得課程主題內容
-            topic = data.get('course_topic', '')
-            if not topic:
-                print("找不到課程主題內容")
-                return
-            
-            # 將課程主題分行
-            topic_lines = topic.split('\n')
-            print(f"課程主題共 {len(topic_lines)} 行")
-            
-            # 確保表格有足夠的列數
-            current_row = start_row
-            for topic_line in topic_lines:
-                if current_row >= len(table.rows):
-                    table.add_row()
-                
-                # 從指定的欄位開始填入
-                if start_col < len(table.rows[current_row].cells):
-                    table.rows[current_row].cells[start_col].text = topic_line.strip()
-                current_row += 1
-            
-            print("課程主題表格處理完成")
-            
-        except Exception as e:
-            print(f"處理課程主題表格時發生錯誤：{str(e)}")
-            raise
-
 def main():
     import sys
     
+    # 打包成執行檔後，批次產生的子行程需要這個呼叫才能正常啟動
+    multiprocessing.freeze_support()
+    
     try:
+        timer = StartupTimer()
         app = QApplication(sys.argv)
         
         # 設定應用程式樣式
         app.setStyle('Fusion')
+        timer.mark('建立 QApplication')
         
         # 建立並顯示主視窗
         window = TeacherDocApp()
+        timer.mark('建立視窗')
+        FirstPaintReporter(window, timer)
         window.show()
         
         # 執行應用程式
@@ -0,0 +1,137 @@
+# 以本機模擬的 Drive changes 端點測試變動偵測：下載失敗的照片在下次登入時重新下載
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import teacher_doc_core as core
+
+PHOTO = b'photo-bytes'
+
+class _Request:
+    def __init__(self, value):
+        self.value = value
+    
+    def execute(self):
+        return self.value
+
+class FakeChanges:
+    # 模擬 changes().getStartPageToken() 和 changes().list()，每次取得權杖時都推進
+    def __init__(self):
+        self.token = 0
+    
+    def getStartPageToken(self):
+        return _Request({'startPageToken': str(self.token)})
+    
+    def list(self, pageToken, **kwargs):
+        self.token += 1
+        return _Request({'changes': [], 'newStartPageToken': str(self.token)})
+
+class FakeDrive:
+    def __init__(self):
+        self.change_list = FakeChanges()
+    
+    def changes(self):
+        return self.change_list
+
+class FakeClients:
+    def sheets(self):
+        return None
+    
+    @contextmanager
+    def lease(self, name, version):
+        yield None
+
+class FakeLoginManager:
+    def __init__(self, teachers):
+        self.clients = FakeClients()
+        self.sheet_values = {
+            core.LoginManager.LOGIN_RANGE: [['code'], ['code', '台北']],
+            core.LoginManager.TEACHER_RANGE: teachers,
+            core.LoginManager.COURSE_RANGE: []
+        }
+
+class FlakyDownloadEngine(core.DriveDownloadEngine):
+    # 前 failures 次下載拋出 ConnectionError，之後寫入照片
+    failures = 0
+    
+    def _download_file(self, drive_service, file, save_path):
+        if FlakyDownloadEngine.failures > 0:
+            FlakyDownloadEngine.failures -= 1
+            raise ConnectionError("連線中斷")
+        save_path = self.local_path(file, save_path)
+        with open(save_path, 'wb') as f:
+            f.write(PHOTO)
+        return save_path
+
+class FakeSyncService(core.DataSyncService):
+    PHOTO_FILE = {'id': 'p1', 'name': '王一大頭照.jpg', 'size': str(len(PHOTO))}
+    
+    def _get_folder_index(self):
+        return core.DriveFolderIndex([self.PHOTO_FILE])
+    
+    def _create_download_engine(self, phase):
+        return FlakyDownloadEngine(None, max_workers=1, max_retries=0, cache=self.photo_cache, clients=self.clients)
+
+class ChangeDetectionTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.work_dir = tempfile.mkdtemp()
+        os.chdir(self.work_dir)
+        os.makedirs('images/teachers')
+        os.makedirs('images/courses')
+        self.drive = FakeDrive()
+        self.teachers = [['台北', '王一', '', '有']]
+        self.teacher_manager = core.TeacherDataManager()
+        self.course_manager = core.CourseDataManager()
+    
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+    
+    def login(self):
+        # 與 login_and_sync 相同：先偵測變動，有變動時才同步
+        service = FakeSyncService(
+            None,
+            self.teacher_manager,
+            self.course_manager,
+            login_manager=FakeLoginManager(self.teachers),
+            thumbnails=False,
+            change_feed=core.DriveChangeFeed(self.drive, core.DataSyncService.PHOTO_FOLDER_ID)
+        )
+        changes = service.detect_changes()
+        if changes['changed']:
+            service.sync(True, changes['photos'])
+        else:
+            service.mark_unchanged()
+        return changes['changed']
+    
+    def test_unchanged_sheet_skips_sync(self):
+        self.assertTrue(self.login())
+        self.assertFalse(self.login())
+        self.assertTrue(os.path.exists('images/teachers/王一大頭照.jpg'))
+    
+    def test_failed_download_is_retried(self):
+        # 先完成一次同步，之後的登入都從儲存的權杖讀取變動紀錄
+        self.teachers[:] = []
+        self.assertTrue(self.login())
+        self.assertIsNotNone(core.SyncState().get_page_token())
+        
+        self.teachers.append(['台北', '王一', '', '有'])
+        FlakyDownloadEngine.failures = 1
+        self.assertTrue(self.login())
+        self.assertFalse(os.path.exists('images/teachers/王一大頭照.jpg'))
+        self.assertEqual(core.SyncState().get_pending_photos(), {'王一大頭照.jpg'})
+        
+        # 試算表和照片資料夾都沒有變動，仍因下載失敗的照片而同步
+        self.assertTrue(self.login())
+        self.assertTrue(os.path.exists('images/teachers/王一大頭照.jpg'))
+        self.assertEqual(core.SyncState().get_pending_photos(), set())
+        self.assertFalse(self.login())
+
+if __name__ == '__main__':
+    unittest.main()